@@ -0,0 +1,267 @@
+"""
+Change-data-capture para SQLite.
+
+Triggers sobre las tablas vigiladas añaden un registro compacto
+(tabla, rowid, operación, seq) a `changelog` por cada INSERT/UPDATE/DELETE.
+Los consumidores (pipelines de Pathway, cachés...) leen a partir de su último
+seq con read_batch() y confirman con ack() hasta donde han mirado, aunque
+ninguno de los cambios fuera de sus tablas; lo que ya han confirmado todos los
+consumidores se borra. Un consumidor que deja de confirmar durante
+CHANGELOG_CONSUMER_TTL segundos se da de baja (también con
+unregister_consumer()), para que no retenga el log; si vuelve, ack() devuelve
+False y debe recargar todo y registrarse de nuevo.
+
+Las funciones reciben una conexión DB-API de SQLite (sqlite3.Connection o
+engine.raw_connection()).
+"""
+import time
+from typing import Iterable, NamedTuple, Optional, Sequence
+
+from .config import CHANGELOG_CONSUMER_TTL
+
+WATCHED_TABLES = ("appointment", "followuptask", "escalation")
+
+_OPS = (("INSERT", "I", "NEW"), ("UPDATE", "U", "NEW"), ("DELETE", "D", "OLD"))
+
+
+class Change(NamedTuple):
+    seq: int
+    table: str
+    row_id: int
+    op: str  # I | U | D
+
+
+class Batch(NamedTuple):
+    changes: list[Change]
+    # hasta dónde se ha leído el log (para ack(), haya o no cambios)
+    seq: int
+    # True si el lote se cortó por el límite
+    more: bool
+
+
+def install(conn, tables: Iterable[str] = WATCHED_TABLES) -> None:
+    """
+    Crea la tabla changelog, la de consumidores y los triggers (idempotente).
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS changelog (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS changelog_consumer (
+            name TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL DEFAULT 0,
+            last_ack REAL
+        )
+        """
+    )
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(changelog_consumer)")}
+    if "last_ack" not in columns:
+        conn.execute("ALTER TABLE changelog_consumer ADD COLUMN last_ack REAL")
+        # los que ya había cuentan como vistos ahora
+        conn.execute("UPDATE changelog_consumer SET last_ack = ?", (time.time(),))
+    for table in tables:
+        for event, op, ref in _OPS:
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS changelog_{table}_{op}
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO changelog (tbl, row_id, op)
+                    VALUES ('{table}', {ref}.id, '{op}');
+                END
+                """
+            )
+    conn.commit()
+
+
+def is_installed(conn) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'changelog'"
+    ).fetchone()
+    return row is not None
+
+
+def latest_seq(conn) -> int:
+    """
+    Último seq asignado (incluye los ya purgados).
+    """
+    row = conn.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'changelog'"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def register_consumer(conn, name: str, start_seq: Optional[int] = None) -> int:
+    """
+    Da de alta un consumidor (si no existía) y devuelve su posición.
+    Por defecto un consumidor nuevo empieza en el final del log.
+    """
+    if start_seq is None:
+        start_seq = latest_seq(conn)
+    conn.execute(
+        """
+        INSERT INTO changelog_consumer (name, last_seq, last_ack) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET last_ack = excluded.last_ack
+        """,
+        (name, start_seq, time.time()),
+    )
+    conn.commit()
+    row = conn.execute(
+        "SELECT last_seq FROM changelog_consumer WHERE name = ?", (name,)
+    ).fetchone()
+    return row[0]
+
+
+def unregister_consumer(conn, name: str) -> None:
+    """
+    Da de baja un consumidor: deja de retener el log.
+    """
+    conn.execute("DELETE FROM changelog_consumer WHERE name = ?", (name,))
+    _prune(conn)
+    conn.commit()
+
+
+def expire_consumers(conn, ttl: float = CHANGELOG_CONSUMER_TTL) -> list[str]:
+    """
+    Da de baja los consumidores sin ack() en los últimos `ttl` segundos
+    (0 = nunca). Devuelve sus nombres.
+    """
+    if not ttl:
+        return []
+    cutoff = time.time() - ttl
+    names = [
+        row[0]
+        for row in conn.execute(
+            "SELECT name FROM changelog_consumer WHERE last_ack < ?",
+            (cutoff,),
+        ).fetchall()
+    ]
+    if names:
+        conn.execute(
+            f"DELETE FROM changelog_consumer WHERE name IN ({', '.join('?' for _ in names)})",
+            names,
+        )
+    return names
+
+
+def read_changes(
+    conn,
+    after_seq: int,
+    tables: Optional[Sequence[str]] = None,
+    limit: int = 1000,
+) -> list[Change]:
+    """
+    Cambios con seq > after_seq, en orden. El llamante avanza su posición
+    con el seq del último cambio devuelto.
+    """
+    sql = "SELECT seq, tbl, row_id, op FROM changelog WHERE seq > ?"
+    params: list = [after_seq]
+    if tables:
+        sql += f" AND tbl IN ({', '.join('?' for _ in tables)})"
+        params.extend(tables)
+    sql += " ORDER BY seq LIMIT ?"
+    params.append(limit)
+    return [Change(*row) for row in conn.execute(sql, params).fetchall()]
+
+
+def read_batch(
+    conn,
+    after_seq: int,
+    tables: Optional[Sequence[str]] = None,
+    limit: int = 1000,
+) -> Batch:
+    """
+    Como read_changes(), pero dice también hasta qué seq se ha mirado: si
+    el lote no llega al límite es el final del log en el momento de leer,
+    aunque no haya cambios de `tables`. El consumidor avanza a batch.seq.
+    """
+    end = latest_seq(conn)
+    sql = "SELECT seq, tbl, row_id, op FROM changelog WHERE seq > ? AND seq <= ?"
+    params: list = [after_seq, end]
+    if tables:
+        sql += f" AND tbl IN ({', '.join('?' for _ in tables)})"
+        params.extend(tables)
+    sql += " ORDER BY seq LIMIT ?"
+    params.append(limit)
+    changes = [Change(*row) for row in conn.execute(sql, params).fetchall()]
+    if len(changes) == limit:
+        return Batch(changes, changes[-1].seq, True)
+    return Batch(changes, max(end, after_seq), False)
+
+
+def _prune(conn) -> None:
+    # sin consumidores nadie necesita el log (uno nuevo empieza en el final)
+    conn.execute(
+        """
+        DELETE FROM changelog
+        WHERE seq <= COALESCE(
+            (SELECT MIN(last_seq) FROM changelog_consumer),
+            (SELECT MAX(seq) FROM changelog)
+        )
+        """
+    )
+
+
+def ack(conn, name: str, seq: int) -> bool:
+    """
+    Confirma que el consumidor `name` ha procesado hasta `seq`, da de baja
+    los consumidores caducados y purga lo que ya han confirmado todos.
+    Devuelve False si `name` ya no estaba registrado (caducó): se ha podido
+    perder cambios, así que debe recargar y volver a registrarse.
+    """
+    cur = conn.execute(
+        """
+        UPDATE changelog_consumer SET last_seq = MAX(last_seq, ?), last_ack = ?
+        WHERE name = ?
+        """,
+        (seq, time.time(), name),
+    )
+    registered = cur.rowcount == 1
+    expire_consumers(conn)
+    _prune(conn)
+    conn.commit()
+    return registered
+
+
+def fetch_rows(
+    conn,
+    table: str,
+    columns: str,
+    ids: Sequence[int],
+    where: str = "",
+    params: Sequence = (),
+    chunk_size: int = 500,
+) -> list:
+    """
+    Lee las filas `ids` de `table` (en bloques, por el límite de parámetros
+    de SQLite). `where`/`params` permiten añadir un filtro extra,
+    p.ej. where="date >= ?", params=(day,).
+    """
+    ids = list(ids)
+    extra = f" AND {where}" if where else ""
+    rows = []
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        marks = ", ".join("?" for _ in chunk)
+        rows.extend(
+            conn.execute(
+                f"SELECT {columns} FROM {table} WHERE id IN ({marks}){extra}",
+                [*chunk, *params],
+            ).fetchall()
+        )
+    return rows
+
+
+def changed_ids(changes: Iterable[Change], table: str) -> list[int]:
+    """
+    Ids distintos de `table` que aparecen en `changes` (en orden de aparición).
+    """
+    return list(dict.fromkeys(c.row_id for c in changes if c.table == table))
@@ -0,0 +1,71 @@
+"""
+Enrutado de peticiones a la BD de su clínica (ver "Shards por clínica" en
+database.py).
+
+La clínica se indica con la cabecera X-Clinic-Id o con el prefijo
+/clinics/<id>/ delante de cualquier ruta (/clinics/7/appointments/slots).
+El prefijo se trata como root_path, así que los routers no cambian. La
+clínica queda en database.current_clinic durante toda la petición
+(dependencias, threadpool y tareas en segundo plano incluidas).
+"""
+import json
+
+from .database import UnknownClinic, current_clinic, get_engine
+
+CLINIC_HEADER = b"x-clinic-id"
+PATH_PREFIX = "/clinics/"
+
+
+async def _reject(send, status: int, detail: str) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+class ClinicRoutingMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        from_header = None
+        for name, value in scope.get("headers", ()):
+            if name == CLINIC_HEADER:
+                from_header = value.decode("latin-1").strip()
+                break
+
+        from_path = None
+        root_path = scope.get("root_path", "")
+        route_path = scope["path"][len(root_path):] if scope["path"].startswith(root_path) else scope["path"]
+        if route_path.startswith(PATH_PREFIX):
+            from_path = route_path[len(PATH_PREFIX):].split("/", 1)[0]
+            scope = dict(scope, root_path=f"{root_path}{PATH_PREFIX}{from_path}")
+
+        if from_header and from_path and from_header != from_path:
+            return await _reject(send, 400, "X-Clinic-Id does not match the /clinics/ prefix")
+
+        clinic_id = from_path or from_header or None
+        if clinic_id is None:
+            return await self.app(scope, receive, send)
+
+        try:
+            get_engine(clinic_id)
+        except UnknownClinic:
+            return await _reject(send, 404, "Clinic not found")
+
+        token = current_clinic.set(clinic_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_clinic.reset(token)
@@ -10,7 +10,7 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./healthcare.db")
 APARAVI_API_URL = os.getenv("APARAVI_API_URL", "")
 APARAVI_API_KEY = os.getenv("APARAVI_API_KEY", "")
 
-# Notifications (ej. Twilio, SendGrid, etc.) – de momento usamos print(),
+# Notifications (ej. Twilio, SendGrid, etc.) – de momento sólo se loguean,
 # pero dejamos las variables preparadas.
 SMS_PROVIDER_API_KEY = os.getenv("SMS_PROVIDER_API_KEY", "")
 EMAIL_PROVIDER_API_KEY = os.getenv("EMAIL_PROVIDER_API_KEY", "")
@@ -19,3 +19,68 @@ VOICE_PROVIDER_API_KEY = os.getenv("VOICE_PROVIDER_API_KEY", "")
 # Payments (Juspay o similar)
 PAYMENTS_BASE_URL = os.getenv("PAYMENTS_BASE_URL", "")
 PAYMENTS_API_KEY = os.getenv("PAYMENTS_API_KEY", "")
+
+# Planificador de follow-ups en proceso (sustituye al polling de /followups/run_once).
+# Apagado por defecto (desarrollo, tests, scripts): lo enciende el despliegue
+# (gunicorn_conf.py) o FOLLOWUP_SCHEDULER_ENABLED=1
+FOLLOWUP_SCHEDULER_ENABLED = os.getenv("FOLLOWUP_SCHEDULER_ENABLED", "0") == "1"
+
+# Triggers de change-data-capture (tabla changelog) para los consumidores
+# que reaccionan a cambios (pipelines de Pathway, cachés...)
+CHANGELOG_ENABLED = os.getenv("CHANGELOG_ENABLED", "0") == "1"
+# Segundos sin ack() tras los que se da de baja un consumidor (0 = nunca)
+CHANGELOG_CONSUMER_TTL = float(os.getenv("CHANGELOG_CONSUMER_TTL", "86400"))
+
+# Arranque rápido (workers autoescalados): no se toca el esquema al arrancar;
+# las migraciones se aplican antes con `python -m backend.migrations`
+FAST_START = os.getenv("FAST_START", "0") == "1"
+
+# Espera máxima (ms) de una escritura cuando otro worker tiene el fichero
+# SQLite bloqueado
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Cada cuánto mira el planificador de follow-ups si otros procesos
+# (workers, pipelines) han creado tareas
+FOLLOWUP_SCHEDULER_POLL_SECONDS = float(os.getenv("FOLLOWUP_SCHEDULER_POLL_SECONDS", "2"))
+
+# Shards por clínica: con un directorio, cada clínica tiene su propia BD
+# ({dir}/clinic_<id>.db) elegida por X-Clinic-Id o /clinics/<id>/...
+CLINIC_DATABASE_DIR = os.getenv("CLINIC_DATABASE_DIR", "")
+# Engines de clínica abiertos a la vez por proceso (LRU)
+CLINIC_ENGINE_CACHE_SIZE = int(os.getenv("CLINIC_ENGINE_CACHE_SIZE", "32"))
+
+# Días pasados que se quedan en las tablas vivas antes de archivarse
+# (python -m backend.services.archive)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+
+# Días que se conservan los follow-ups ya ejecutados
+# (python -m backend.services.retention)
+FOLLOWUP_RETENTION_DAYS = int(os.getenv("FOLLOWUP_RETENTION_DAYS", "180"))
+
+# Cada cuánto relee cada worker la lista de espera entera (las altas nuevas
+# se leen antes de cada búsqueda; esto recoge las que vuelven a estar en espera)
+WAITLIST_RELOAD_SECONDS = float(os.getenv("WAITLIST_RELOAD_SECONDS", "60"))
+# Minutos que tiene el paciente para aceptar un hueco ofrecido; después se
+# ofrece al siguiente y él vuelve a la lista de espera
+WAITLIST_OFFER_MINUTES = float(os.getenv("WAITLIST_OFFER_MINUTES", "30"))
+
+# Reparto de follow-ups entre workers (services/followup_leases.py): cuánto
+# tiempo es suya una tarea reclamada y cuántas reclama de una vez
+FOLLOWUP_LEASE_SECONDS = float(os.getenv("FOLLOWUP_LEASE_SECONDS", "120"))
+FOLLOWUP_CLAIM_BATCH = int(os.getenv("FOLLOWUP_CLAIM_BATCH", "100"))
+# Espera antes de reintentar una tarea cuyo envío falló
+FOLLOWUP_RETRY_SECONDS = float(os.getenv("FOLLOWUP_RETRY_SECONDS", "30"))
+
+# Generador de mensajes de follow-up (services/llm_client.py): "templates",
+# "local" (modelo de prueba determinista) o "paquete.modulo:Clase"
+MESSAGE_GENERATOR = os.getenv("MESSAGE_GENERATOR", "templates")
+MESSAGE_LANGUAGE = os.getenv("MESSAGE_LANGUAGE", "en")
+# Mensajes distintos que se guardan ya generados (por tipo, idioma y contexto)
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "1024"))
+
+# Logs JSON (backend/logs.py): van a una cola que vacía un hilo escritor; si
+# se llena se descartan, nunca se espera. Los eventos de mucho volumen (envíos,
+# peticiones) se muestrean con LOG_SAMPLE_RATE; avisos y errores salen siempre.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
@@ -0,0 +1,55 @@
+"""
+Detección de escrituras de otros procesos con `PRAGMA data_version`.
+
+SQLite cambia el valor que ve una conexión cada vez que *otra* conexión
+(de este proceso o de otro worker) confirma cambios en el fichero. Leerlo
+no toca páginas de la BD, así que sirve para saber en microsegundos si una
+caché en memoria puede seguir usándose sin preguntar nada más.
+
+Cada consumidor usa su propio DataVersionWatcher: la conexión es sólo de
+lectura y nunca escribe, así que cualquier commit cuenta como cambio.
+"""
+import sqlite3
+import threading
+from typing import Any, Optional, Sequence
+
+
+class DataVersionWatcher:
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._last: Optional[int] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # autocommit: cada lectura ve el último commit, sin transacción abierta
+            self._conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, isolation_level=None
+            )
+        return self._conn
+
+    def changed(self) -> bool:
+        """
+        True si alguien ha confirmado cambios desde la llamada anterior
+        (la primera llamada siempre devuelve True).
+        """
+        with self._lock:
+            current = self._connection().execute("PRAGMA data_version").fetchone()[0]
+            changed = current != self._last
+            self._last = current
+            return changed
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> list[tuple]:
+        """
+        Lectura puntual con la misma conexión (no cuenta como cambio).
+        """
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._last = None
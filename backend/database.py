@@ -1,21 +1,267 @@
-from sqlmodel import SQLModel, create_engine, Session
-from .config import DATABASE_URL  # import relativo dentro de backend
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Optional, TypeVar
 
-engine = create_engine(
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlmodel import create_engine, Session
+from .config import (  # import relativo dentro de backend
+    CHANGELOG_ENABLED,
+    CLINIC_DATABASE_DIR,
+    CLINIC_ENGINE_CACHE_SIZE,
     DATABASE_URL,
-    echo=False,
+    SQLITE_BUSY_TIMEOUT_MS,
 )
 
-def init_db() -> None:
+# Ruta del archivo SQLite (para los pipelines que usan sqlite3 directamente)
+if DATABASE_URL.startswith("sqlite:///"):
+    DB_PATH = DATABASE_URL.replace("sqlite:///", "", 1)
+else:
+    # Fallback simple
+    DB_PATH = "healthcare.db"
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    Varios workers sobre el mismo fichero:
+    - WAL: las lecturas no bloquean ni esperan a las escrituras.
+    - busy_timeout: una escritura concurrente espera en vez de fallar
+      con "database is locked".
+    - synchronous=NORMAL: seguro con WAL y mucho más barato por commit.
     """
-    Crear tablas en la base de datos.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT_MS)}")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def _create_engine(url: str) -> Engine:
+    new_engine = create_engine(url, echo=False)
+    if url.startswith("sqlite:///"):
+        event.listen(new_engine, "connect", _sqlite_pragmas)
+    return new_engine
+
+
+engine = _create_engine(DATABASE_URL)
+
+
+# ---------- Shards por clínica ----------
+#
+# Con CLINIC_DATABASE_DIR cada clínica tiene su propio fichero
+# ({dir}/clinic_<id>.db), y por tanto su propio lock de escritura. La clínica
+# de la petición (cabecera X-Clinic-Id o prefijo /clinics/<id>/, ver main.py)
+# se guarda en `current_clinic`; sin clínica se usa la BD de DATABASE_URL.
+
+CLINIC_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+current_clinic: ContextVar[Optional[str]] = ContextVar("current_clinic", default=None)
+
+SHARDING_ENABLED = bool(CLINIC_DATABASE_DIR)
+
+
+class UnknownClinic(LookupError):
+    pass
+
+
+def clinic_db_path(clinic_id: str) -> str:
+    if not SHARDING_ENABLED:
+        raise UnknownClinic("clinic sharding is disabled (CLINIC_DATABASE_DIR)")
+    if not CLINIC_ID_RE.match(clinic_id):
+        raise UnknownClinic(f"invalid clinic id {clinic_id!r}")
+    return os.path.join(CLINIC_DATABASE_DIR, f"clinic_{clinic_id}.db")
+
+
+def list_clinics() -> list[str]:
     """
-    from . import models  # importa modelos dentro del paquete backend
-    SQLModel.metadata.create_all(engine)
+    Clínicas con BD creada, ordenadas.
+    """
+    if not SHARDING_ENABLED or not os.path.isdir(CLINIC_DATABASE_DIR):
+        return []
+    clinics = []
+    for name in os.listdir(CLINIC_DATABASE_DIR):
+        if name.startswith("clinic_") and name.endswith(".db"):
+            clinic_id = name[len("clinic_"):-len(".db")]
+            if CLINIC_ID_RE.match(clinic_id):
+                clinics.append(clinic_id)
+    return sorted(clinics)
+
+
+class EngineCache:
+    """
+    Engines de las clínicas, abiertos bajo demanda y como mucho `max_engines`
+    a la vez (LRU). Al expulsar uno se cierran sus conexiones libres; las que
+    estén en uso se cierran al devolverse.
+
+    Los callbacks de on_open() se llaman con (clínica, engine) cada vez que
+    se abre el engine de una clínica existente (y tras create_clinic()).
+    """
+
+    def __init__(self, max_engines: int) -> None:
+        self.max_engines = max_engines
+        self._lock = threading.Lock()
+        self._engines: OrderedDict[str, Engine] = OrderedDict()
+        self._listeners: list[Callable[[str, Engine], None]] = []
+
+    def on_open(self, listener: Callable[[str, Engine], None]) -> None:
+        self._listeners.append(listener)
+
+    def notify(self, clinic_id: str, clinic_engine: Engine) -> None:
+        for listener in list(self._listeners):
+            listener(clinic_id, clinic_engine)
+
+    def get(self, clinic_id: str, create: bool = False) -> Engine:
+        path = clinic_db_path(clinic_id)
+        with self._lock:
+            cached = self._engines.get(clinic_id)
+            if cached is not None:
+                self._engines.move_to_end(clinic_id)
+                return cached
+
+        # una cabecera no puede crear ficheros: las clínicas se dan de alta
+        # con create_clinic()
+        if not create and not os.path.exists(path):
+            raise UnknownClinic(f"unknown clinic {clinic_id!r}")
+
+        new_engine = _create_engine(f"sqlite:///{path}")
+        evicted = []
+        opened = False
+        with self._lock:
+            cached = self._engines.get(clinic_id)
+            if cached is not None:
+                # otro hilo lo abrió mientras tanto
+                evicted.append(new_engine)
+                new_engine = cached
+            else:
+                self._engines[clinic_id] = new_engine
+                opened = True
+            self._engines.move_to_end(clinic_id)
+            while len(self._engines) > self.max_engines:
+                evicted.append(self._engines.popitem(last=False)[1])
+        for old in evicted:
+            old.dispose()
+        # una clínica recién creada avisa cuando ya está migrada (create_clinic)
+        if opened and not create:
+            self.notify(clinic_id, new_engine)
+        return new_engine
+
+    def dispose_all(self) -> None:
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+        for old in engines:
+            old.dispose()
+
+
+_clinic_engines = EngineCache(CLINIC_ENGINE_CACHE_SIZE)
+
+
+def get_engine(clinic_id: Optional[str] = None) -> Engine:
+    """
+    Engine de la clínica (o el de DATABASE_URL si no hay clínica).
+    Lanza UnknownClinic si la clínica no existe.
+    """
+    if clinic_id is None:
+        return engine
+    return _clinic_engines.get(clinic_id)
+
+
+def on_clinic_engine(listener: Callable[[str, Engine], None]) -> None:
+    """
+    Llama a listener(clínica, engine) cada vez que este proceso abre la BD
+    de una clínica, también las dadas de alta después del arranque.
+    """
+    _clinic_engines.on_open(listener)
+
+
+def current_engine() -> Engine:
+    """
+    Engine de la clínica de la petición en curso.
+    """
+    return get_engine(current_clinic.get())
+
+
+def create_clinic(clinic_id: str) -> Engine:
+    """
+    Da de alta una clínica: crea su fichero y le aplica las migraciones
+    (idempotente).
+    """
+    path = clinic_db_path(clinic_id)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    clinic_engine = _clinic_engines.get(clinic_id, create=True)
+    init_db(target=clinic_engine)
+    _clinic_engines.notify(clinic_id, clinic_engine)
+    return clinic_engine
+
+
+T = TypeVar("T")
+
+
+def fan_out(
+    fn: Callable[[Optional[str], Engine], T],
+    clinics: Optional[list[str]] = None,
+    include_default: bool = False,
+    max_workers: int = 8,
+) -> dict[Optional[str], T]:
+    """
+    Ejecuta fn(clinic_id, engine) en cada shard (por defecto todas las
+    clínicas; con include_default también la BD de DATABASE_URL, con clave
+    None) en paralelo. Para informes de administración: cada shard se consulta
+    por separado y el llamador combina los resultados.
+    """
+    targets: list[Optional[str]] = list(clinics if clinics is not None else list_clinics())
+    if include_default:
+        targets.insert(0, None)
+    if not targets:
+        return {}
+
+    def run(clinic_id: Optional[str]) -> T:
+        return fn(clinic_id, get_engine(clinic_id))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as pool:
+        return dict(zip(targets, pool.map(run, targets)))
+
+
+def init_db(install_changelog: bool = CHANGELOG_ENABLED, target: Optional[Engine] = None) -> None:
+    """
+    Aplica las migraciones pendientes (ver migrations.py) a `target`
+    (por defecto la BD de DATABASE_URL).
+    Con install_changelog, instala también los triggers de CDC (ver changelog.py).
+
+    El servidor en modo FAST_START no la llama: el esquema se migra antes
+    del despliegue con `python -m backend.migrations`.
+    """
+    from . import migrations
+
+    target = target if target is not None else engine
+    migrations.upgrade(target)
+
+    if install_changelog:
+        from . import changelog
+
+        conn = target.raw_connection()
+        try:
+            changelog.install(conn)
+        finally:
+            conn.close()
+
+def sqlite_timestamp(dt: datetime) -> str:
+    """
+    Formato con el que SQLAlchemy guarda los datetime en SQLite
+    (para comparar/escribir desde SQL crudo).
+    """
+    return dt.isoformat(sep=" ", timespec="microseconds")
+
 
 def get_session():
     """
-    Dependencia de FastAPI que devuelve una sesión de BD.
+    Dependencia de FastAPI que devuelve una sesión de BD (de la clínica
+    de la petición, si la hay).
     """
-    with Session(engine) as session:
+    with Session(current_engine()) as session:
         yield session
@@ -0,0 +1,41 @@
+"""
+Despliegue con varios workers:
+
+    gunicorn -c backend/gunicorn_conf.py backend.main:app
+
+- El proceso maestro aplica las migraciones una vez antes de lanzar los
+  workers, y los workers arrancan en modo FAST_START (no tocan el esquema).
+- Cada worker tiene sus propias conexiones y cachés en memoria; se mantienen
+  coherentes porque van por versión de agenda, que vive en la BD (ver
+  schedule_versions.py y data_version.py).
+- Sólo un worker ejecuta el planificador de follow-ups (flock junto a la BD);
+  aquí se enciende por defecto (FOLLOWUP_SCHEDULER_ENABLED=0 lo apaga).
+
+Variables: WEB_CONCURRENCY (workers, por defecto uno por CPU), BIND.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# sin preload: ninguna conexión SQLite se hereda a través de fork()
+preload_app = False
+raw_env = [
+    "FAST_START=1",
+    # los servidores desplegados envían follow-ups salvo que se apague a mano
+    f"FOLLOWUP_SCHEDULER_ENABLED={os.getenv('FOLLOWUP_SCHEDULER_ENABLED', '1')}",
+]
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    # en un proceso aparte: el maestro no importa la app ni abre conexiones
+    # que luego heredarían los workers
+    subprocess.run([sys.executable, "-m", "backend.migrations", "--all-clinics"], check=True)
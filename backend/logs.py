@@ -0,0 +1,205 @@
+"""
+Logs estructurados (una línea JSON por evento) que no bloquean.
+
+Quien loguea sólo mete el registro en una cola acotada (put_nowait): el
+formateo a JSON y la escritura en stdout los hace un hilo aparte
+(QueueListener). Si la cola está llena el registro se descarta y se cuenta
+(el siguiente que entra lleva `dropped_before`), así que una ruta caliente
+nunca espera a la E/S de logs.
+
+Cada línea lleva los ids de correlación del contexto: `request_id` (cabecera
+X-Request-Id o uno nuevo, ver RequestIdMiddleware), `clinic` y los que se
+añadan con log_context() (p.ej. task_id al enviar un follow-up). Como van en
+contextvars, siguen a la petición por el threadpool y las tareas en segundo
+plano.
+
+Los eventos de mucho volumen se loguean con sampled=True y sólo sale una
+fracción LOG_SAMPLE_RATE (la línea lleva `sample_rate` para reescalar
+recuentos); avisos y errores salen siempre.
+
+    log = get_logger(__name__)
+    log_event(log, "notification.sent", sampled=True, channel="sms")
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from .config import LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE
+from .database import current_clinic
+
+ROOT_LOGGER = "backend"
+REQUEST_ID_HEADER = b"x-request-id"
+
+# ids de correlación del contexto actual (request_id, task_id...)
+_context: ContextVar[dict] = ContextVar("log_context", default={})
+
+
+@contextmanager
+def log_context(**ids):
+    """
+    Añade ids de correlación a todo lo que se loguee dentro del bloque.
+    """
+    token = _context.set({**_context.get(), **ids})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", {}))
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # en el hilo que loguea sólo se fija el texto y el contexto; el JSON
+        # lo monta el hilo escritor
+        record.msg = record.getMessage()
+        record.args = None
+        context = {"clinic": current_clinic.get(), **_context.get()}
+        record.context = {key: value for key, value in context.items() if value is not None}
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # leer, sumar y poner a cero `dropped` con el lock del handler (RLock:
+        # handle() ya lo tiene, pero enqueue también se puede llamar suelto);
+        # put_nowait no espera, así que el lock dura muy poco
+        with self.lock:
+            if self.dropped:
+                record.fields = {**getattr(record, "fields", {}), "dropped_before": self.dropped}
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+            else:
+                self.dropped = 0
+
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging() -> None:
+    """
+    Cuelga la cola del logger "backend" y arranca el hilo escritor (una vez
+    por proceso). Al salir se vacía la cola.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        writer = logging.StreamHandler(sys.stdout)
+        writer.setFormatter(JsonFormatter())
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(_NonBlockingQueueHandler(log_queue))
+        root.propagate = False
+
+        _listener = QueueListener(log_queue, writer)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(name)
+
+
+def log_event(
+    logger: logging.Logger,
+    event: str,
+    level: int = logging.INFO,
+    sampled: bool = False,
+    exc_info=None,
+    **fields,
+) -> None:
+    """
+    Loguea `event` con sus campos. Con sampled (eventos de mucho volumen)
+    sólo sale una fracción LOG_SAMPLE_RATE de los INFO/DEBUG; se decide
+    antes de crear el registro.
+    """
+    if sampled and level < logging.WARNING:
+        if random.random() >= LOG_SAMPLE_RATE:
+            return
+        fields["sample_rate"] = LOG_SAMPLE_RATE
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+
+_access_log = get_logger("backend.requests")
+
+
+class RequestIdMiddleware:
+    """
+    Da a cada petición un request_id (el de X-Request-Id si viene, o uno
+    nuevo), lo devuelve en la respuesta y lo deja en el contexto de logs.
+    También loguea cada petición (muestreada).
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1").strip()[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        status = {}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.append((REQUEST_ID_HEADER, request_id.encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        start = time.perf_counter()
+        with log_context(request_id=request_id):
+            try:
+                await self.app(scope, receive, send_with_id)
+            finally:
+                code = status.get("code", 500)
+                log_event(
+                    _access_log,
+                    "request.done",
+                    level=logging.WARNING if code >= 500 else logging.INFO,
+                    sampled=True,
+                    method=scope["method"],
+                    path=scope["path"],
+                    status=code,
+                    duration_ms=round((time.perf_counter() - start) * 1000, 1),
+                )
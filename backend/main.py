@@ -1,8 +1,13 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from .database import init_db
-from .routes import doctors, patients, appointments, doctor_dashboard, followups, agent
+from . import migrations
+from .clinic_routing import ClinicRoutingMiddleware
+from .config import FAST_START, FOLLOWUP_SCHEDULER_ENABLED
+from .database import SHARDING_ENABLED, engine, get_engine, init_db, list_clinics, on_clinic_engine
+from .logs import RequestIdMiddleware
+from .routes import doctors, patients, appointments, doctor_dashboard, followups, agent, imports, analytics, waitlist
+from .services.followup_scheduler import start_scheduler, stop_scheduler
 
 
 app = FastAPI(
@@ -10,6 +15,17 @@ app = FastAPI(
     version="0.1.0",
 )
 
+# el último middleware añadido es el más externo
+
+# request_id de cada petición en los logs (y en X-Request-Id); por dentro
+# del enrutado por clínica, para que sus logs lleven también la clínica
+app.add_middleware(RequestIdMiddleware)
+
+# X-Clinic-Id / /clinics/<id>/... -> BD de la clínica (ver database.py)
+if SHARDING_ENABLED:
+    app.add_middleware(ClinicRoutingMiddleware)
+
+# por fuera de todo: también los 400/404 del enrutado llevan cabeceras CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # en producción, restringir
@@ -24,15 +40,68 @@ app.include_router(appointments.router, prefix="/appointments", tags=["appointme
 app.include_router(doctor_dashboard.router, prefix="/doctor", tags=["doctor_dashboard"])
 app.include_router(followups.router, prefix="/followups", tags=["followups"])
 app.include_router(agent.router, prefix="/agent", tags=["agent"])
+app.include_router(imports.router, prefix="/import", tags=["import"])
+app.include_router(analytics.router, prefix="/analytics", tags=["analytics"])
+app.include_router(waitlist.router, prefix="/waitlist", tags=["waitlist"])
+
+
+
+
+# /ready: una vez listo no se vuelve a comprobar (el esquema no retrocede)
+_readiness = {"started": False, "ready": False}
+
 
+def _mark_ready() -> None:
+    _readiness["ready"] = True
+    if FOLLOWUP_SCHEDULER_ENABLED:
+        start_scheduler(engine)
+        # uno por clínica existente al arrancar (cada shard tiene su líder)
+        for clinic_id in list_clinics():
+            start_scheduler(get_engine(clinic_id), clinic_id)
 
 
+def _start_clinic_scheduler(clinic_id: str, clinic_engine) -> None:
+    # clínicas dadas de alta (o abiertas de nuevo) después del arranque
+    if _readiness["ready"] and FOLLOWUP_SCHEDULER_ENABLED:
+        start_scheduler(clinic_engine, clinic_id)
+
+
+on_clinic_engine(_start_clinic_scheduler)
+
 
 @app.on_event("startup")
 def on_startup():
-    init_db()
+    if not FAST_START:
+        init_db()
+    _readiness["started"] = True
+    # con el esquema sin migrar, el planificador arranca cuando /ready lo vea al día
+    if not migrations.pending(engine):
+        _mark_ready()
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    stop_scheduler()
 
 
 @app.get("/")
 def read_root():
     return {"status": "ok", "message": "HealthcareApp backend running"}
+
+
+@app.get("/ready")
+def readiness(response: Response):
+    """
+    Readiness para el balanceador: 200 cuando el arranque ha terminado y el
+    esquema está en la última migración; 503 mientras tanto.
+    """
+    if not _readiness["ready"]:
+        if not _readiness["started"]:
+            response.status_code = 503
+            return {"status": "starting"}
+        pending = migrations.pending(engine)
+        if pending:
+            response.status_code = 503
+            return {"status": "migrations_pending", "pending": [v for v, _ in pending]}
+        _mark_ready()
+    return {"status": "ready", "schema_version": migrations.HEAD}
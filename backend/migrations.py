@@ -0,0 +1,261 @@
+"""
+Migraciones versionadas del esquema.
+
+La versión aplicada se guarda en `PRAGMA user_version` de SQLite. Cada
+migración es una función que recibe una conexión SQLAlchemy dentro de una
+transacción; se aplican en orden y sólo las pendientes.
+
+Se ejecutan fuera del arranque del servidor:
+
+    python -m backend.migrations                 # aplica las pendientes
+    python -m backend.migrations --status        # versión actual / última
+    python -m backend.migrations --clinic 7      # da de alta / migra una clínica
+    python -m backend.migrations --all-clinics   # BD principal + todas las clínicas
+
+init_db() también las aplica (scripts, pipelines y modo desarrollo).
+"""
+import argparse
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+
+def _baseline(conn: Connection) -> None:
+    """
+    Esquema completo a la fecha: tablas e índices de models.py que falten
+    (create_all no añade índices nuevos a tablas que ya existen), más los
+    triggers de búsqueda de pacientes y de versión de agenda.
+    """
+    from sqlmodel import SQLModel
+
+    from . import models  # noqa: F401 - registra las tablas
+    from . import patient_search, schedule_versions
+
+    SQLModel.metadata.create_all(conn)
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+    # install() trabaja sobre la conexión DB-API y hace commit
+    conn.commit()
+    patient_search.install(conn.connection)
+    schedule_versions.install(conn.connection)
+
+
+def _archive_tables(conn: Connection) -> None:
+    """
+    Tablas de archivo (ver services/archive.py) y los índices por cita de
+    follow-ups y escalados que usa el archivado.
+    """
+    from .models import (
+        AppointmentArchive,
+        Escalation,
+        EscalationArchive,
+        FollowUpTask,
+        FollowUpTaskArchive,
+    )
+
+    for model in (AppointmentArchive, FollowUpTaskArchive, EscalationArchive, FollowUpTask, Escalation):
+        model.__table__.create(conn, checkfirst=True)
+        for index in model.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+
+# PRAGMA auto_vacuum: 0 = NONE, 1 = FULL, 2 = INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _followup_retention(conn: Connection) -> None:
+    """
+    Resumen diario de follow-ups purgados, índice por hora en el archivo y
+    auto_vacuum incremental (ver services/retention.py). Cambiar auto_vacuum
+    en una BD con tablas exige un VACUUM completo: se hace una sola vez,
+    aquí, fuera del arranque del servidor.
+    """
+    from .models import FollowUpDaySummary, FollowUpTaskArchive
+
+    FollowUpDaySummary.__table__.create(conn, checkfirst=True)
+    for index in FollowUpTaskArchive.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    conn.commit()
+
+    if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != AUTO_VACUUM_INCREMENTAL:
+        conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        # VACUUM no puede ir dentro de una transacción
+        conn.exec_driver_sql("VACUUM")
+        conn.commit()
+
+
+def _waitlist(conn: Connection) -> None:
+    """
+    Lista de espera (ver services/waitlist.py).
+    """
+    from .models import WaitlistEntry
+
+    WaitlistEntry.__table__.create(conn, checkfirst=True)
+    for index in WaitlistEntry.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _visit_indexes(conn: Connection) -> None:
+    """
+    Índice por cita de action items (GET /patients/{id}/visit/{appointment_id}).
+    """
+    from .models import ActionItem
+
+    for index in ActionItem.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _followup_leases(conn: Connection) -> None:
+    """
+    Columnas de lease de FollowUpTask (ver services/followup_leases.py), en
+    la tabla viva y en el archivo (union_all lee las mismas columnas). Una
+    BD creada desde cero ya las tiene.
+    """
+    for table in ("followuptask", "followuptask_archive"):
+        existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+        for column, sql_type in (("claimed_by", "VARCHAR"), ("lease_until", "DATETIME")):
+            if column not in existing:
+                conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type}")
+
+
+def _autoincrement_ids(conn: Connection) -> None:
+    """
+    AUTOINCREMENT en las tablas vivas que se archivan. Sin él SQLite reutiliza
+    el id más alto cuando el archivo se lo lleva, y el mismo id acaba en la
+    tabla viva y en la de archivo. SQLite no permite añadirlo con ALTER: se
+    reconstruye la tabla (con sus índices y triggers) y se arranca su
+    secuencia en el id más alto de las dos tablas.
+    """
+    from sqlalchemy.schema import CreateTable
+
+    from .models import Appointment, Escalation, FollowUpTask
+
+    # DDL en la misma transacción que la copia y el user_version
+    conn.commit()
+    conn.exec_driver_sql("BEGIN")
+    for model in (Appointment, FollowUpTask, Escalation):
+        table = model.__tablename__
+        ddl = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).scalar()
+        if "AUTOINCREMENT" not in ddl.upper():
+            # índices y triggers desaparecen con la tabla: se recrean tal cual
+            extras = [
+                row[0]
+                for row in conn.exec_driver_sql(
+                    "SELECT sql FROM sqlite_master"
+                    " WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+                    (table,),
+                )
+            ]
+            old_columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+            columns = ", ".join(f'"{c}"' for c in model.__table__.columns.keys() if c in old_columns)
+            create = str(CreateTable(model.__table__).compile(dialect=conn.dialect))
+            conn.exec_driver_sql(create.replace(f"CREATE TABLE {table} ", f"CREATE TABLE {table}__new ", 1))
+            conn.exec_driver_sql(f"INSERT INTO {table}__new ({columns}) SELECT {columns} FROM {table}")
+            # sin PRAGMA foreign_keys (ver database.py) el DROP no comprueba referencias
+            conn.exec_driver_sql(f"DROP TABLE {table}")
+            conn.exec_driver_sql(f"ALTER TABLE {table}__new RENAME TO {table}")
+            for sql in extras:
+                conn.exec_driver_sql(sql)
+
+        top = conn.exec_driver_sql(
+            f"SELECT max(coalesce((SELECT max(id) FROM {table}), 0),"
+            f" coalesce((SELECT max(id) FROM {table}_archive), 0))"
+        ).scalar()
+        conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+        conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, top))
+
+
+def _waitlist_offer_expiry(conn: Connection) -> None:
+    """
+    Caducidad de las ofertas de la lista de espera; las que ya estaban
+    ofrecidas caducan WAITLIST_OFFER_MINUTES después de ofrecerse. Una BD
+    creada desde cero ya tiene la columna.
+    """
+    from .config import WAITLIST_OFFER_MINUTES
+
+    existing = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(waitlistentry)")}
+    if "offer_expires_at" not in existing:
+        conn.exec_driver_sql("ALTER TABLE waitlistentry ADD COLUMN offer_expires_at DATETIME")
+    conn.exec_driver_sql(
+        "UPDATE waitlistentry SET offer_expires_at = datetime(offered_at, ?)"
+        " WHERE status = 'OFFERED' AND offer_expires_at IS NULL",
+        (f"+{int(WAITLIST_OFFER_MINUTES * 60)} seconds",),
+    )
+
+
+# (versión, descripción, función). Sólo se añaden al final.
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline schema", _baseline),
+    (2, "archive tables", _archive_tables),
+    (3, "follow-up retention", _followup_retention),
+    (4, "waitlist", _waitlist),
+    (5, "visit indexes", _visit_indexes),
+    (6, "follow-up leases", _followup_leases),
+    (7, "autoincrement ids", _autoincrement_ids),
+    (8, "waitlist offer expiry", _waitlist_offer_expiry),
+]
+
+HEAD = MIGRATIONS[-1][0]
+
+
+def current_version(conn: Connection) -> int:
+    return conn.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def pending(engine: Engine) -> list[tuple[int, str]]:
+    with engine.connect() as conn:
+        version = current_version(conn)
+    return [(v, desc) for v, desc, _ in MIGRATIONS if v > version]
+
+
+def upgrade(engine: Engine) -> list[int]:
+    """
+    Aplica las migraciones pendientes. Devuelve las versiones aplicadas.
+    """
+    applied = []
+    with engine.connect() as conn:
+        version = current_version(conn)
+        for target, description, migrate in MIGRATIONS:
+            if target <= version:
+                continue
+            migrate(conn)
+            # PRAGMA no admite parámetros; target es un entero nuestro
+            conn.execute(text(f"PRAGMA user_version = {int(target)}"))
+            conn.commit()
+            print(f"[MIGRATIONS] applied {target}: {description}")
+            applied.append(target)
+    return applied
+
+
+if __name__ == "__main__":
+    from .database import create_clinic, engine, get_engine, list_clinics
+
+    parser = argparse.ArgumentParser(description="Schema migrations")
+    parser.add_argument("--status", action="store_true", help="show versions and exit")
+    parser.add_argument("--clinic", default=None, help="only this clinic (created if missing)")
+    parser.add_argument("--all-clinics", action="store_true", help="main database and every clinic")
+    args = parser.parse_args()
+
+    if args.clinic is not None:
+        clinic_engine = get_engine(args.clinic) if args.status else create_clinic(args.clinic)
+        targets = [(f"clinic {args.clinic}", clinic_engine)]
+    else:
+        targets = [("main", engine)]
+        if args.all_clinics:
+            targets += [(f"clinic {c}", get_engine(c)) for c in list_clinics()]
+
+    for name, target in targets:
+        if args.status:
+            with target.connect() as conn:
+                print(f"{name}: current={current_version(conn)} head={HEAD}")
+            for version, description in pending(target):
+                print(f"{name}: pending {version}: {description}")
+        else:
+            applied = upgrade(target)
+            if not applied:
+                print(f"[MIGRATIONS] {name} up to date (version {HEAD})")
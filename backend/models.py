@@ -2,6 +2,7 @@ from datetime import datetime, date, time
 from enum import Enum
 from typing import Optional
 
+from sqlalchemy import Index, UniqueConstraint
 from sqlmodel import SQLModel, Field
 
 
@@ -10,6 +11,7 @@ class AppointmentStatus(str, Enum):
     IN_PROGRESS = "in_progress"
     COMPLETED = "completed"
     SKIPPED = "skipped"
+    CANCELLED = "cancelled"
 
 
 class ArrivalStatus(str, Enum):
@@ -42,7 +44,7 @@ class Patient(SQLModel, table=True):
     display_name: str  # nombre visible en dashboard del doctor
 
 
-class Appointment(SQLModel, table=True):
+class AppointmentBase(SQLModel):
     """
     Cita entre doctor y paciente para un día concreto.
     """
@@ -72,9 +74,46 @@ class Appointment(SQLModel, table=True):
     event_id: Optional[str] = None
 
 
+class Appointment(AppointmentBase, table=True):
+    """
+    Citas vivas: hoy, futuras y pasadas aún sin archivar.
+    """
+    __table_args__ = (
+        # colas por día: filtra por fecha y ordena por doctor + hora actual
+        Index("ix_appointment_day_queue", "date", "doctor_id", "current_time"),
+        # historial del paciente (listado paginado por fecha/hora)
+        Index("ix_appointment_patient_history", "patient_id", "date", "scheduled_time"),
+        # ids nunca reutilizados: los archivados siguen existiendo en *_archive
+        {"sqlite_autoincrement": True},
+    )
+
+
+class AppointmentArchive(AppointmentBase, table=True):
+    """
+    Días pasados ya cerrados, movidos fuera de `appointment` por
+    services/archive.py (conservan su id).
+    """
+    __tablename__ = "appointment_archive"
+    __table_args__ = (
+        Index("ix_appointment_archive_day", "date", "doctor_id"),
+        Index("ix_appointment_archive_patient_history", "patient_id", "date", "scheduled_time"),
+    )
+
+
 
 # ---- Follow-ups & Action Items ----
 
+class ScheduleVersion(SQLModel, table=True):
+    """
+    Versión de la agenda de un doctor en un día. La suben triggers de SQLite
+    con cada INSERT/UPDATE/DELETE de citas (ver schedule_versions.py) y sirve
+    de ETag para las lecturas de agenda/ETA.
+    """
+    doctor_id: int = Field(foreign_key="doctor.id", primary_key=True)
+    day: date = Field(primary_key=True)
+    version: int = 0
+
+
 class FollowUpType(str, Enum):
     REMINDER = "reminder"
     CHECKIN = "checkin"
@@ -86,7 +125,7 @@ class FollowUpChannel(str, Enum):
     VOICE = "voice"
 
 
-class FollowUpTask(SQLModel, table=True):
+class FollowUpTaskBase(SQLModel):
     id: Optional[int] = Field(default=None, primary_key=True)
     appointment_id: int = Field(foreign_key="appointment.id")
     type: FollowUpType
@@ -98,6 +137,48 @@ class FollowUpTask(SQLModel, table=True):
     executed_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+    # worker que la está enviando y hasta cuándo (services/followup_leases.py)
+    claimed_by: Optional[str] = None
+    lease_until: Optional[datetime] = None
+
+
+class FollowUpTask(FollowUpTaskBase, table=True):
+    __table_args__ = (
+        # workers de follow-ups: "pendientes cuya hora ya ha llegado"
+        Index("ix_followuptask_due", "executed", "scheduled_time"),
+        # archivo: "¿le queda algún follow-up pendiente a esta cita?"
+        Index("ix_followuptask_appointment", "appointment_id", "executed"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class FollowUpTaskArchive(FollowUpTaskBase, table=True):
+    """
+    Follow-ups ejecutados de citas archivadas.
+    """
+    __tablename__ = "followuptask_archive"
+    __table_args__ = (
+        # retención: "ejecutados antes de X"
+        Index("ix_followuptask_archive_scheduled", "scheduled_time"),
+    )
+
+    # la cita está en appointment_archive: sin clave foránea
+    appointment_id: int = Field(index=True)
+
+
+class FollowUpDaySummary(SQLModel, table=True):
+    """
+    Follow-ups ejecutados por día, tipo y canal que quedan tras purgar las
+    tareas antiguas (services/retention.py).
+    """
+    __table_args__ = (UniqueConstraint("day", "type", "channel"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    day: date
+    type: FollowUpType
+    channel: FollowUpChannel
+    executed: int = 0
+
 
 class ActionItemStatus(str, Enum):
     PENDING = "pending"
@@ -110,6 +191,11 @@ class ActionItem(SQLModel, table=True):
     - 'Do blood test'
     - 'Take medication 3x per day'
     """
+    __table_args__ = (
+        # pantalla "mi visita": action items de una cita
+        Index("ix_actionitem_appointment", "appointment_id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     appointment_id: int = Field(foreign_key="appointment.id")
     title: str
@@ -119,7 +205,7 @@ class ActionItem(SQLModel, table=True):
     due_date: Optional[datetime] = None
 
 
-class Escalation(SQLModel, table=True):
+class EscalationBase(SQLModel):
     """
     Escalados a humano cuando una respuesta del paciente parece preocupante.
     """
@@ -128,3 +214,119 @@ class Escalation(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     status: str = "open"  # open | in_progress | resolved
     notes: Optional[str] = None
+
+
+class Escalation(EscalationBase, table=True):
+    __table_args__ = (
+        # archivo: "¿queda algún escalado abierto de esta cita?"
+        Index("ix_escalation_appointment", "appointment_id"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+class EscalationArchive(EscalationBase, table=True):
+    """
+    Escalados resueltos de citas archivadas.
+    """
+    __tablename__ = "escalation_archive"
+
+    appointment_id: int = Field(index=True)
+
+
+# ---- KPIs en vivo ----
+
+class DoctorKPI(SQLModel, table=True):
+    """
+    KPIs por doctor y día, mantenidos de forma incremental por el pipeline
+    de Pathway (backend/pathway_kpis.py). Los dashboards los leen tal cual,
+    sin agregar sobre las tablas transaccionales.
+    """
+    __table_args__ = (UniqueConstraint("doctor_id", "day"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    doctor_id: int = Field(foreign_key="doctor.id")
+    day: date
+
+    total_appointments: int = 0
+    queue_length: int = 0
+    current_delay_minutes: int = 0
+    avg_wait_minutes: Optional[float] = None
+    no_show_rate: float = 0.0
+
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# ---- Rollups diarios (analítica) ----
+
+class DoctorDayRollup(SQLModel, table=True):
+    """
+    Resumen por doctor y día que rellena el job de rollups
+    (backend/services/rollups.py). Los histogramas de espera y duración de
+    visita son "sketches" que se pueden sumar entre días, así que cualquier
+    rango de fechas se responde sin volver a las citas.
+    """
+    __table_args__ = (UniqueConstraint("doctor_id", "day"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    doctor_id: int = Field(foreign_key="doctor.id")
+    day: date
+
+    total_appointments: int = 0
+    completed: int = 0
+    skipped: int = 0
+    no_shows: int = 0
+    booked_minutes: int = 0
+
+    wait_count: int = 0
+    wait_sum_minutes: float = 0.0
+    visit_count: int = 0
+    visit_sum_minutes: float = 0.0
+    # JSON {bucket: count} (ver services/rollups.py)
+    wait_histogram: str = "{}"
+    visit_histogram: str = "{}"
+
+    computed_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# ---- Lista de espera ----
+
+class WaitlistStatus(str, Enum):
+    WAITING = "waiting"
+    OFFERED = "offered"
+    BOOKED = "booked"
+    CANCELLED = "cancelled"
+
+
+class WaitlistEntry(SQLModel, table=True):
+    """
+    Paciente que quiere un hueco antes: con un doctor concreto o con
+    cualquiera de una especialidad, un día, empezando entre `earliest` y
+    `latest`. Los huecos que se liberan (skip, cancelación) se le ofrecen
+    desde services/waitlist.py.
+    """
+    __table_args__ = (
+        # carga del índice en memoria: "en espera a partir de hoy"
+        Index("ix_waitlistentry_open", "status", "day"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    patient_id: int = Field(foreign_key="patient.id")
+    doctor_id: Optional[int] = Field(default=None, foreign_key="doctor.id")
+    specialty: Optional[str] = None
+
+    day: date
+    earliest: time
+    latest: time
+    slot_minutes: int = 20
+    channel: FollowUpChannel = FollowUpChannel.SMS
+
+    status: WaitlistStatus = Field(default=WaitlistStatus.WAITING)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    # hueco ofrecido y, si lo acepta, la cita creada
+    offered_doctor_id: Optional[int] = None
+    offered_time: Optional[time] = None
+    offered_at: Optional[datetime] = None
+    # pasada esta hora la oferta caduca (services/waitlist.py: expire_offers)
+    offer_expires_at: Optional[datetime] = None
+    appointment_id: Optional[int] = None
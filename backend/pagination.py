@@ -0,0 +1,138 @@
+"""
+Paginación por cursor (keyset) y proyección de columnas para los listados.
+
+- El cursor es opaco (base64 de las claves de orden de la última fila) y la
+  siguiente página se pide con WHERE (claves) > (cursor): el coste no crece
+  con la profundidad, a diferencia de OFFSET.
+- `fields=a,b,c` selecciona sólo esas columnas en SQL; las filas se devuelven
+  como diccionarios, sin construir un modelo por fila.
+"""
+import base64
+import json
+from datetime import date, datetime, time
+from typing import Any, Callable, Optional, Sequence
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import select, tuple_
+from sqlmodel import Session
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class Page(BaseModel):
+    items: list[dict[str, Any]]
+    next_cursor: Optional[str] = None
+
+
+def _encode_value(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type in (date, datetime, time):
+        return python_type.fromisoformat(value)
+    return value
+
+
+def encode_cursor(values: Sequence) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [_decode_value(c, v) for c, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(model, fields: Optional[str]) -> list[str]:
+    """
+    Columnas pedidas en `fields` (separadas por comas), o todas.
+    """
+    table_columns = list(model.__table__.columns.keys())
+    if not fields:
+        return table_columns
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in table_columns]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(table_columns)}",
+        )
+    return list(dict.fromkeys(requested))
+
+
+def _fetch(session: Session, model, conditions, selected, order_by, last, limit: int) -> list:
+    table = model.__table__
+    keys = [table.c[name] for name in order_by]
+
+    stmt = select(*[table.c[name] for name in selected])
+    for condition in conditions:
+        stmt = stmt.where(condition)
+    if last is not None:
+        if len(keys) == 1:
+            stmt = stmt.where(keys[0] > last[0])
+        else:
+            stmt = stmt.where(tuple_(*keys) > tuple_(*last))
+    stmt = stmt.order_by(*keys).limit(limit + 1)
+    return session.execute(stmt).mappings().all()
+
+
+def paginate(
+    session: Session,
+    model,
+    *,
+    where: Sequence | Callable[[Any], Sequence] = (),
+    order_by: Sequence[str] = ("id",),
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_LIMIT,
+    archive=None,
+) -> Page:
+    """
+    Una página de `model` ordenada por `order_by` (que debe terminar en una
+    columna única, normalmente id). Las columnas de orden se leen siempre
+    para construir el cursor aunque no estén en `fields`.
+
+    Con `archive` (tabla de archivo con las mismas columnas e ids, ver
+    services/archive.py) la página mezcla las dos: se pide una página a cada
+    una con su índice y se intercalan. `where` es entonces una función
+    modelo -> condiciones, para construirlas sobre cada tabla.
+    """
+    table = model.__table__
+    output = parse_fields(model, fields)
+    keys = [table.c[name] for name in order_by]
+    selected = list(dict.fromkeys([*output, *order_by]))
+    last = decode_cursor(cursor, keys) if cursor else None
+
+    models = [model] if archive is None else [model, archive]
+    rows = []
+    for source in models:
+        conditions = where(source) if callable(where) else where
+        rows.extend(_fetch(session, source, conditions, selected, order_by, last, limit))
+    if archive is not None:
+        rows.sort(key=lambda row: tuple(row[name] for name in order_by))
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor([rows[-1][name] for name in order_by])
+
+    return Page(
+        items=[{name: row[name] for name in output} for row in rows],
+        next_cursor=next_cursor,
+    )
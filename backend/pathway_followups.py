@@ -1,21 +1,35 @@
 import sqlite3
 import time
 from datetime import datetime
-from typing import Set
+from typing import Optional, Set
 
 import pathway as pw
 
-from .config import DATABASE_URL
-from .services.notifications import send_sms, send_email, send_voice_call
+from . import changelog
+from .database import DB_PATH, clinic_db_path, list_clinics, sqlite_timestamp
+from .logs import get_logger, log_context, log_event
+from .services.followup_leases import claim_ids, send_claimed, worker_id
 
 
-# ---------- Resolver ruta del archivo SQLite a partir de DATABASE_URL ----------
+log = get_logger(__name__)
 
-if DATABASE_URL.startswith("sqlite:///"):
-    DB_PATH = DATABASE_URL.replace("sqlite:///", "", 1)
-else:
-    # Fallback simple
-    DB_PATH = "healthcare.db"
+# Máximo que dormimos entre consultas: otro proceso puede insertar tareas
+# nuevas y desde aquí no podemos enterarnos antes.
+MAX_POLL_SECONDS = 5.0
+
+# Cambios del changelog que procesamos por ronda
+CHANGELOG_BATCH = 5_000
+
+
+_FOLLOWUP_COLUMNS = "id, appointment_id, type, channel, scheduled_time, message"
+
+# que se puedan reclamar: sin lease o con el lease caducado (como claim_ids)
+_CLAIMABLE = "executed = 0 AND (lease_until IS NULL OR lease_until < ?)"
+
+
+def _parse_ts(value) -> datetime:
+    # scheduled_time vendrá como string ISO o datetime; lo normalizamos
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
 
 
 # ---------- Esquema Pathway para FollowUpTask ----------
@@ -26,7 +40,7 @@ class FollowUpSchema(pw.Schema):
     appointment_id: int
     type: str
     channel: str
-    scheduled_time: datetime
+    scheduled_time: pw.DateTimeNaive
     message: str
 
 
@@ -39,67 +53,164 @@ class FollowUpSubject(pw.io.python.ConnectorSubject):
     - Conecta a la base de datos SQLite (healthcare.db)
     - Busca FollowUpTask pendientes (executed = 0) cuya hora ya ha llegado
     - Va haciendo self.next(...) para enviar filas a Pathway
+    - Duerme hasta la siguiente tarea pendiente (como mucho MAX_POLL_SECONDS)
+
+    Sólo se leen tareas vencidas (índice executed + scheduled_time), nunca todo
+    el backlog pendiente, así que reiniciar cuesta lo mismo que una ronda.
+    Si la BD tiene changelog (CHANGELOG_ENABLED), tras la primera ronda sólo
+    mira el tramo (última ronda, ahora] y las tareas que aparecen en él.
+
+    Una tarea con lease vigente (enviándose, o esperando reintento tras un
+    envío fallido) no se lee y deja de contar como emitida: cuando el lease
+    caduca sin que se haya ejecutado se vuelve a emitir.
     """
 
+    CONSUMER_NAME = "pathway_followups"
+
     def __init__(self, db_path: str) -> None:
         super().__init__()
         self.db_path = db_path
-        # Para no reenviar las mismas tareas continuamente
+        # Emitidas a Pathway y todavía sin ejecutar (para no reenviarlas)
         self._seen_ids: Set[int] = set()
 
+        # Modo changelog: posición en el log y hora de la última ronda
+        self._use_changelog: Optional[bool] = None
+        self._seq = 0
+        self._watermark: Optional[datetime] = None
+
     def run(self) -> None:
         """
         Bucle infinito que:
-        - cada X segundos consulta la BD
+        - consulta la BD (o el changelog)
         - envía a Pathway los follow-ups listos para ejecutarse
+        - espera hasta el siguiente vencimiento
         """
         while True:
-            now = datetime.utcnow()
-
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-
-            # Importante: la tabla se llama followuptask (por defecto de SQLModel)
-            cur.execute(
-                """
-                SELECT id, appointment_id, type, channel, scheduled_time, message
-                FROM followuptask
-                WHERE executed = 0
-            """
-            )
-            rows = cur.fetchall()
+            backlog, next_due = self.poll_once()
+            # Si quedan cambios por leer seguimos; si no, dormimos hasta la
+            # siguiente tarea (o MAX_POLL_SECONDS si no hay)
+            if backlog:
+                continue
+            sleep_s = MAX_POLL_SECONDS
+            if next_due is not None:
+                wait = (next_due - datetime.utcnow()).total_seconds()
+                sleep_s = min(max(wait, 0.0), MAX_POLL_SECONDS)
+            time.sleep(sleep_s)
+
+    def poll_once(self, now: Optional[datetime] = None) -> tuple[bool, Optional[datetime]]:
+        """
+        Una ronda: emite lo que toca y devuelve (quedan cambios por leer,
+        siguiente vencimiento).
+        """
+        now = now or datetime.utcnow()
+
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            if self._use_changelog is None:
+                self._use_changelog = changelog.is_installed(conn)
+                if self._use_changelog:
+                    self._seq = changelog.register_consumer(conn, self.CONSUMER_NAME)
+                    # al (re)registrarse, una ronda completa
+                    self._watermark = None
+
+            backlog = False
+            if self._use_changelog and self._watermark is not None:
+                rows, backlog = self._poll_changelog(conn, now)
+            else:
+                rows = self._poll_due(conn, now)
+            self._watermark = now
+
+            # siguiente vencimiento, para no dormir más de la cuenta
+            next_due = conn.execute(
+                "SELECT MIN(scheduled_time) FROM followuptask WHERE executed = 0 AND scheduled_time > ?",
+                (sqlite_timestamp(now),),
+            ).fetchone()[0]
+        finally:
             conn.close()
 
-            for row in rows:
-                fid = row["id"]
-                if fid in self._seen_ids:
-                    continue
-
-                # scheduled_time vendrá como string ISO o datetime; lo normalizamos
-                s_time = row["scheduled_time"]
-                if isinstance(s_time, str):
-                    scheduled_dt = datetime.fromisoformat(s_time)
-                else:
-                    scheduled_dt = s_time
-
-                # Solo emitimos si ya toca (hora <= ahora)
-                if scheduled_dt <= now:
-                    self.next(
-                        id=fid,
-                        appointment_id=row["appointment_id"],
-                        type=row["type"],
-                        channel=row["channel"],
-                        scheduled_time=scheduled_dt,
-                        message=row["message"],
-                    )
-                    self._seen_ids.add(fid)
-
-            # Enviamos un commit para que Pathway procese el mini-batch
-            self.commit()
-
-            # Dormimos unos segundos antes de la siguiente ronda
-            time.sleep(5)
+        for row in rows:
+            self._emit(row)
+
+        # Enviamos un commit para que Pathway procese el mini-batch
+        self.commit()
+        return backlog, _parse_ts(next_due) if next_due is not None else None
+
+    def _emit(self, row: sqlite3.Row) -> None:
+        fid = row["id"]
+        if fid in self._seen_ids:
+            return
+
+        self.next(
+            id=fid,
+            appointment_id=row["appointment_id"],
+            type=row["type"],
+            channel=row["channel"],
+            scheduled_time=_parse_ts(row["scheduled_time"]),
+            message=row["message"],
+        )
+        self._seen_ids.add(fid)
+
+    def _poll_due(self, conn: sqlite3.Connection, now: datetime) -> list:
+        # Importante: la tabla se llama followuptask (por defecto de SQLModel)
+        rows = conn.execute(
+            f"""
+            SELECT {_FOLLOWUP_COLUMNS}
+            FROM followuptask
+            WHERE {_CLAIMABLE} AND scheduled_time <= ?
+            """,
+            (sqlite_timestamp(now), sqlite_timestamp(now)),
+        ).fetchall()
+
+        # lo emitido que ya no sale se ejecutó o tiene lease: si el lease
+        # caduca sin ejecutarse, volverá a salir y se emitirá otra vez
+        self._seen_ids &= {row["id"] for row in rows}
+        return rows
+
+    def _poll_changelog(self, conn: sqlite3.Connection, now: datetime):
+        now_ts = sqlite_timestamp(now)
+
+        watermark_ts = sqlite_timestamp(self._watermark)
+
+        # tareas que han vencido desde la última ronda, y vencidas cuyo lease
+        # ha caducado desde entonces (envío fallido o worker caído)
+        rows = conn.execute(
+            f"""
+            SELECT {_FOLLOWUP_COLUMNS}
+            FROM followuptask
+            WHERE {_CLAIMABLE} AND scheduled_time <= ?
+              AND (scheduled_time > ? OR (lease_until >= ? AND lease_until < ?))
+            """,
+            (now_ts, now_ts, watermark_ts, watermark_ts, now_ts),
+        ).fetchall()
+
+        # + tareas insertadas o reprogramadas con una hora ya pasada
+        batch = changelog.read_batch(
+            conn, self._seq, tables=("followuptask",), limit=CHANGELOG_BATCH
+        )
+        ids = changelog.changed_ids(batch.changes, "followuptask")
+        changed_due = changelog.fetch_rows(
+            conn,
+            "followuptask",
+            _FOLLOWUP_COLUMNS,
+            ids,
+            where=f"{_CLAIMABLE} AND scheduled_time <= ?",
+            params=(now_ts, now_ts),
+        )
+        rows.extend(changed_due)
+
+        # las emitidas que han cambiado y ya no se pueden reclamar (ejecutadas
+        # o con lease) se olvidan
+        self._seen_ids -= set(ids) - {row["id"] for row in changed_due}
+
+        if batch.seq > self._seq:
+            self._seq = batch.seq
+            if not changelog.ack(conn, self.CONSUMER_NAME, self._seq):
+                # nos dieron de baja por inactivos: volver a registrarse y
+                # releer todo lo pendiente
+                self._use_changelog = None
+
+        return rows, batch.more
 
 
 # ---------- Observador de salida: ejecuta notificaciones y marca ejecutado ----------
@@ -108,92 +219,77 @@ class FollowUpSubject(pw.io.python.ConnectorSubject):
 class FollowUpObserver(pw.io.python.ConnectorObserver):
     """
     Recibe cambios desde la tabla Pathway y:
-    - envía notificación por SMS/EMAIL/VOICE
-    - marca el follow-up como ejecutado en SQLite
+    - lo reclama con un lease (services/followup_leases.py); si ya está
+      ejecutado o lo tiene otro worker, no envía
+    - envía notificación por SMS/EMAIL/VOICE y lo marca ejecutado
+
+    Si el envío falla o el proceso cae a mitad, la tarea sigue pendiente en
+    la BD con su lease; al caducar, FollowUpSubject la vuelve a emitir (o la
+    lee al arrancar) y se envía con la misma clave de idempotencia: el
+    proveedor descarta el duplicado. No hace falta más estado local.
     """
 
-    def __init__(self, db_path: str) -> None:
+    def __init__(self, db_path: str, scope: Optional[str] = None) -> None:
         super().__init__()
         self.db_path = db_path
+        # clínica del shard (claves de idempotencia) e id en claimed_by
+        self.scope = scope
+        self.worker = worker_id()
 
-    def on_change(self, key: pw.Pointer, row: dict, time_: int, is_addition: bool):
+    def on_change(self, key: pw.Pointer, row: dict, time: int, is_addition: bool):
         # Sólo actuamos en adiciones (diff = +1)
         if not is_addition:
             return
 
         followup_id = row["id"]
-        appointment_id = row["appointment_id"]
         channel = row["channel"]
-        message = row["message"]
 
-        # Recuperamos info básica del paciente para logging / destino
         conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        cur.execute(
-            "SELECT patient_id FROM appointment WHERE id = ?",
-            (appointment_id,),
-        )
-        app_row = cur.fetchone()
-
-        if app_row is not None:
-            patient_id = app_row["patient_id"]
-            # En una versión más avanzada aquí usarías teléfono/email reales
-            destination = f"patient-{patient_id}"
-        else:
-            destination = "unknown-patient"
-
-        # Enviar notificación según canal
-        if channel.lower() == "sms":
-            send_sms(destination, message)
-        elif channel.lower() == "email":
-            send_email(destination, "Appointment follow-up", message)
-        elif channel.lower() == "voice":
-            send_voice_call(destination, message)
-        else:
-            # Canal desconocido, hacemos log
-            print(f"[FOLLOWUP] Unknown channel '{channel}' for followup {followup_id}")
-
-        # Marcar follow-up como ejecutado
-        now_iso = datetime.utcnow().isoformat()
-
-        cur.execute(
-            """
-            UPDATE followuptask
-            SET executed = 1,
-                executed_at = ?
-            WHERE id = ?
-            """,
-            (now_iso, followup_id),
-        )
-        conn.commit()
-        conn.close()
+        try:
+            tasks = claim_ids(conn, self.worker, [followup_id])
+            sent = send_claimed(conn, self.worker, tasks, self.scope) if tasks else 0
+        finally:
+            conn.close()
 
-        print(f"[FOLLOWUP] executed followup_id={followup_id} via {channel} to {destination}")
+        if sent:
+            with log_context(task_id=followup_id, clinic=self.scope):
+                log_event(log, "followup.executed", sampled=True, channel=channel)
 
     def on_end(self):
-        print("[FOLLOWUP] Pathway stream ended.")
+        log_event(log, "followup.stream_ended")
 
 
 # ---------- Construcción del pipeline y arranque ----------
 
 
-def build_pipeline():
+def _shards(clinics: Optional[list[str]]) -> list[tuple[Optional[str], str]]:
     """
-    Construye el pipeline Pathway:
+    (clínica, BD) de cada shard: la BD principal y las clínicas (todas las
+    existentes si clinics es None).
+    """
+    shards = [(None, DB_PATH)]
+    for clinic_id in list_clinics() if clinics is None else clinics:
+        shards.append((clinic_id, clinic_db_path(clinic_id)))
+    return shards
+
+
+def build_pipeline(clinics: Optional[list[str]] = None):
+    """
+    Construye el pipeline Pathway, con una rama por shard (ver database.py):
     - Entrada: FollowUpSubject (SQLite -> Pathway)
     - Salida: FollowUpObserver (Pathway -> notificaciones + update BD)
+    Las clínicas dadas de alta después del arranque entran al reiniciar.
     """
-    subject = FollowUpSubject(DB_PATH)
-    table = pw.io.python.read(
-        subject,
-        schema=FollowUpSchema,
-        autocommit_duration_ms=1_000,
-    )
-
-    pw.io.python.write(table, FollowUpObserver(DB_PATH))
-    return table
+    tables = []
+    for clinic_id, db_path in _shards(clinics):
+        table = pw.io.python.read(
+            FollowUpSubject(db_path),
+            schema=FollowUpSchema,
+            autocommit_duration_ms=1_000,
+        )
+        pw.io.python.write(table, FollowUpObserver(db_path, scope=clinic_id))
+        tables.append(table)
+    return tables
 
 
 if __name__ == "__main__":
@@ -0,0 +1,334 @@
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+
+import pathway as pw
+
+from . import changelog
+from .database import sqlite_timestamp
+from .logs import get_logger, log_event
+from .pathway_followups import _shards
+from .services.rollups import NO_SHOW_SQL
+
+log = get_logger(__name__)
+
+
+# Días que mantenemos "vivos" en el pipeline (1 = sólo hoy)
+WINDOW_DAYS = 1
+POLL_SECONDS = 2.0
+CHANGELOG_BATCH = 5_000
+
+_APPOINTMENT_COLUMNS = (
+    "id, doctor_id, date, scheduled_time, status, "
+    "patient_arrival_time, visit_start_time, "
+    f"{NO_SHOW_SQL} AS no_show"
+)
+
+# Estados tal y como los guarda SQLAlchemy en SQLite (nombre del Enum)
+_QUEUE_STATUSES = ("SCHEDULED", "IN_PROGRESS")
+_STARTED_STATUSES = ("IN_PROGRESS", "COMPLETED")
+
+
+# ---------- Esquema Pathway: una fila por cita, ya con columnas derivadas ----------
+
+
+class AppointmentKPISchema(pw.Schema):
+    id: int = pw.column_definition(primary_key=True)
+    doctor_id: int
+    day: str
+    # 0 si la cita se canceló (no cuenta en el total del día)
+    booked: int
+    in_queue: int
+    # saltada sin que el paciente llegara (un skip con el paciente presente no cuenta)
+    no_show: int
+    wait_minutes: float
+    has_wait: int
+    # hora programada (segundos) de las visitas empezadas, -1 si no empezó
+    started_key: int
+    delay_minutes: int
+
+
+def _parse_dt(value) -> datetime | None:
+    if value is None:
+        return None
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _derive(row: sqlite3.Row) -> dict:
+    """
+    Convierte una fila de `appointment` en los contadores que agrega Pathway.
+    """
+    status = row["status"]
+    arrival = _parse_dt(row["patient_arrival_time"])
+    start = _parse_dt(row["visit_start_time"])
+    scheduled = datetime.combine(
+        date.fromisoformat(row["date"]),
+        datetime.strptime(row["scheduled_time"][:8], "%H:%M:%S").time(),
+    )
+
+    wait = 0.0
+    has_wait = 0
+    if arrival and start:
+        wait = max((start - arrival).total_seconds() / 60, 0.0)
+        has_wait = 1
+
+    started_key = -1
+    delay = 0
+    if status in _STARTED_STATUSES and start:
+        started_key = scheduled.hour * 3600 + scheduled.minute * 60 + scheduled.second
+        delay = max(int((start - scheduled).total_seconds() // 60), 0)
+
+    return dict(
+        id=row["id"],
+        doctor_id=row["doctor_id"],
+        day=row["date"],
+        booked=int(status != "CANCELLED"),
+        in_queue=int(status in _QUEUE_STATUSES),
+        no_show=row["no_show"],
+        wait_minutes=wait,
+        has_wait=has_wait,
+        started_key=started_key,
+        delay_minutes=delay,
+    )
+
+
+def _window_start() -> str:
+    return (date.today() - timedelta(days=WINDOW_DAYS - 1)).isoformat()
+
+
+# ---------- Conector de entrada: cambios de citas desde SQLite ----------
+
+
+class AppointmentChangesSubject(pw.io.python.ConnectorSubject):
+    """
+    Lee las citas de la ventana activa y envía a Pathway sólo las que han
+    cambiado desde la última ronda (sesión upsert por id de cita).
+
+    Con changelog instalado, tras la carga inicial sólo relee las citas que
+    aparecen en él; si no, relee la ventana entera en cada ronda.
+
+    Las citas enviadas que desaparecen (borradas, archivadas, movidas fuera
+    de la ventana) o cuyo día sale de la ventana se retiran de Pathway con
+    delete(), así que ni cuentan en los agregados ni se quedan en memoria.
+    """
+
+    CONSUMER_NAME = "pathway_kpis"
+
+    def __init__(self, db_path: str) -> None:
+        super().__init__(session_type="upsert")
+        self.db_path = db_path
+        # id -> última fila enviada (para detectar cambios y para retirarla)
+        self._last_sent: Dict[int, dict] = {}
+        self._seq: Optional[int] = None
+
+    def run(self) -> None:
+        while True:
+            backlog = self.poll_once()
+            if not backlog:
+                time.sleep(POLL_SECONDS)
+
+    def poll_once(self) -> bool:
+        """
+        Una ronda: envía lo cambiado, retira lo que ya no está y hace commit.
+        Devuelve True si queda changelog por leer.
+        """
+        start_day = _window_start()
+
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+
+        backlog = False
+        # ids revisados en esta ronda (None = toda la ventana)
+        checked = None
+        if self._seq is None and changelog.is_installed(conn):
+            self._seq = changelog.register_consumer(conn, self.CONSUMER_NAME)
+            rows = self._read_window(conn, start_day)
+        elif self._seq is not None:
+            batch = changelog.read_batch(
+                conn, self._seq, tables=("appointment",), limit=CHANGELOG_BATCH
+            )
+            checked = set(changelog.changed_ids(batch.changes, "appointment"))
+            rows = changelog.fetch_rows(
+                conn,
+                "appointment",
+                _APPOINTMENT_COLUMNS,
+                sorted(checked),
+                where="date >= ?",
+                params=(start_day,),
+            )
+            backlog = batch.more
+            if batch.seq > self._seq:
+                self._seq = batch.seq
+                if not changelog.ack(conn, self.CONSUMER_NAME, self._seq):
+                    # nos dieron de baja por inactivos: recarga completa
+                    self._seq = None
+        else:
+            rows = self._read_window(conn, start_day)
+        conn.close()
+
+        found = {row["id"] for row in rows}
+        gone = (set(self._last_sent) if checked is None else checked & set(self._last_sent)) - found
+        gone.update(i for i, values in self._last_sent.items() if values["day"] < start_day)
+        for appointment_id in gone:
+            self.delete(**self._last_sent.pop(appointment_id))
+
+        for row in rows:
+            values = _derive(row)
+            if self._last_sent.get(row["id"]) == values:
+                continue
+            self.next(**values)
+            self._last_sent[row["id"]] = values
+
+        self.commit()
+        return backlog
+
+    def _read_window(self, conn: sqlite3.Connection, start_day: str) -> list:
+        return conn.execute(
+            f"SELECT {_APPOINTMENT_COLUMNS} FROM appointment WHERE date >= ?",
+            (start_day,),
+        ).fetchall()
+
+
+# ---------- Observador de salida: escribe la tabla doctorkpi ----------
+
+
+class KPIObserver(pw.io.python.ConnectorObserver):
+    """
+    Recibe los agregados por (doctor, día) y los guarda en `doctorkpi`
+    con un upsert.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        super().__init__()
+        self.db_path = db_path
+        self._conn = None
+        # (doctor, día) retirados / añadidos en el instante en curso
+        self._retracted: set = set()
+        self._added: set = set()
+
+    def on_change(self, key: pw.Pointer, row: dict, time: int, is_addition: bool):
+        group = (row["doctor_id"], row["day"])
+        # Las retracciones se sustituyen por la adición del mismo instante (upsert)
+        if not is_addition:
+            self._retracted.add(group)
+            return
+        self._added.add(group)
+
+        total = row["total"]
+        wait_count = row["wait_count"]
+        avg_wait = row["wait_sum"] / wait_count if wait_count else None
+        no_show_rate = row["no_shows"] / total if total else 0.0
+
+        self._connection().execute(
+            """
+            INSERT INTO doctorkpi (
+                doctor_id, day, total_appointments, queue_length,
+                current_delay_minutes, avg_wait_minutes, no_show_rate, updated_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (doctor_id, day) DO UPDATE SET
+                total_appointments = excluded.total_appointments,
+                queue_length = excluded.queue_length,
+                current_delay_minutes = excluded.current_delay_minutes,
+                avg_wait_minutes = excluded.avg_wait_minutes,
+                no_show_rate = excluded.no_show_rate,
+                updated_at = excluded.updated_at
+            """,
+            (
+                row["doctor_id"],
+                row["day"],
+                total,
+                row["queue_length"],
+                row["current_delay"],
+                avg_wait,
+                no_show_rate,
+                sqlite_timestamp(datetime.utcnow()),
+            ),
+        )
+        self._connection().commit()
+
+    def on_time_end(self, time: int):
+        # grupos retirados sin adición: se quedaron sin citas. Los de días ya
+        # fuera de la ventana conservan su último valor; los de la ventana
+        # (p.ej. todas sus citas borradas) se quitan
+        start_day = _window_start()
+        vanished = [
+            group for group in self._retracted - self._added if group[1] >= start_day
+        ]
+        if vanished:
+            self._connection().executemany(
+                "DELETE FROM doctorkpi WHERE doctor_id = ? AND day = ?", vanished
+            )
+            self._connection().commit()
+        self._retracted.clear()
+        self._added.clear()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._conn
+
+    def on_end(self):
+        if self._conn is not None:
+            self._conn.close()
+        log_event(log, "kpi.stream_ended")
+
+
+# ---------- Construcción del pipeline y arranque ----------
+
+
+def _aggregate(appointments: pw.Table) -> pw.Table:
+    """
+    Agregado incremental por (doctor, día) de las citas de un shard.
+    """
+    kpis = appointments.groupby(pw.this.doctor_id, pw.this.day).reduce(
+        pw.this.doctor_id,
+        pw.this.day,
+        total=pw.reducers.sum(pw.this.booked),
+        queue_length=pw.reducers.sum(pw.this.in_queue),
+        no_shows=pw.reducers.sum(pw.this.no_show),
+        wait_sum=pw.reducers.sum(pw.this.wait_minutes),
+        wait_count=pw.reducers.sum(pw.this.has_wait),
+        last_started=pw.reducers.argmax(pw.this.started_key),
+    )
+    # retraso actual = retraso de la última visita empezada (como eta_service)
+    kpis = kpis.select(
+        pw.this.doctor_id,
+        pw.this.day,
+        pw.this.total,
+        pw.this.queue_length,
+        pw.this.no_shows,
+        pw.this.wait_sum,
+        pw.this.wait_count,
+        current_delay=appointments.ix(pw.this.last_started).delay_minutes,
+    )
+    return kpis
+
+
+def build_pipeline(clinics: Optional[list[str]] = None):
+    """
+    Construye el pipeline de KPIs, con una rama por shard (como
+    pathway_followups): cada clínica lee sus citas y escribe su propia
+    tabla doctorkpi, que es la que lee /doctor/kpis con su X-Clinic-Id.
+    - Entrada: AppointmentChangesSubject (SQLite -> Pathway)
+    - Agregado incremental por (doctor, día): ventana diaria
+    - Salida: KPIObserver (Pathway -> tabla doctorkpi)
+    Las clínicas dadas de alta después del arranque entran al reiniciar.
+    """
+    tables = []
+    for _, db_path in _shards(clinics):
+        appointments = pw.io.python.read(
+            AppointmentChangesSubject(db_path),
+            schema=AppointmentKPISchema,
+            autocommit_duration_ms=1_000,
+        )
+        kpis = _aggregate(appointments)
+        pw.io.python.write(kpis, KPIObserver(db_path))
+        tables.append(kpis)
+    return tables
+
+
+if __name__ == "__main__":
+    build_pipeline()
+    pw.run()
@@ -0,0 +1,282 @@
+"""
+Búsqueda de pacientes por nombre con SQLite FTS5 (tokenizer trigram).
+
+`patient_fts` es una tabla FTS5 de contenido externo sobre `patient`;
+triggers la mantienen sincronizada en cada INSERT/UPDATE/DELETE.
+
+No se ordena por bm25 (con un millón de pacientes y consultas cortas tarda
+cientos de ms) sino por una puntuación barata, en dos niveles:
+1. las palabras de la consulta aparecen como subcadena; primero los nombres
+   que empiezan por la consulta, luego los que tienen palabras que empiezan
+   por ellas. Se filtra con el índice y se ordena y pagina en SQL
+   (ORDER BY ... LIMIT/OFFSET), así que las páginas son estables. Si todas
+   las palabras tienen menos de 3 letras el índice no sirve y se recorre la
+   tabla con LIKE.
+2. después, tolerante a erratas y acentos: candidatos que contienen alguna
+   mitad de cada palabra, verificados con distancia de edición. El grupo de
+   candidatos es fijo (los primeros FUZZY_SCAN), no depende de la página.
+
+Las funciones reciben una conexión DB-API de SQLite, como changelog.py.
+"""
+import unicodedata
+from functools import lru_cache
+from typing import NamedTuple
+
+MIN_QUERY_LENGTH = 3
+FUZZY_SCAN = 1_000
+# distancia de edición máxima por palabra según su longitud
+_MAX_EDITS = ((8, 2), (4, 1), (0, 0))
+
+
+class PatientMatch(NamedTuple):
+    id: int
+    display_name: str
+    score: float  # 0 = mejor
+
+
+def install(conn) -> None:
+    """
+    Crea la tabla FTS y sus triggers (idempotente). Si la tabla es nueva
+    y ya hay pacientes, la indexa entera.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_fts'"
+    ).fetchone()
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS patient_fts USING fts5(
+            display_name,
+            content = 'patient',
+            content_rowid = 'id',
+            tokenize = 'trigram'
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS patient_fts_I AFTER INSERT ON patient
+        BEGIN
+            INSERT INTO patient_fts (rowid, display_name)
+            VALUES (new.id, new.display_name);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS patient_fts_D AFTER DELETE ON patient
+        BEGIN
+            INSERT INTO patient_fts (patient_fts, rowid, display_name)
+            VALUES ('delete', old.id, old.display_name);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS patient_fts_U AFTER UPDATE OF display_name ON patient
+        BEGIN
+            INSERT INTO patient_fts (patient_fts, rowid, display_name)
+            VALUES ('delete', old.id, old.display_name);
+            INSERT INTO patient_fts (rowid, display_name)
+            VALUES (new.id, new.display_name);
+        END
+        """
+    )
+    if not exists:
+        conn.execute("INSERT INTO patient_fts (patient_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+# ---------- Normalización y distancia ----------
+
+
+def fold(text: str) -> str:
+    """
+    Minúsculas y sin acentos ("José" -> "jose").
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Levenshtein acotado: devuelve limit + 1 en cuanto se supera `limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _max_edits(word: str) -> int:
+    for length, edits in _MAX_EDITS:
+        if len(word) >= length:
+            return edits
+    return 0
+
+
+@lru_cache(maxsize=65_536)
+def _word_distance(query_word: str, name_word: str, limit: int) -> int:
+    # los nombres se repiten mucho: la caché evita la mayoría de cálculos
+    return min(
+        _edit_distance(query_word, name_word, limit),
+        _edit_distance(query_word, name_word[:len(query_word)], limit),
+    )
+
+
+def _fuzzy_score(query_words: list[str], name: str):
+    """
+    Suma de distancias de cada palabra de la consulta a su mejor palabra
+    del nombre (o prefijo, para consultas a medio escribir).
+    None si alguna palabra no encaja.
+    """
+    name_words = fold(name).split()
+    total = 0
+    for qw in query_words:
+        limit = _max_edits(qw)
+        best = limit + 1
+        for nw in name_words:
+            best = min(best, _word_distance(qw, nw, limit))
+            if best == 0:
+                break
+        if best > limit:
+            return None
+        total += best
+    return total
+
+
+# ---------- Búsqueda ----------
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _halves(word: str) -> list[str]:
+    """
+    Trozos de >= 3 letras de los que, con una sola errata, al menos uno
+    sigue intacto.
+    """
+    if len(word) >= 6:
+        middle = len(word) // 2
+        return [word[:middle], word[middle:]]
+    if len(word) >= 3:
+        return [word[:3], word[-3:]]
+    return []
+
+
+def _like(pattern: str) -> str:
+    return pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _exact_filter(words: list[str]) -> tuple[str, str, list]:
+    """
+    (FROM, WHERE, parámetros) del nivel 1: el índice con las palabras
+    largas y LIKE para las cortas (o sólo LIKE si no hay largas).
+    """
+    long_words = [w for w in words if len(w) >= MIN_QUERY_LENGTH]
+    clauses, params = [], []
+    if long_words:
+        source = "patient_fts"
+        clauses.append("patient_fts MATCH ?")
+        params.append(" AND ".join(_quote(w) for w in long_words))
+    else:
+        source = "patient"
+    for word in words:
+        if len(word) < MIN_QUERY_LENGTH:
+            clauses.append("display_name LIKE ? ESCAPE '\\'")
+            params.append(f"%{_like(word)}%")
+    return source, " AND ".join(clauses), params
+
+
+def _exact_score(query: str, words: list[str]) -> tuple[str, list]:
+    """
+    Puntuación del nivel 1 en SQL: 0 si el nombre empieza por la consulta,
+    0.5 si cada palabra de la consulta empieza alguna palabra del nombre,
+    1 si sólo es subcadena. Sólo funciones nativas (LIKE ya ignora
+    mayúsculas): el nivel 1 puede tener decenas de miles de filas.
+    """
+    prefixes = " AND ".join("(' ' || display_name) LIKE ? ESCAPE '\\'" for _ in words)
+    sql = f"""
+        CASE WHEN display_name LIKE ? ESCAPE '\\' THEN 0.0
+             WHEN {prefixes} THEN 0.5
+             ELSE 1.0 END
+    """
+    return sql, [f"{_like(query)}%", *(f"% {_like(w)}%" for w in words)]
+
+
+def search_patients(conn, query: str, limit: int = 20, offset: int = 0) -> list[PatientMatch]:
+    """
+    Hasta `limit` pacientes a partir de `offset` (más uno, para que el
+    llamante sepa si hay más), ordenados por score, longitud del nombre e id:
+    primero todos los del nivel 1 y después los aproximados.
+    """
+    query = " ".join(query.split())
+    if len(query) < MIN_QUERY_LENGTH:
+        return []
+
+    wanted = limit + 1
+    words = query.split()
+    folded = fold(query).split()
+
+    # 1) todas las palabras como subcadena, ordenado y paginado en SQL
+    source, where, params = _exact_filter(words)
+    row_id = "rowid" if source == "patient_fts" else "id"
+    score, score_params = _exact_score(query, words)
+    page = [
+        PatientMatch(*row)
+        for row in conn.execute(
+            f"""
+            SELECT {row_id}, display_name, {score} AS score
+            FROM {source} WHERE {where}
+            ORDER BY score, length(display_name), {row_id}
+            LIMIT ? OFFSET ?
+            """,
+            (*score_params, *params, wanted, offset),
+        )
+    ]
+    if len(page) == wanted:
+        return page
+
+    # 2) erratas y acentos, detrás de todos los del nivel 1
+    groups = [_halves(w) for w in folded if _halves(w)]
+    if not groups:
+        return page
+    if page:
+        exact_total = offset + len(page)
+    else:
+        exact_total = conn.execute(
+            f"SELECT COUNT(*) FROM {source} WHERE {where}", params
+        ).fetchone()[0]
+    match = " AND ".join(
+        "(" + " OR ".join(_quote(part) for part in group) + ")"
+        for group in groups
+    )
+    rows = conn.execute(
+        f"""
+        SELECT rowid, display_name FROM patient_fts
+        WHERE patient_fts MATCH ?
+          AND rowid NOT IN (SELECT {row_id} FROM {source} WHERE {where})
+        ORDER BY rowid
+        LIMIT ?
+        """,
+        (match, *params, FUZZY_SCAN),
+    )
+    fuzzy = []
+    for patient_id, name in rows:
+        distance = _fuzzy_score(folded, name)
+        if distance is not None:
+            fuzzy.append(PatientMatch(patient_id, name, 2.0 + distance))
+    fuzzy.sort(key=lambda m: (m.score, len(m.display_name), m.id))
+    start = max(0, offset - exact_total)
+    return page + fuzzy[start:start + wanted - len(page)]
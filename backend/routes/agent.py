@@ -5,7 +5,7 @@ from pydantic import BaseModel
 from sqlmodel import Session, select
 
 from ..database import get_session
-from ..models import Appointment, Patient, Doctor
+from ..models import Appointment, AppointmentArchive, Patient, Doctor
 from ..services.eta_service import recommend_time_slots, compute_eta_for_appointment
 
 router = APIRouter()
@@ -26,12 +26,17 @@ def _find_doctor_for_patient(session: Session, patient_id: int) -> Doctor | None
     Para simplificar: asumimos que el paciente suele ver al mismo doctor:
     cogemos el último doctor con el que tuvo cita.
     """
-    stmt = (
-        select(Appointment)
-        .where(Appointment.patient_id == patient_id)
-        .order_by(Appointment.date.desc())
-    )
-    last_app = session.exec(stmt).first()
+    last_app = None
+    # las citas vivas son siempre más recientes que las archivadas
+    for model in (Appointment, AppointmentArchive):
+        stmt = (
+            select(model)
+            .where(model.patient_id == patient_id)
+            .order_by(model.date.desc())
+        )
+        last_app = session.exec(stmt).first()
+        if last_app:
+            break
     if not last_app:
         return None
     return session.get(Doctor, last_app.doctor_id)
@@ -0,0 +1,129 @@
+import os
+import tempfile
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel
+from sqlmodel import Session, select
+from starlette.background import BackgroundTask
+
+from ..database import SHARDING_ENABLED, current_engine, fan_out
+from ..models import DoctorDayRollup
+from ..services.analytics_export import (
+    FORMATS,
+    TABLES,
+    iter_arrow_stream,
+    require_pyarrow,
+    write_export,
+)
+from ..services.rollups import summarize
+
+router = APIRouter()
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+
+class ClinicsStats(BaseModel):
+    from_date: date
+    to_date: date
+    clinics: dict[str, dict]
+    total: dict
+
+
+def _stream(engine, table: str, start: date, end: date):
+    conn = engine.raw_connection()
+    try:
+        yield from iter_arrow_stream(conn, table, start, end)
+    finally:
+        conn.close()
+
+
+@router.get("/export/{table}")
+def export_table(
+    table: str,
+    start: date = Query(..., alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+    format: str = "arrow",
+):
+    """
+    Exporta el histórico de `table` (appointments | followups | escalations)
+    para citas con fecha en [from, to] (to por defecto = from).
+    - arrow: Arrow IPC en streaming, por bloques
+    - parquet: fichero Parquet (se genera en disco temporal y se envía)
+    """
+    if table not in TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown export table '{table}'")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {FORMATS}")
+    end = end or start
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' must be on or after 'from'")
+
+    try:
+        require_pyarrow()
+    except RuntimeError as exc:
+        raise HTTPException(status_code=501, detail=str(exc))
+
+    filename = f"{table}_{start.isoformat()}_{end.isoformat()}"
+
+    if format == "arrow":
+        return StreamingResponse(
+            _stream(current_engine(), table, start, end),
+            media_type=ARROW_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{filename}.arrows"'},
+        )
+
+    # Parquet necesita escribir el footer al final: pasa por un fichero temporal
+    fd, path = tempfile.mkstemp(suffix=".parquet")
+    os.close(fd)
+    conn = current_engine().raw_connection()
+    try:
+        write_export(conn, table, start, end, path, "parquet")
+    except Exception:
+        os.remove(path)
+        raise
+    finally:
+        conn.close()
+
+    return FileResponse(
+        path,
+        media_type=PARQUET_MEDIA_TYPE,
+        filename=f"{filename}.parquet",
+        background=BackgroundTask(os.remove, path),
+    )
+
+
+@router.get("/clinics/stats", response_model=ClinicsStats)
+def get_clinics_stats(
+    from_date: date = Query(..., alias="from"),
+    to_date: date = Query(..., alias="to"),
+):
+    """
+    Informe de administración: el resumen de /doctors/{id}/stats por clínica
+    y el total de todas, a partir de los rollups diarios de cada shard
+    (consultados en paralelo). Los histogramas se mezclan, así que los
+    percentiles del total son los de todas las clínicas juntas.
+    """
+    if not SHARDING_ENABLED:
+        raise HTTPException(status_code=404, detail="Clinic sharding is disabled")
+    if to_date < from_date:
+        raise HTTPException(status_code=400, detail="'to' must be on or after 'from'")
+
+    def load(clinic_id, engine) -> list[DoctorDayRollup]:
+        with Session(engine) as session:
+            return session.exec(
+                select(DoctorDayRollup)
+                .where(DoctorDayRollup.day >= from_date)
+                .where(DoctorDayRollup.day <= to_date)
+            ).all()
+
+    rollups = fan_out(load)
+    return ClinicsStats(
+        from_date=from_date,
+        to_date=to_date,
+        clinics={clinic_id: summarize(rows) for clinic_id, rows in rollups.items()},
+        total=summarize(row for rows in rollups.values() for row in rows),
+    )
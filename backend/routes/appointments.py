@@ -1,17 +1,34 @@
 from datetime import date, datetime, time
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Response
+from pydantic import BaseModel, Field
+from sqlalchemy import delete
 from sqlmodel import Session, select
 
 from ..database import get_session
-from ..models import Appointment, Doctor, Patient, AppointmentStatus, ArrivalStatus
+from ..models import (
+    Appointment,
+    AppointmentStatus,
+    ArrivalStatus,
+    Doctor,
+    FollowUpChannel,
+    FollowUpTask,
+    Patient,
+)
+from ..schedule_versions import cached_version, etag_matches, make_etag
+from ..services.appointment_series import MAX_OCCURRENCES, finish_series, occurrences
+from ..services.booking_intervals import OutsideWorkingHours, SlotTaken, reserve, reserve_many
 from ..services.eta_service import recommend_time_slots, compute_eta_for_appointment
 from ..services.payments import generate_payment_link
+from ..services.waitlist import offer_freed_slot, send_offer
 
 
 router = APIRouter()
 
+# Para el demo, asumimos una tarifa plana de 50€ por cita.
+APPOINTMENT_FEE_EUR = 50.0
+
 
 class SlotsResponse(BaseModel):
     recommended: list[dict]
@@ -26,6 +43,33 @@ class BookAppointmentRequest(BaseModel):
     slot_minutes: int = 20
 
 
+class BookSeriesRequest(BaseModel):
+    doctor_id: int
+    patient_id: int
+    start_date: date
+    time: time
+    slot_minutes: int = 20
+    every_weeks: int = Field(1, ge=1, le=52)
+    # exactamente uno de los dos
+    count: Optional[int] = Field(None, ge=1, le=MAX_OCCURRENCES)
+    until: Optional[date] = None
+    # follow-ups por defecto para cada cita (null: sin follow-ups)
+    followup_channel: Optional[FollowUpChannel] = FollowUpChannel.SMS
+
+
+class SeriesOccurrence(BaseModel):
+    id: int
+    date: date
+
+
+class BookSeriesResponse(BaseModel):
+    doctor_id: int
+    patient_id: int
+    scheduled_time: str
+    slot_minutes: int
+    appointments: list[SeriesOccurrence]
+
+
 class AppointmentDetailResponse(BaseModel):
     id: int
     doctor_id: int
@@ -42,17 +86,46 @@ class CheckInRequest(BaseModel):
     arrived: bool
 
 
+class CancelAppointmentResponse(BaseModel):
+    id: int
+    status: str
+    # entrada de la lista de espera a la que se ha ofrecido el hueco
+    waitlist_entry_id: Optional[int] = None
+
+
+# Los clientes pueden guardar la respuesta pero deben revalidarla (ETag)
+CACHE_CONTROL = "no-cache"
+# la misma URL responde distinto según la clínica de la cabecera
+VARY = "X-Clinic-Id"
+
+
+def cache_headers(etag: str) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": VARY}
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
 @router.get("/slots", response_model=SlotsResponse)
 def get_slots(
     doctor_id: int,
     day: date,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     session: Session = Depends(get_session),
 ):
     doctor = session.get(Doctor, doctor_id)
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
 
-    result = recommend_time_slots(session, doctor, day)
+    version = cached_version(session, doctor_id, day)
+    etag = make_etag("slots", doctor_id, day, version)
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    response.headers.update(cache_headers(etag))
+
+    result = recommend_time_slots(session, doctor, day, version=version)
     return SlotsResponse(
         recommended=result["recommended"],
         all_slots=result["all_slots"],
@@ -83,13 +156,17 @@ def book_appointment(
         arrival_status=ArrivalStatus.NOT_ARRIVED,
     )
 
-    session.add(appointment)
-    session.commit()
+    # comprobación atómica de solapes y horario (services/booking_intervals.py)
+    try:
+        reserve(session, appointment)
+    except SlotTaken as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except OutsideWorkingHours as e:
+        raise HTTPException(status_code=422, detail=str(e))
     session.refresh(appointment)
 
     # 💳 Generar payment link
-    # Para el demo, asumimos una tarifa plana de 50€ por cita.
-    payment_link = generate_payment_link(appointment.id, amount_eur=50.0)
+    payment_link = generate_payment_link(appointment.id, amount_eur=APPOINTMENT_FEE_EUR)
     appointment.payment_link = payment_link
     session.add(appointment)
     session.commit()
@@ -110,16 +187,80 @@ def book_appointment(
     )
 
 
+@router.post("/series", response_model=BookSeriesResponse)
+def book_series(
+    payload: BookSeriesRequest,
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
+):
+    """
+    Serie de citas recurrentes (misma hora cada `every_weeks` semanas).
+    Todas se validan juntas y se crean en una transacción, o ninguna; los
+    enlaces de pago y los follow-ups se generan en segundo plano después
+    de responder.
+    """
+    try:
+        dates = occurrences(payload.start_date, payload.every_weeks, payload.count, payload.until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not session.get(Doctor, payload.doctor_id):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    if not session.get(Patient, payload.patient_id):
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    appointments = [
+        Appointment(
+            doctor_id=payload.doctor_id,
+            patient_id=payload.patient_id,
+            date=day,
+            scheduled_time=payload.time,
+            current_time=payload.time,
+            slot_minutes=payload.slot_minutes,
+            status=AppointmentStatus.SCHEDULED,
+            arrival_status=ArrivalStatus.NOT_ARRIVED,
+        )
+        for day in dates
+    ]
+    session.expire_on_commit = False  # los ids ya están; no recargar cita a cita
+    try:
+        reserve_many(session, appointments)
+    except SlotTaken as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except OutsideWorkingHours as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    ids = [a.id for a in appointments]
+    background_tasks.add_task(finish_series, ids, APPOINTMENT_FEE_EUR, payload.followup_channel)
+
+    return BookSeriesResponse(
+        doctor_id=payload.doctor_id,
+        patient_id=payload.patient_id,
+        scheduled_time=payload.time.strftime("%H:%M"),
+        slot_minutes=payload.slot_minutes,
+        appointments=[SeriesOccurrence(id=a.id, date=a.date) for a in appointments],
+    )
+
+
 @router.get("/{appointment_id}", response_model=AppointmentDetailResponse)
 def get_appointment_detail(
     appointment_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
     session: Session = Depends(get_session),
 ):
     appointment = session.get(Appointment, appointment_id)
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
 
-    eta = compute_eta_for_appointment(session, appointment)
+    # la cita y su ETA sólo cambian si cambia la agenda de su doctor/día
+    version = cached_version(session, appointment.doctor_id, appointment.date)
+    etag = make_etag("appointment", appointment.id, appointment.doctor_id, appointment.date, version)
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    response.headers.update(cache_headers(etag))
+
+    eta = compute_eta_for_appointment(session, appointment, version=version)
 
     return AppointmentDetailResponse(
         id=appointment.id,
@@ -134,6 +275,49 @@ def get_appointment_detail(
     )
 
 
+@router.post("/{appointment_id}/cancel", response_model=CancelAppointmentResponse)
+def cancel_appointment(
+    appointment_id: int,
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
+):
+    """
+    Cancela la cita (con sus follow-ups aún sin enviar) y ofrece su hueco
+    a la lista de espera.
+    """
+    appointment = session.get(Appointment, appointment_id)
+    if not appointment:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    if appointment.status != AppointmentStatus.SCHEDULED:
+        raise HTTPException(
+            status_code=409,
+            detail=f"only scheduled appointments can be cancelled (status is {appointment.status.value})",
+        )
+
+    appointment.status = AppointmentStatus.CANCELLED
+    session.add(appointment)
+    session.exec(
+        delete(FollowUpTask).where(
+            FollowUpTask.appointment_id == appointment.id, FollowUpTask.executed == False  # noqa: E712
+        )
+    )
+    session.commit()
+    session.refresh(appointment)
+
+    doctor = session.get(Doctor, appointment.doctor_id)
+    offer = offer_freed_slot(
+        session, doctor, appointment.date, appointment.scheduled_time, appointment.slot_minutes
+    )
+    if offer is not None:
+        background_tasks.add_task(send_offer, offer, doctor.name)
+
+    return CancelAppointmentResponse(
+        id=appointment.id,
+        status=appointment.status.value,
+        waitlist_entry_id=offer.id if offer else None,
+    )
+
+
 @router.post("/{appointment_id}/checkin", response_model=AppointmentDetailResponse)
 def check_in_appointment(
     appointment_id: int,
@@ -1,7 +1,12 @@
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from typing import NamedTuple, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Response
 from pydantic import BaseModel
+from pydantic_core import to_json
 from sqlmodel import Session, select
 
 from ..database import get_session
@@ -10,9 +15,19 @@ from ..models import (
     AppointmentStatus,
     ArrivalStatus,
     Doctor,
+    DoctorKPI,
     Patient,
 )
-from ..services.eta_service import compute_eta_for_appointment
+from ..schedule_versions import cached_version, etag_matches, make_etag
+from ..services.eta_service import (
+    OFF_QUEUE_STATUSES,
+    compute_etas_for_day,
+    doctor_delay_from_appointments,
+    queue_etas,
+)
+from ..services.rollups import rollup_closed_day
+from ..services.waitlist import offer_freed_slot, send_offer
+from .appointments import cache_headers
 
 router = APIRouter()
 
@@ -32,6 +47,51 @@ class DoctorScheduleResponse(BaseModel):
     rows: list[DoctorScheduleRow]
 
 
+class BoardRow(BaseModel):
+    appointment_id: int
+    patient_name: str
+    time: str
+    status: str
+    arrival_status: str
+    eta_time: str
+    queue_position: int
+    delay_minutes: int
+
+
+class BoardDoctor(BaseModel):
+    doctor_id: int
+    doctor_name: str
+    specialty: str
+    current_delay_minutes: int
+    rows: list[BoardRow]
+
+
+class DoctorBoardResponse(BaseModel):
+    date: date
+    doctors: list[BoardDoctor]
+
+
+class CompactBoardDoctor(BaseModel):
+    doctor_id: int
+    doctor_name: str
+    specialty: str
+    current_delay_minutes: int
+    rows: list[list]
+
+
+class CompactDoctorBoardResponse(BaseModel):
+    """
+    Formato compacto para pantallas con muchos doctores: cada fila es una
+    lista de valores en el orden de `columns` (sin repetir nombres de campo).
+    """
+    date: date
+    columns: list[str]
+    doctors: list[CompactBoardDoctor]
+
+
+BOARD_COLUMNS = list(BoardRow.model_fields)
+
+
 class ActionRequest(BaseModel):
     appointment_id: int
 
@@ -40,38 +100,177 @@ class ActionRequest(BaseModel):
 def get_today_schedule(
     doctor_id: int,
     day: date,
+    response: Response,
+    if_none_match: str | None = Header(None),
     session: Session = Depends(get_session),
 ):
     doctor = session.get(Doctor, doctor_id)
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
 
+    # ETag por versión de agenda: si no ha cambiado, 304 sin calcular ETAs
+    etag = make_etag("schedule", doctor_id, day, cached_version(session, doctor_id, day))
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+    response.headers.update(cache_headers(etag))
+
     stmt = (
-        select(Appointment)
+        select(Appointment, Patient.display_name)
+        .join(Patient, Patient.id == Appointment.patient_id, isouter=True)
         .where(Appointment.doctor_id == doctor_id)
         .where(Appointment.date == day)
+        .where(Appointment.status != AppointmentStatus.CANCELLED)
         .order_by(Appointment.current_time)
     )
-    appointments = session.exec(stmt).all()
+    results = session.exec(stmt).all()
+    etas = compute_etas_for_day([app for app, _ in results])
 
-    rows: list[DoctorScheduleRow] = []
-    for app in appointments:
-        patient = session.get(Patient, app.patient_id)
-        eta = compute_eta_for_appointment(session, app)
-        rows.append(
-            DoctorScheduleRow(
-                appointment_id=app.id,
-                patient_name=patient.display_name if patient else "Unknown",
-                time=app.current_time.strftime("%H:%M"),
-                status=app.status.value,
-                arrival_status=app.arrival_status.value,
-                eta=eta,
-            )
+    rows = [
+        DoctorScheduleRow(
+            appointment_id=app.id,
+            patient_name=patient_name or "Unknown",
+            time=app.current_time.strftime("%H:%M"),
+            status=app.status.value,
+            arrival_status=app.arrival_status.value,
+            eta=etas[app.id],
         )
+        for app, patient_name in results
+    ]
 
     return DoctorScheduleResponse(doctor_id=doctor_id, date=day, rows=rows)
 
 
+# Cola del día de todos los doctores, leída en crudo: con 4.000 filas
+# convertir horas y enums a objetos cuesta más que toda la consulta. Las
+# horas llegan como "HH:MM:SS[.ffffff]", las fechas ISO y los enums por nombre.
+_BOARD_SQL = """
+    SELECT a.doctor_id, d.name, d.specialty, a.id, p.display_name,
+           a.scheduled_time, a.current_time, a.status, a.arrival_status,
+           a.slot_minutes, a.visit_start_time
+    FROM appointment a
+    JOIN doctor d ON d.id = a.doctor_id
+    LEFT JOIN patient p ON p.id = a.patient_id
+    WHERE a.date = ? AND a.status != 'CANCELLED'
+    ORDER BY a.doctor_id, a.current_time
+"""
+
+_STATUS_VALUES = {s.name: s.value for s in AppointmentStatus}
+_ARRIVAL_VALUES = {s.name: s.value for s in ArrivalStatus}
+_OFF_QUEUE = {s.name for s in OFF_QUEUE_STATUSES}
+_STARTED = {AppointmentStatus.IN_PROGRESS.name, AppointmentStatus.COMPLETED.name}
+
+
+class _Started(NamedTuple):
+    # lo que necesita doctor_delay_from_appointments de la última visita empezada
+    date: date
+    scheduled_time: time
+    status: AppointmentStatus
+    visit_start_time: Optional[datetime]
+
+
+@lru_cache(maxsize=4096)
+def _seconds(hhmmss: str) -> int:
+    # las horas de un día se repiten entre doctores: se parsean una vez
+    return int(hhmmss[:2]) * 3600 + int(hhmmss[3:5]) * 60 + int(hhmmss[6:8])
+
+
+def _board_delay(day: date, last_started) -> int:
+    if last_started is None or last_started[10] is None:
+        return 0
+    return doctor_delay_from_appointments([_Started(
+        day,
+        time.fromisoformat(last_started[5]),
+        AppointmentStatus[last_started[7]],
+        datetime.fromisoformat(last_started[10]),
+    )])
+
+
+@router.get("/board", response_model=DoctorBoardResponse | CompactDoctorBoardResponse)
+def get_waiting_room_board(
+    day: date,
+    compact: bool = False,
+    session: Session = Depends(get_session),
+):
+    """
+    Pantalla de sala de espera: colas de todos los doctores para un día.
+    Se construye con una única consulta ordenada (cita + paciente + doctor)
+    que se agrupa en memoria; las ETAs se calculan en una pasada por doctor.
+    Con compact=true las filas van como listas según `columns`.
+    """
+    results = session.connection().exec_driver_sql(_BOARD_SQL, (day.isoformat(),)).fetchall()
+
+    doctors = []
+    for doctor_id, group in groupby(results, key=itemgetter(0)):
+        queue = list(group)
+        etas = queue_etas([
+            (_seconds(r[5]), _seconds(r[6]), r[7] not in _OFF_QUEUE, r[9]) for r in queue
+        ])
+        rows = []
+        last_started = None
+        for r, (eta_time, delay_minutes, position) in zip(queue, etas):
+            values = [
+                r[3],
+                r[4] or "Unknown",
+                r[6][:5],
+                _STATUS_VALUES[r[7]],
+                _ARRIVAL_VALUES[r[8]],
+                eta_time,
+                position,
+                delay_minutes,
+            ]
+            rows.append(values if compact else dict(zip(BOARD_COLUMNS, values)))
+            # la última visita empezada (por hora programada) da el retraso
+            if r[7] in _STARTED and (last_started is None or r[5] >= last_started[5]):
+                last_started = r
+
+        doctors.append({
+            "doctor_id": doctor_id,
+            "doctor_name": queue[0][1],
+            "specialty": queue[0][2],
+            "current_delay_minutes": _board_delay(day, last_started),
+            "rows": rows,
+        })
+
+    board = {"date": day, "doctors": doctors}
+    if compact:
+        board = {"date": day, "columns": BOARD_COLUMNS, "doctors": doctors}
+    # filas ya con la forma de response_model: sin crear un modelo por fila
+    return Response(content=to_json(board), media_type="application/json")
+
+
+@router.get("/kpis", response_model=list[DoctorKPI])
+def get_live_kpis(
+    day: date,
+    doctor_id: int | None = None,
+    session: Session = Depends(get_session),
+):
+    """
+    KPIs en vivo (retraso, espera media, no-shows, cola) por doctor.
+    Los mantiene el pipeline de Pathway (python -m backend.pathway_kpis),
+    en la BD de cada clínica; aquí sólo se lee la tabla ya agregada.
+    """
+    stmt = select(DoctorKPI).where(DoctorKPI.day == day)
+    if doctor_id is not None:
+        stmt = stmt.where(DoctorKPI.doctor_id == doctor_id)
+    return session.exec(stmt.order_by(DoctorKPI.doctor_id)).all()
+
+
+_OPEN_STATUSES = (AppointmentStatus.SCHEDULED, AppointmentStatus.IN_PROGRESS)
+
+
+def _rollup_if_day_closed(session: Session, background_tasks: BackgroundTasks, app: Appointment) -> None:
+    # jornada cerrada: al doctor no le quedan citas por atender ese día
+    still_open = session.exec(
+        select(Appointment.id)
+        .where(Appointment.doctor_id == app.doctor_id)
+        .where(Appointment.date == app.date)
+        .where(Appointment.status.in_(_OPEN_STATUSES))
+        .limit(1)
+    ).first()
+    if still_open is None:
+        background_tasks.add_task(rollup_closed_day, session.get_bind(), app.doctor_id, app.date)
+
+
 @router.post("/mark_arrived")
 def doctor_mark_arrived(
     body: ActionRequest,
@@ -107,6 +306,7 @@ def start_visit(
 @router.post("/end_visit")
 def end_visit(
     body: ActionRequest,
+    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session),
 ):
     app = session.get(Appointment, body.appointment_id)
@@ -117,6 +317,7 @@ def end_visit(
     app.visit_end_time = datetime.utcnow()
     session.add(app)
     session.commit()
+    _rollup_if_day_closed(session, background_tasks, app)
 
     # Opcional: podrías llamar aquí a la programación de follow-ups por defecto.
     # Para evitar imports circulares, simplemente lo dejas a decisión del front:
@@ -127,19 +328,25 @@ def end_visit(
 @router.post("/skip")
 def skip_patient(
     body: ActionRequest,
+    background_tasks: BackgroundTasks,
     session: Session = Depends(get_session),
 ):
     app = session.get(Appointment, body.appointment_id)
     if not app:
         raise HTTPException(status_code=404, detail="Appointment not found")
 
+    # el hueco se ofrece una vez: saltar otra vez no lo vuelve a ofrecer
+    first_skip = app.status != AppointmentStatus.SKIPPED
     app.status = AppointmentStatus.SKIPPED
-    app.arrival_status = ArrivalStatus.SKIPPED
+    # si el paciente ya llegó, el salto es del médico: no es una ausencia
+    if app.arrival_status != ArrivalStatus.ARRIVED:
+        app.arrival_status = ArrivalStatus.SKIPPED
 
     stmt = (
         select(Appointment)
         .where(Appointment.doctor_id == app.doctor_id)
         .where(Appointment.date == app.date)
+        .where(Appointment.status != AppointmentStatus.CANCELLED)
         .order_by(Appointment.current_time)
     )
     appointments = session.exec(stmt).all()
@@ -151,4 +358,18 @@ def skip_patient(
 
     session.add(app)
     session.commit()
-    return {"status": "ok", "new_time": app.current_time.strftime("%H:%M")}
+
+    # su hueco original queda libre: a la lista de espera
+    offer = None
+    if first_skip:
+        doctor = session.get(Doctor, app.doctor_id)
+        offer = offer_freed_slot(session, doctor, app.date, app.scheduled_time, app.slot_minutes)
+    if offer is not None:
+        background_tasks.add_task(send_offer, offer, doctor.name)
+    _rollup_if_day_closed(session, background_tasks, app)
+
+    return {
+        "status": "ok",
+        "new_time": app.current_time.strftime("%H:%M"),
+        "waitlist_entry_id": offer.id if offer else None,
+    }
@@ -1,15 +1,59 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date
+from typing import Any, Optional, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
 from sqlmodel import Session, select
 
 from ..database import get_session
-from ..models import Doctor, DoctorPreferences
+from ..models import Doctor, DoctorDayRollup, DoctorPreferences
+from ..pagination import DEFAULT_LIMIT, MAX_LIMIT, Page, paginate, parse_fields
+from ..services.rollups import summarize
 
 router = APIRouter()
 
 
-@router.get("/", response_model=list[Doctor])
-def list_doctors(session: Session = Depends(get_session)):
-    return session.exec(select(Doctor)).all()
+class DurationStats(BaseModel):
+    count: int
+    mean: Optional[float]
+    p50: Optional[float]
+    p90: Optional[float]
+    p99: Optional[float]
+
+
+class DoctorStats(BaseModel):
+    doctor_id: int
+    from_date: date
+    to_date: date
+    days: int
+    total_appointments: int
+    completed: int
+    skipped: int
+    no_shows: int
+    no_show_rate: float
+    wait_minutes: DurationStats
+    visit_minutes: DurationStats
+    booked_minutes: int
+    utilization: Optional[float]
+
+
+@router.get("/", response_model=Union[Page, list[dict[str, Any]]])
+def list_doctors(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+    fields: Optional[str] = None,
+    session: Session = Depends(get_session),
+):
+    """
+    Todos los doctores por id, como lista (la respuesta de siempre). Con
+    `limit` o `cursor` la respuesta pasa a ser una Page paginada por cursor.
+    `fields=id,name` limita las columnas en los dos casos.
+    """
+    if limit is None and cursor is None:
+        columns = [Doctor.__table__.c[name] for name in parse_fields(Doctor, fields)]
+        rows = session.execute(select(*columns).order_by(Doctor.id)).mappings().all()
+        return [dict(row) for row in rows]
+    return paginate(session, Doctor, fields=fields, cursor=cursor, limit=limit or DEFAULT_LIMIT)
 
 
 @router.post("/", response_model=Doctor)
@@ -28,6 +72,37 @@ def get_doctor(doctor_id: int, session: Session = Depends(get_session)):
     return doctor
 
 
+@router.get("/{doctor_id}/stats", response_model=DoctorStats)
+def get_doctor_stats(
+    doctor_id: int,
+    from_date: date = Query(..., alias="from"),
+    to_date: date = Query(..., alias="to"),
+    session: Session = Depends(get_session),
+):
+    """
+    Espera, duración de visita (media y p50/p90/p99), no-shows y utilización
+    del doctor en [from, to]. Se mezclan los rollups diarios
+    (python -m backend.services.rollups); los días sin rollup no cuentan.
+    """
+    if to_date < from_date:
+        raise HTTPException(status_code=400, detail="'to' must be on or after 'from'")
+    if not session.get(Doctor, doctor_id):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+
+    rollups = session.exec(
+        select(DoctorDayRollup)
+        .where(DoctorDayRollup.doctor_id == doctor_id)
+        .where(DoctorDayRollup.day >= from_date)
+        .where(DoctorDayRollup.day <= to_date)
+    ).all()
+    return DoctorStats(
+        doctor_id=doctor_id,
+        from_date=from_date,
+        to_date=to_date,
+        **summarize(rollups),
+    )
+
+
 @router.get("/{doctor_id}/preferences", response_model=DoctorPreferences)
 def get_preferences(doctor_id: int, session: Session = Depends(get_session)):
     statement = select(DoctorPreferences).where(DoctorPreferences.doctor_id == doctor_id)
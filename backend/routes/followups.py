@@ -1,24 +1,30 @@
-from datetime import datetime, timedelta
-from typing import List
+from datetime import date, datetime
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
+from sqlalchemy import exists
 from sqlmodel import Session, select
 
-from ..database import get_session
+from ..database import current_clinic, current_engine, get_session
 from ..models import (
     Appointment,
+    AppointmentStatus,
     Patient,
     FollowUpTask,
     FollowUpType,
     FollowUpChannel,
     Escalation,
 )
-from ..services.llm_client import (
-    generate_followup_message,
-    classify_patient_reply,
+from ..pagination import DEFAULT_LIMIT, MAX_LIMIT, Page, paginate
+from ..services.default_followups import (
+    build_default_followups,
+    build_default_followups_many,
+    insert_missing,
 )
-from ..services.notifications import send_sms, send_email, send_voice_call
+from ..services.followup_leases import run_due
+from ..services.llm_client import classify_patient_reply
+from ..services.followup_scheduler import notify_followup_scheduled, notify_followups_bulk
 
 router = APIRouter()
 
@@ -36,6 +42,14 @@ class PatientReplyRequest(BaseModel):
     message: str
 
 
+class ScheduleDayResponse(BaseModel):
+    day: date
+    doctor_id: Optional[int]
+    # citas que no tenían follow-ups y ahora sí
+    appointments: int
+    tasks_created: int
+
+
 class FollowUpTaskResponse(BaseModel):
     id: int
     appointment_id: int
@@ -55,55 +69,64 @@ def _schedule_default_followups(
     channel: FollowUpChannel,
 ) -> List[FollowUpTask]:
     """
-    Crea:
-    - 1 recordatorio antes de la cita (ej. 2h antes)
-    - 1 check-in después de la cita (ej. 4h después de visit_end_time)
+    Crea y guarda los follow-ups por defecto (services/default_followups.py).
     """
-    tasks: List[FollowUpTask] = []
-
-    # Recordatorio 2h antes de la hora programada
-    scheduled_dt = datetime.combine(appointment.date, appointment.scheduled_time)
-    reminder_time = scheduled_dt - timedelta(hours=2)
-    reminder_msg = generate_followup_message(appointment, patient, FollowUpType.REMINDER)
-
-    reminder_task = FollowUpTask(
-        appointment_id=appointment.id,
-        type=FollowUpType.REMINDER,
-        channel=channel,
-        scheduled_time=reminder_time,
-        message=reminder_msg,
-    )
-    session.add(reminder_task)
-    tasks.append(reminder_task)
-
-    # Check-in 4h después de visit_end_time (si ya se ha finalizado),
-    # si no, lo dejamos para más tarde (puedes adaptar esta lógica).
-    if appointment.visit_end_time:
-        checkin_time = appointment.visit_end_time + timedelta(hours=4)
-    else:
-        checkin_time = scheduled_dt + timedelta(hours=4)
-
-    checkin_msg = generate_followup_message(appointment, patient, FollowUpType.CHECKIN)
-
-    checkin_task = FollowUpTask(
-        appointment_id=appointment.id,
-        type=FollowUpType.CHECKIN,
-        channel=channel,
-        scheduled_time=checkin_time,
-        message=checkin_msg,
-    )
-    session.add(checkin_task)
-    tasks.append(checkin_task)
-
+    tasks = build_default_followups(appointment, patient, channel)
+    session.add_all(tasks)
     session.commit()
     for t in tasks:
         session.refresh(t)
+        notify_followup_scheduled(t)
 
     return tasks
 
 
 # ---------- Endpoints ----------
 
+@router.get("/", response_model=Page)
+def list_followups(
+    appointment_id: Optional[int] = None,
+    executed: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    fields: Optional[str] = None,
+    session: Session = Depends(get_session),
+):
+    """
+    Follow-ups por id, paginados por cursor y filtrables por cita/estado.
+    """
+    where = []
+    if appointment_id is not None:
+        where.append(FollowUpTask.appointment_id == appointment_id)
+    if executed is not None:
+        where.append(FollowUpTask.executed == executed)
+    return paginate(
+        session, FollowUpTask, where=where, fields=fields, cursor=cursor, limit=limit
+    )
+
+
+@router.get("/escalations", response_model=Page)
+def list_escalations(
+    status: Optional[str] = None,
+    appointment_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    fields: Optional[str] = None,
+    session: Session = Depends(get_session),
+):
+    """
+    Escalados por id, paginados por cursor (p.ej. ?status=open para la bandeja).
+    """
+    where = []
+    if status is not None:
+        where.append(Escalation.status == status)
+    if appointment_id is not None:
+        where.append(Escalation.appointment_id == appointment_id)
+    return paginate(
+        session, Escalation, where=where, fields=fields, cursor=cursor, limit=limit
+    )
+
+
 @router.post("/schedule", response_model=list[FollowUpTaskResponse])
 def schedule_followups(
     body: ScheduleFollowUpsRequest,
@@ -140,52 +163,58 @@ def schedule_followups(
     ]
 
 
-@router.post("/run_once")
-def run_followup_worker_once(session: Session = Depends(get_session)):
+@router.post("/schedule_day", response_model=ScheduleDayResponse)
+def schedule_followups_for_day(
+    day: date,
+    doctor_id: Optional[int] = None,
+    channel: FollowUpChannel = FollowUpChannel.SMS,
+    session: Session = Depends(get_session),
+):
     """
-    Worker simple:
-    - Busca follow-ups pendientes cuya hora ya ha llegado.
-    - Envía el mensaje por SMS/email/voz.
-    - Marca como ejecutados.
-
-    En un entorno real esto sería un cron job o un Pathway pipeline.
+    Follow-ups por defecto para todas las citas programadas de un día (de
+    un doctor o de toda la clínica) que aún no tienen ninguno. Las citas se
+    eligen con un anti-join y las tareas se insertan con un solo executemany
+    en una transacción; repetir la llamada no duplica nada.
     """
-    now = datetime.utcnow()
-
-    stmt = select(FollowUpTask).where(
-        (FollowUpTask.executed == False)  # noqa: E712
-        & (FollowUpTask.scheduled_time <= now)
+    stmt = (
+        select(Appointment, Patient)
+        .join(Patient, Patient.id == Appointment.patient_id)
+        .where(Appointment.date == day)
+        .where(Appointment.status == AppointmentStatus.SCHEDULED)
+        .where(~exists().where(FollowUpTask.appointment_id == Appointment.id))
     )
-    tasks = session.exec(stmt).all()
-
-    processed = 0
-
-    for task in tasks:
-        app = session.get(Appointment, task.appointment_id)
-        if not app:
-            continue
+    if doctor_id is not None:
+        stmt = stmt.where(Appointment.doctor_id == doctor_id)
+    rows = session.exec(stmt).all()
 
-        patient = session.get(Patient, app.patient_id)
-        if not patient:
-            continue
+    tasks = build_default_followups_many(rows, channel)
+    created = insert_missing(session, tasks)
+    session.commit()
+    if created:
+        notify_followups_bulk()
 
-        # Para el demo no guardamos teléfono/email reales.
-        # Supón que aquí tienes patient.contact_xxx y úsalo.
-        destination = f"patient-{patient.id}"
+    return ScheduleDayResponse(
+        day=day, doctor_id=doctor_id, appointments=len(rows), tasks_created=created
+    )
 
-        if task.channel == FollowUpChannel.SMS:
-            send_sms(destination, task.message)
-        elif task.channel == FollowUpChannel.EMAIL:
-            send_email(destination, "Appointment follow-up", task.message)
-        elif task.channel == FollowUpChannel.VOICE:
-            send_voice_call(destination, task.message)
 
-        task.executed = True
-        task.executed_at = now
-        session.add(task)
-        processed += 1
+@router.post("/run_once")
+def run_followup_worker_once():
+    """
+    Worker simple:
+    - Reclama por lotes los follow-ups pendientes cuya hora ya ha llegado
+      (lease: otra llamada, otro worker o el planificador no los tocan).
+    - Envía el mensaje por SMS/email/voz.
+    - Marca como ejecutados.
 
-    session.commit()
+    Con el planificador en proceso activo (FOLLOWUP_SCHEDULER_ENABLED) no hace
+    falta llamarlo; queda como disparo manual.
+    """
+    conn = current_engine().raw_connection()
+    try:
+        processed = run_due(conn, scope=current_clinic.get())
+    finally:
+        conn.close()
     return {"processed": processed}
 
 
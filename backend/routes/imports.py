@@ -0,0 +1,67 @@
+import tempfile
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from sqlmodel import Session
+
+from ..database import get_session
+from ..services.bulk_import import FORMATS, KINDS, ImportConflict, import_records
+
+router = APIRouter()
+
+# A partir de este tamaño el cuerpo se vuelca a disco en vez de a memoria
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+
+class ImportReport(BaseModel):
+    kind: str
+    dry_run: bool
+    rows_read: int
+    rows_valid: int
+    rows_inserted: int
+    error_count: int
+    errors: list[ImportRowError]
+
+
+@router.post("/{kind}", response_model=ImportReport)
+async def bulk_import(
+    kind: str,
+    request: Request,
+    format: str = "csv",
+    dry_run: bool = False,
+    session: Session = Depends(get_session),
+):
+    """
+    Importación masiva: el cuerpo es un CSV (con cabecera) o NDJSON.
+    - doctors: name, specialty[, id]
+    - patients: display_name[, id]
+    - appointments: doctor_id, patient_id, date, time[, slot_minutes, id]
+
+    No genera payment links ni follow-ups (eso queda para procesos aparte).
+    Las filas válidas se insertan todas o ninguna; si otra reserva cambia un
+    día del fichero mientras tanto, 409 y no se importa nada.
+    """
+    if kind not in KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown import kind '{kind}'")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {FORMATS}")
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as body:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+
+        try:
+            report = await run_in_threadpool(
+                import_records, session, kind, body, format, dry_run
+            )
+        except ImportConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    return ImportReport(**report)
@@ -1,13 +1,106 @@
 import uuid
-from fastapi import APIRouter, Depends
-from sqlmodel import Session
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+from sqlmodel import Session, select
 
 from ..database import get_session
-from ..models import Patient
+from ..models import (
+    ActionItem,
+    Appointment,
+    AppointmentArchive,
+    AppointmentStatus,
+    Doctor,
+    Escalation,
+    FollowUpTask,
+    Patient,
+)
+from ..pagination import DEFAULT_LIMIT, MAX_LIMIT, Page, paginate
+from ..patient_search import MIN_QUERY_LENGTH, search_patients
+from ..schedule_versions import cached_version
+from ..services.eta_service import compute_eta_for_appointment
 
 router = APIRouter()
 
 
+class PatientSearchHit(BaseModel):
+    id: int
+    display_name: str
+    score: float
+
+
+class PatientSearchResponse(BaseModel):
+    items: list[PatientSearchHit]
+    next_offset: Optional[int] = None
+
+
+class VisitAppointment(BaseModel):
+    id: int
+    doctor_id: int
+    doctor_name: str
+    date: date
+    scheduled_time: str
+    current_time: str
+    slot_minutes: int
+    status: str
+    arrival_status: str
+    # True si la cita ya está en appointment_archive (día cerrado)
+    archived: bool
+
+
+class VisitActionItem(BaseModel):
+    id: int
+    title: str
+    description: str
+    status: str
+    due_date: Optional[datetime]
+
+
+class VisitFollowUp(BaseModel):
+    id: int
+    type: str
+    channel: str
+    scheduled_time: datetime
+
+
+class VisitEscalation(BaseModel):
+    id: int
+    status: str
+    created_at: datetime
+    notes: Optional[str]
+
+
+class PatientVisitResponse(BaseModel):
+    appointment: VisitAppointment
+    eta: Optional[dict]
+    payment_link: Optional[str]
+    action_items: list[VisitActionItem]
+    pending_followups: list[VisitFollowUp]
+    open_escalations: list[VisitEscalation]
+
+
+@router.get("/search", response_model=PatientSearchResponse)
+def search(
+    q: str = Query(..., min_length=MIN_QUERY_LENGTH),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    session: Session = Depends(get_session),
+):
+    """
+    Busca pacientes por nombre: primero los que empiezan por `q`, luego los
+    que lo contienen y por último coincidencias aproximadas (erratas/acentos).
+    `next_offset` es null cuando no hay más resultados.
+    """
+    conn = session.connection().connection
+    matches = search_patients(conn, q, limit=limit, offset=offset)
+    return PatientSearchResponse(
+        items=[PatientSearchHit(**m._asdict()) for m in matches[:limit]],
+        next_offset=offset + limit if len(matches) > limit else None,
+    )
+
+
 @router.post("/", response_model=Patient)
 def create_patient(
     display_name: str,
@@ -19,3 +112,136 @@ def create_patient(
     session.refresh(patient)
     return patient
 
+
+@router.get("/{patient_id}/appointments", response_model=Page)
+def list_patient_appointments(
+    patient_id: int,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    status: Optional[AppointmentStatus] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    fields: Optional[str] = None,
+    session: Session = Depends(get_session),
+):
+    """
+    Citas del paciente en orden cronológico, paginadas por cursor
+    (incluye las archivadas).
+    """
+    if not session.get(Patient, patient_id):
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    def where(model) -> list:
+        conditions = [model.patient_id == patient_id]
+        if from_date is not None:
+            conditions.append(model.date >= from_date)
+        if to_date is not None:
+            conditions.append(model.date <= to_date)
+        if status is not None:
+            conditions.append(model.status == status)
+        return conditions
+
+    return paginate(
+        session,
+        Appointment,
+        where=where,
+        order_by=("date", "scheduled_time", "id"),
+        fields=fields,
+        cursor=cursor,
+        limit=limit,
+        archive=AppointmentArchive,
+    )
+
+
+@router.get("/{patient_id}/visit/{appointment_id}", response_model=PatientVisitResponse)
+def get_patient_visit(
+    patient_id: int,
+    appointment_id: int,
+    session: Session = Depends(get_session),
+):
+    """
+    Todo lo que necesita la pantalla "mi visita" de la app en una respuesta:
+    cita, ETA, enlace de pago, action items, follow-ups pendientes y
+    escalados abiertos. Siempre las mismas consultas (cita + doctor, ETA
+    del día compartida/cacheada, y una por cada lista), sin una por fila.
+    Las citas de días archivados salen sin ETA; sus follow-ups y escalados
+    ya están cerrados.
+    """
+    archived = False
+    row = session.exec(
+        select(Appointment, Doctor.name)
+        .join(Doctor, Doctor.id == Appointment.doctor_id)
+        .where(Appointment.id == appointment_id)
+    ).first()
+    if row is None:
+        archived = True
+        row = session.exec(
+            select(AppointmentArchive, Doctor.name)
+            .join(Doctor, Doctor.id == AppointmentArchive.doctor_id)
+            .where(AppointmentArchive.id == appointment_id)
+        ).first()
+    # misma respuesta si la cita no existe o es de otro paciente
+    if row is None or row[0].patient_id != patient_id:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    appointment, doctor_name = row
+
+    eta = None
+    pending_followups, open_escalations = [], []
+    if not archived:
+        version = cached_version(session, appointment.doctor_id, appointment.date)
+        eta = compute_eta_for_appointment(session, appointment, version=version)
+        pending_followups = session.exec(
+            select(FollowUpTask)
+            .where(FollowUpTask.appointment_id == appointment_id)
+            .where(FollowUpTask.executed == False)  # noqa: E712
+            .order_by(FollowUpTask.scheduled_time)
+        ).all()
+        open_escalations = session.exec(
+            select(Escalation)
+            .where(Escalation.appointment_id == appointment_id)
+            .where(Escalation.status != "resolved")
+            .order_by(Escalation.created_at)
+        ).all()
+    action_items = session.exec(
+        select(ActionItem).where(ActionItem.appointment_id == appointment_id).order_by(ActionItem.id)
+    ).all()
+
+    return PatientVisitResponse(
+        appointment=VisitAppointment(
+            id=appointment.id,
+            doctor_id=appointment.doctor_id,
+            doctor_name=doctor_name,
+            date=appointment.date,
+            scheduled_time=appointment.scheduled_time.strftime("%H:%M"),
+            current_time=appointment.current_time.strftime("%H:%M"),
+            slot_minutes=appointment.slot_minutes,
+            status=appointment.status.value,
+            arrival_status=appointment.arrival_status.value,
+            archived=archived,
+        ),
+        eta=eta,
+        payment_link=appointment.payment_link,
+        action_items=[
+            VisitActionItem(
+                id=item.id,
+                title=item.title,
+                description=item.description,
+                status=item.status.value,
+                due_date=item.due_date,
+            )
+            for item in action_items
+        ],
+        pending_followups=[
+            VisitFollowUp(
+                id=task.id,
+                type=task.type.value,
+                channel=task.channel.value,
+                scheduled_time=task.scheduled_time,
+            )
+            for task in pending_followups
+        ],
+        open_escalations=[
+            VisitEscalation(id=esc.id, status=esc.status, created_at=esc.created_at, notes=esc.notes)
+            for esc in open_escalations
+        ],
+    )
@@ -0,0 +1,200 @@
+from datetime import date, time
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from pydantic import BaseModel
+from sqlmodel import Session
+
+from ..database import get_session
+from ..models import (
+    Appointment,
+    AppointmentStatus,
+    ArrivalStatus,
+    Doctor,
+    FollowUpChannel,
+    Patient,
+    WaitlistEntry,
+    WaitlistStatus,
+)
+from ..pagination import DEFAULT_LIMIT, MAX_LIMIT, Page, paginate
+from ..services.booking_intervals import OutsideWorkingHours, SlotTaken, reserve
+from ..services.waitlist import claim_offer, expire_offers, reopen_offer, send_offer, waitlist_index
+
+router = APIRouter()
+
+
+class JoinWaitlistRequest(BaseModel):
+    patient_id: int
+    # un doctor concreto, cualquiera de la especialidad, o ambos
+    doctor_id: Optional[int] = None
+    specialty: Optional[str] = None
+    day: date
+    earliest: time
+    latest: time
+    slot_minutes: int = 20
+    channel: FollowUpChannel = FollowUpChannel.SMS
+
+
+class WaitlistEntryResponse(BaseModel):
+    id: int
+    patient_id: int
+    doctor_id: Optional[int]
+    specialty: Optional[str]
+    day: date
+    earliest: str
+    latest: str
+    slot_minutes: int
+    status: str
+    offered_doctor_id: Optional[int]
+    offered_time: Optional[str]
+    appointment_id: Optional[int]
+
+
+def _to_response(entry: WaitlistEntry) -> WaitlistEntryResponse:
+    return WaitlistEntryResponse(
+        id=entry.id,
+        patient_id=entry.patient_id,
+        doctor_id=entry.doctor_id,
+        specialty=entry.specialty,
+        day=entry.day,
+        earliest=entry.earliest.strftime("%H:%M"),
+        latest=entry.latest.strftime("%H:%M"),
+        slot_minutes=entry.slot_minutes,
+        status=entry.status.value,
+        offered_doctor_id=entry.offered_doctor_id,
+        offered_time=entry.offered_time.strftime("%H:%M") if entry.offered_time else None,
+        appointment_id=entry.appointment_id,
+    )
+
+
+def _get_entry(session: Session, entry_id: int) -> WaitlistEntry:
+    entry = session.get(WaitlistEntry, entry_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Waitlist entry not found")
+    return entry
+
+
+@router.post("/", response_model=WaitlistEntryResponse)
+def join_waitlist(
+    body: JoinWaitlistRequest,
+    session: Session = Depends(get_session),
+):
+    """
+    Apunta a un paciente para un hueco antes (se le ofrecerá el primero que
+    se libere dentro de su ventana).
+    """
+    if body.doctor_id is None and not body.specialty:
+        raise HTTPException(status_code=400, detail="give 'doctor_id' or 'specialty'")
+    if body.latest < body.earliest:
+        raise HTTPException(status_code=400, detail="'latest' must be on or after 'earliest'")
+    if body.day < date.today():
+        raise HTTPException(status_code=400, detail="'day' is in the past")
+    if not session.get(Patient, body.patient_id):
+        raise HTTPException(status_code=404, detail="Patient not found")
+    if body.doctor_id is not None and not session.get(Doctor, body.doctor_id):
+        raise HTTPException(status_code=404, detail="Doctor not found")
+
+    entry = WaitlistEntry(**body.model_dump())
+    session.add(entry)
+    session.commit()
+    session.refresh(entry)
+
+    waitlist_index().add(entry)
+    return _to_response(entry)
+
+
+@router.get("/", response_model=Page)
+def list_waitlist(
+    status: Optional[WaitlistStatus] = None,
+    day: Optional[date] = None,
+    doctor_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    fields: Optional[str] = None,
+    session: Session = Depends(get_session),
+):
+    where = []
+    if status is not None:
+        where.append(WaitlistEntry.status == status)
+    if day is not None:
+        where.append(WaitlistEntry.day == day)
+    if doctor_id is not None:
+        where.append(WaitlistEntry.doctor_id == doctor_id)
+    return paginate(
+        session, WaitlistEntry, where=where, fields=fields, cursor=cursor, limit=limit
+    )
+
+
+@router.post("/{entry_id}/accept", response_model=WaitlistEntryResponse)
+def accept_offer(
+    entry_id: int,
+    session: Session = Depends(get_session),
+):
+    """
+    El paciente acepta el hueco ofrecido: se reserva como cualquier cita.
+    Si ya no está libre, la entrada vuelve a la lista de espera.
+    """
+    entry = _get_entry(session, entry_id)
+    # primero se reclama la oferta: dos aceptaciones a la vez no reservan dos citas
+    if not claim_offer(session, entry_id):
+        session.refresh(entry)
+        if entry.status == WaitlistStatus.OFFERED:
+            raise HTTPException(status_code=409, detail="offer has expired")
+        raise HTTPException(status_code=409, detail=f"entry is {entry.status.value}, not offered")
+    session.refresh(entry)
+
+    appointment = Appointment(
+        doctor_id=entry.offered_doctor_id,
+        patient_id=entry.patient_id,
+        date=entry.day,
+        scheduled_time=entry.offered_time,
+        current_time=entry.offered_time,
+        slot_minutes=entry.slot_minutes,
+        status=AppointmentStatus.SCHEDULED,
+        arrival_status=ArrivalStatus.NOT_ARRIVED,
+    )
+    try:
+        reserve(session, appointment)
+    except (SlotTaken, OutsideWorkingHours) as e:
+        reopen_offer(session, entry)
+        raise HTTPException(status_code=409, detail=f"offered slot is no longer available: {e}")
+
+    session.refresh(entry)
+    entry.appointment_id = appointment.id
+    session.add(entry)
+    session.commit()
+    session.refresh(entry)
+    return _to_response(entry)
+
+
+@router.post("/expire_offers")
+def expire_waitlist_offers(
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
+):
+    """
+    Devuelve a la espera las ofertas caducadas y ofrece sus huecos a los
+    siguientes (para un cron, como /followups/run_once).
+    """
+    offers = expire_offers(session)
+    for offer in offers:
+        doctor = session.get(Doctor, offer.offered_doctor_id)
+        background_tasks.add_task(send_offer, offer, doctor.name)
+    return {"status": "ok", "reoffered": [offer.id for offer in offers]}
+
+
+@router.delete("/{entry_id}", response_model=WaitlistEntryResponse)
+def leave_waitlist(
+    entry_id: int,
+    session: Session = Depends(get_session),
+):
+    entry = _get_entry(session, entry_id)
+    if entry.status == WaitlistStatus.BOOKED:
+        raise HTTPException(status_code=409, detail="entry is already booked")
+
+    entry.status = WaitlistStatus.CANCELLED
+    session.add(entry)
+    session.commit()
+    session.refresh(entry)
+    waitlist_index().discard(entry.id)
+    return _to_response(entry)
@@ -0,0 +1,158 @@
+"""
+Versiones de agenda por (doctor, día) para GET condicionales.
+
+Triggers sobre `appointment` suben `scheduleversion.version` del día
+afectado en cada INSERT/UPDATE/DELETE (si una cita cambia de doctor o de
+día, se suben los dos). Así ninguna ruta, importación o script puede
+olvidarse de invalidar.
+
+Las lecturas de agenda/ETA dependen sólo de las citas de ese doctor y día,
+así que la versión basta como ETag: si el cliente manda If-None-Match con
+la actual se responde 304 sin calcular nada.
+
+Con varios workers, la versión es también la señal de invalidación entre
+procesos: las cachés en memoria guardan resultados por (doctor, día,
+versión) y cached_version() lee la versión vigente sin pasar por el ORM,
+comprobando antes con PRAGMA data_version si alguien ha escrito.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Optional
+
+from sqlmodel import Session
+
+from .data_version import DataVersionWatcher
+from .database import current_clinic
+from .models import ScheduleVersion
+
+_BUMP = """
+    INSERT INTO scheduleversion (doctor_id, day, version)
+    SELECT {ref}.doctor_id, {ref}.date, 1 WHERE {condition}
+    ON CONFLICT (doctor_id, day) DO UPDATE SET version = version + 1;
+"""
+
+
+def install(conn) -> None:
+    """
+    Crea los triggers (idempotente). La tabla la crea create_all.
+    """
+    moved = "old.doctor_id != new.doctor_id OR old.date != new.date"
+    triggers = {
+        "I": ("INSERT", _BUMP.format(ref="new", condition="1")),
+        "U": (
+            "UPDATE",
+            _BUMP.format(ref="old", condition="1")
+            + _BUMP.format(ref="new", condition=moved),
+        ),
+        "D": ("DELETE", _BUMP.format(ref="old", condition="1")),
+    }
+    for op, (event, body) in triggers.items():
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS scheduleversion_appointment_{op}
+            AFTER {event} ON appointment
+            BEGIN
+                {body}
+            END
+            """
+        )
+    conn.commit()
+
+
+def get_version(session: Session, doctor_id: int, day: date) -> int:
+    """
+    Versión actual (0 si el día aún no tiene citas).
+    """
+    row = session.get(ScheduleVersion, (doctor_id, day))
+    return row.version if row else 0
+
+
+class VersionCache:
+    """
+    Versiones leídas por este proceso. Se vacía entera en cuanto cualquier
+    conexión (de cualquier worker) confirma cambios; mientras no los haya,
+    una consulta cuesta un PRAGMA y un acceso a diccionario.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 100_000) -> None:
+        self._watcher = DataVersionWatcher(db_path)
+        self._lock = threading.Lock()
+        self._versions: dict[tuple[int, date], int] = {}
+        self.max_entries = max_entries
+
+    def get(self, doctor_id: int, day: date) -> int:
+        key = (doctor_id, day)
+        with self._lock:
+            if self._watcher.changed() or len(self._versions) >= self.max_entries:
+                self._versions.clear()
+            version = self._versions.get(key)
+            if version is None:
+                rows = self._watcher.query(
+                    "SELECT version FROM scheduleversion WHERE doctor_id = ? AND day = ?",
+                    (doctor_id, day.isoformat()),
+                )
+                version = rows[0][0] if rows else 0
+                self._versions[key] = version
+            return version
+
+    def close(self) -> None:
+        with self._lock:
+            self._versions.clear()
+            self._watcher.close()
+
+
+# una por fichero (BD principal y shards de clínica), como mucho
+# MAX_VERSION_CACHES a la vez
+MAX_VERSION_CACHES = 64
+_caches: OrderedDict[str, VersionCache] = OrderedDict()
+_caches_lock = threading.Lock()
+
+
+def _cache_for(db_path: str) -> VersionCache:
+    with _caches_lock:
+        cache = _caches.get(db_path)
+        if cache is None:
+            cache = _caches[db_path] = VersionCache(db_path)
+        _caches.move_to_end(db_path)
+        evicted = []
+        while len(_caches) > MAX_VERSION_CACHES:
+            evicted.append(_caches.popitem(last=False)[1])
+    for old in evicted:
+        old.close()
+    return cache
+
+
+def cached_version(session: Session, doctor_id: int, day: date) -> int:
+    """
+    Igual que get_version, pero con la caché del proceso cuando la BD de
+    la sesión es un fichero SQLite. Para lecturas (GET); tras escribir en
+    `session` sin commit, usar get_version.
+    """
+    url = session.get_bind().url
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        return get_version(session, doctor_id, day)
+    return _cache_for(url.database).get(doctor_id, day)
+
+
+def make_etag(*parts) -> str:
+    """
+    ETag con las partes dadas y, delante, la clínica de la petición: ids y
+    versiones se repiten entre clínicas, así que sin ella una caché podría
+    dar por buena la respuesta de otra clínica.
+    """
+    tag = "-".join(str(p) for p in parts)
+    clinic = current_clinic.get()
+    return f'"{clinic}/{tag}"' if clinic else f'"{tag}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    True si la cabecera If-None-Match incluye `etag` (comparación débil).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
@@ -0,0 +1,377 @@
+"""
+Exportación columnar (Apache Arrow IPC / Parquet) del histórico de citas,
+follow-ups y escalados para analítica.
+
+Se lee por bloques (fetchmany) y cada bloque se convierte a un RecordBatch,
+así que la memoria no depende del tamaño del rango exportado. Las columnas
+de texto de SQLite se convierten a tipos Arrow de forma vectorizada (cast).
+
+La exportación incremental sigue el changelog (ver changelog.py): cada
+ejecución saca las filas creadas o modificadas desde la anterior, sea cual
+sea su fecha.
+
+pyarrow es opcional: sólo se importa al exportar.
+"""
+import argparse
+import json
+import os
+from datetime import date
+from typing import Iterator, Optional, Sequence
+
+from .. import changelog
+from .archive import union_all
+
+CHUNK_ROWS = 50_000
+TABLES = ("appointments", "followups", "escalations")
+FORMATS = ("parquet", "arrow")
+
+# tabla de SQLite de cada exportación y columna id en su consulta
+_SOURCES = {"appointments": "appointment", "followups": "followuptask", "escalations": "escalation"}
+_ID_COLUMNS = {"appointments": "a.id", "followups": "f.id", "escalations": "e.id"}
+
+# posición de la exportación incremental en el changelog
+CONSUMER_NAME = "analytics_export"
+CHANGELOG_BATCH = 50_000
+
+# Minutos entre dos columnas datetime de SQLite (NULL si falta alguna)
+_MINUTES = "ROUND((julianday({end}) - julianday({start})) * 1440, 2)"
+
+# Histórico completo: filas vivas + archivadas (ver archive.py)
+_APPOINTMENTS = union_all("appointment")
+_FOLLOWUPS = union_all("followuptask")
+_ESCALATIONS = union_all("escalation")
+
+# (SQL, [(columna, tipo arrow)]) por tabla; los tipos se resuelven con pyarrow
+_QUERIES = {
+    "appointments": (
+        f"""
+        SELECT a.id, a.doctor_id, a.patient_id, a.date,
+               a.date || ' ' || a.scheduled_time AS scheduled_at,
+               a.date || ' ' || a."current_time" AS current_at,
+               lower(a.status) AS status,
+               lower(a.arrival_status) AS arrival_status,
+               a.slot_minutes,
+               a.patient_arrival_time, a.visit_start_time, a.visit_end_time,
+               {_MINUTES.format(start="a.patient_arrival_time", end="a.visit_start_time")} AS wait_minutes,
+               {_MINUTES.format(start="a.visit_start_time", end="a.visit_end_time")} AS visit_minutes
+        FROM {_APPOINTMENTS} a
+        WHERE {{where}}
+        ORDER BY a.date, a.id
+        """,
+        [
+            ("id", "int64"), ("doctor_id", "int64"), ("patient_id", "int64"),
+            ("date", "date"), ("scheduled_at", "timestamp"), ("current_at", "timestamp"),
+            ("status", "string"), ("arrival_status", "string"), ("slot_minutes", "int64"),
+            ("patient_arrival_time", "timestamp"), ("visit_start_time", "timestamp"),
+            ("visit_end_time", "timestamp"), ("wait_minutes", "float64"),
+            ("visit_minutes", "float64"),
+        ],
+    ),
+    "followups": (
+        f"""
+        SELECT f.id, f.appointment_id, a.doctor_id, a.date AS appointment_date,
+               lower(f.type) AS type, lower(f.channel) AS channel,
+               f.scheduled_time, f.executed, f.executed_at, f.created_at
+        FROM {_FOLLOWUPS} f
+        JOIN {_APPOINTMENTS} a ON a.id = f.appointment_id
+        WHERE {{where}}
+        ORDER BY a.date, f.id
+        """,
+        [
+            ("id", "int64"), ("appointment_id", "int64"), ("doctor_id", "int64"),
+            ("appointment_date", "date"), ("type", "string"), ("channel", "string"),
+            ("scheduled_time", "timestamp"), ("executed", "bool"),
+            ("executed_at", "timestamp"), ("created_at", "timestamp"),
+        ],
+    ),
+    "escalations": (
+        f"""
+        SELECT e.id, e.appointment_id, a.doctor_id, a.date AS appointment_date,
+               e.created_at, e.status, e.notes
+        FROM {_ESCALATIONS} e
+        JOIN {_APPOINTMENTS} a ON a.id = e.appointment_id
+        WHERE {{where}}
+        ORDER BY a.date, e.id
+        """,
+        [
+            ("id", "int64"), ("appointment_id", "int64"), ("doctor_id", "int64"),
+            ("appointment_date", "date"), ("created_at", "timestamp"),
+            ("status", "string"), ("notes", "string"),
+        ],
+    ),
+}
+
+
+def require_pyarrow() -> None:
+    """
+    Falla con un mensaje claro si pyarrow no está instalado.
+    """
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise RuntimeError("analytics export requires pyarrow (pip install pyarrow)")
+
+
+def _arrow_schema(table: str):
+    import pyarrow as pa
+
+    types = {
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "string": pa.string(),
+        "bool": pa.bool_(),
+        "date": pa.date32(),
+        "timestamp": pa.timestamp("us"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in _QUERIES[table][1]])
+
+
+def iter_batches(
+    conn,
+    table: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    chunk_rows: int = CHUNK_ROWS,
+    ids: Optional[Sequence[int]] = None,
+) -> Iterator:
+    """
+    RecordBatches de `table` para citas con fecha en [start, end], o de las
+    filas `ids` de la tabla (cualquier fecha) si se dan.
+    `conn` es una conexión DB-API de SQLite (engine.raw_connection()).
+    """
+    import pyarrow as pa
+
+    if table not in _QUERIES:
+        raise ValueError(f"table must be one of {TABLES}")
+
+    schema = _arrow_schema(table)
+    if ids is not None:
+        # los ids van como un único array JSON: sin límite de parámetros
+        where = f"{_ID_COLUMNS[table]} IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(list(ids)),)
+    else:
+        where = "a.date >= ? AND a.date <= ?"
+        params = ((start or date.min).isoformat(), (end or date.max).isoformat())
+    sql = _QUERIES[table][0].format(where=where)
+
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    try:
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            columns = []
+            for i, field in enumerate(schema):
+                values = [row[i] for row in rows]
+                if pa.types.is_temporal(field.type):
+                    # SQLite guarda fechas como texto: cast vectorizado
+                    columns.append(pa.array(values, pa.string()).cast(field.type))
+                elif pa.types.is_boolean(field.type):
+                    # ...y booleanos como 0/1
+                    columns.append(pa.array(values, pa.int8()).cast(field.type))
+                else:
+                    columns.append(pa.array(values, field.type))
+            yield pa.RecordBatch.from_arrays(columns, schema=schema)
+    finally:
+        cur.close()
+
+
+def write_export(
+    conn,
+    table: str,
+    start: Optional[date],
+    end: Optional[date],
+    path: str,
+    fmt: str = "parquet",
+    ids: Optional[Sequence[int]] = None,
+) -> int:
+    """
+    Escribe `table` en `path` (Parquet o Arrow IPC). Devuelve filas escritas.
+    Se escribe a un temporal y se renombra: nunca queda un fichero a medias.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(table)
+    tmp_path = f"{path}.tmp"
+    rows = 0
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(tmp_path, schema)
+    else:
+        writer = pa.ipc.new_file(tmp_path, schema)
+    try:
+        for batch in iter_batches(conn, table, start, end, ids=ids):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+        writer.close()
+    except BaseException:
+        writer.close()
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return rows
+
+
+class _ChunkSink:
+    """
+    Destino "file-like" para pyarrow que acumula lo escrito hasta que se vacía.
+    """
+
+    def __init__(self) -> None:
+        self.closed = False
+        self._parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def iter_arrow_stream(conn, table: str, start: date, end: date) -> Iterator[bytes]:
+    """
+    Arrow IPC (formato stream) trozo a trozo, un trozo por bloque leído;
+    pensado para respuestas HTTP en streaming.
+    """
+    import pyarrow as pa
+
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, _arrow_schema(table))
+    for batch in iter_batches(conn, table, start, end):
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+# ---------- Exportación incremental (CLI) ----------
+
+
+def load_state(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(path: str, state: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _changed_ids(conn, seq: int, tables) -> tuple[dict[str, list[int]], int]:
+    """
+    Ids cambiados después de `seq` por tabla exportada, y hasta dónde se ha leído.
+    """
+    sources = [_SOURCES[table] for table in tables]
+    changed: dict[str, set[int]] = {table: set() for table in tables}
+    while True:
+        batch = changelog.read_batch(conn, seq, tables=sources, limit=CHANGELOG_BATCH)
+        for table in tables:
+            changed[table].update(changelog.changed_ids(batch.changes, _SOURCES[table]))
+        seq = batch.seq
+        if not batch.more:
+            return {table: sorted(ids) for table, ids in changed.items()}, seq
+
+
+def export_incremental(
+    conn,
+    out_dir: str,
+    state_path: str,
+    fmt: str = "parquet",
+    tables=TABLES,
+) -> dict:
+    """
+    Exporta las filas creadas o modificadas desde la última ejecución (un
+    follow-up ejecutado, un escalado abierto días después de la cita, una
+    cita cancelada o importada con fecha pasada...), cada una con su estado
+    actual: el destino se queda con la última versión de cada id. La
+    posición es un seq del changelog, guardado en `state_path` y como
+    consumidor CONSUMER_NAME (que retiene el log hasta la siguiente
+    ejecución). La primera vez, o si el consumidor caducó
+    (CHANGELOG_CONSUMER_TTL) y se ha podido purgar algo, exporta todo.
+    """
+    if not changelog.is_installed(conn):
+        raise RuntimeError("incremental export needs the changelog (CHANGELOG_ENABLED=1)")
+
+    state = load_state(state_path)
+    since = state.get("seq")
+    # antes de leer nada: lo que cambie durante la exportación sale la próxima vez
+    position = changelog.register_consumer(conn, CONSUMER_NAME)
+    if since is None or position != since:
+        since = None
+        seq = changelog.latest_seq(conn)
+        changed = {table: None for table in tables}
+    else:
+        changed, seq = _changed_ids(conn, since, tables)
+
+    os.makedirs(out_dir, exist_ok=True)
+    ext = "parquet" if fmt == "parquet" else "arrow"
+    label = f"seq{since + 1}-{seq}" if since is not None else f"all-seq{seq}"
+
+    summary = {}
+    for table in tables:
+        ids = changed[table]
+        if ids == []:
+            summary[table] = {"rows": 0, "from_seq": since, "to_seq": seq}
+            continue
+        path = os.path.join(out_dir, f"{table}_{label}.{ext}")
+        rows = write_export(conn, table, None, None, path, fmt, ids=ids)
+        summary[table] = {"rows": rows, "from_seq": since, "to_seq": seq, "path": path}
+
+    state["seq"] = seq
+    save_state(state_path, state)
+    changelog.ack(conn, CONSUMER_NAME, seq)
+    return summary
+
+
+if __name__ == "__main__":
+    from ..database import engine
+
+    parser = argparse.ArgumentParser(description="Columnar export of appointment history")
+    parser.add_argument("out_dir")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, default=None)
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, default=None)
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument(
+        "--incremental",
+        metavar="STATE_FILE",
+        default=None,
+        help=(
+            "export only rows created or changed since the run recorded in STATE_FILE "
+            "(needs the changelog; run it more often than CHANGELOG_CONSUMER_TTL)"
+        ),
+    )
+    args = parser.parse_args()
+
+    require_pyarrow()
+    conn = engine.raw_connection()
+    try:
+        if args.incremental:
+            result = export_incremental(conn, args.out_dir, args.incremental, args.format)
+        else:
+            start = args.start or date.min
+            end = args.end or date.today()
+            os.makedirs(args.out_dir, exist_ok=True)
+            ext = "parquet" if args.format == "parquet" else "arrow"
+            result = {}
+            for table in TABLES:
+                path = os.path.join(args.out_dir, f"{table}.{ext}")
+                result[table] = {"rows": write_export(conn, table, start, end, path, args.format), "path": path}
+    finally:
+        conn.close()
+
+    print(json.dumps(result, indent=2))
@@ -1,6 +1,22 @@
-import httpx
+import threading
+
 from ..config import APARAVI_API_URL, APARAVI_API_KEY
 
+# Cliente HTTP creado en el primer uso: httpx no se importa al arrancar
+_client = None
+_client_lock = threading.Lock()
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import httpx
+
+                _client = httpx.Client(timeout=10.0)
+    return _client
+
 
 def redact_text_with_aparavi(text: str) -> str:
     """
@@ -19,7 +35,7 @@ def redact_text_with_aparavi(text: str) -> str:
             "Content-Type": "application/json",
         }
         payload = {"text": text}
-        resp = httpx.post(APARAVI_API_URL, json=payload, headers=headers, timeout=10.0)
+        resp = _get_client().post(APARAVI_API_URL, json=payload, headers=headers)
         resp.raise_for_status()
         data = resp.json()
         # Ajusta la clave según el formato real
@@ -0,0 +1,79 @@
+"""
+Series de citas recurrentes (pacientes crónicos: cada semana durante meses).
+
+Todas las ocurrencias se validan contra las citas existentes y el horario
+del doctor de una vez y se insertan en una sola transacción
+(booking_intervals.reserve_many). Enlaces de pago y follow-ups no hacen
+falta para responder: finish_series los genera después, como tarea en
+segundo plano, también en una sola transacción para toda la serie.
+"""
+from datetime import date, timedelta
+from typing import Optional
+
+from sqlmodel import Session, select
+
+from ..database import current_engine
+from ..models import Appointment, FollowUpChannel, Patient
+from .default_followups import build_default_followups_many
+from .followup_scheduler import notify_followup_scheduled
+from .payments import generate_payment_link
+
+# dos años de citas semanales
+MAX_OCCURRENCES = 104
+
+
+def occurrences(
+    start: date,
+    every_weeks: int = 1,
+    count: Optional[int] = None,
+    until: Optional[date] = None,
+) -> list[date]:
+    """
+    Fechas de la serie: desde `start` cada `every_weeks` semanas, `count`
+    veces o hasta `until` (incluido). Hay que dar exactamente uno de los dos.
+    """
+    if (count is None) == (until is None):
+        raise ValueError("give either 'count' or 'until'")
+    if every_weeks < 1:
+        raise ValueError("'every_weeks' must be at least 1")
+    step = timedelta(weeks=every_weeks)
+    if count is None:
+        if until < start:
+            raise ValueError("'until' must be on or after 'start_date'")
+        count = (until - start) // step + 1
+    if count > MAX_OCCURRENCES:
+        raise ValueError(f"a series can have at most {MAX_OCCURRENCES} occurrences")
+    return [start + i * step for i in range(count)]
+
+
+def finish_series(
+    appointment_ids: list[int],
+    amount_eur: float,
+    followup_channel: Optional[FollowUpChannel],
+) -> None:
+    """
+    Enlace de pago y follow-ups por defecto (si hay canal) para las citas
+    de una serie ya confirmada. Pensada para BackgroundTasks: abre su
+    propia sesión en la BD de la clínica actual.
+    """
+    with Session(current_engine(), expire_on_commit=False) as session:
+        appointments = session.exec(
+            select(Appointment).where(Appointment.id.in_(appointment_ids))
+        ).all()
+        patient_ids = {a.patient_id for a in appointments}
+        patients = {
+            p.id: p for p in session.exec(select(Patient).where(Patient.id.in_(patient_ids)))
+        }
+
+        for appointment in appointments:
+            appointment.payment_link = generate_payment_link(appointment.id, amount_eur=amount_eur)
+        tasks = []
+        if followup_channel is not None:
+            tasks = build_default_followups_many(
+                [(a, patients[a.patient_id]) for a in appointments], followup_channel
+            )
+        session.add_all(tasks)
+        session.commit()
+
+    for task in tasks:
+        notify_followup_scheduled(task)
@@ -0,0 +1,167 @@
+"""
+Archivo de días pasados (particionado caliente/frío).
+
+Las colas, ETAs y huecos sólo leen citas de hoy en adelante, pero
+`appointment` crece sin fin con días cerrados. Este job mueve a las tablas
+*_archive (mismas columnas y mismos ids, ver models.py):
+- citas con fecha anterior al corte que ya no tienen nada pendiente
+  (ni follow-ups sin ejecutar ni escalados sin resolver);
+- follow-ups ejecutados y escalados resueltos de citas ya archivadas.
+
+Se mueve por lotes, cada uno en su propia transacción (INSERT ... SELECT +
+DELETE), así que los workers sólo esperan un lote y el job se puede cortar
+y relanzar en cualquier momento. Las lecturas históricas (analítica,
+rollups, historial del paciente) leen las dos tablas con union_all().
+
+    python -m backend.services.archive [--days 30] [--all-clinics]
+
+Las funciones reciben una conexión DB-API de SQLite (engine.raw_connection()).
+"""
+import argparse
+from datetime import date, datetime, timedelta
+
+from ..config import ARCHIVE_AFTER_DAYS
+from ..database import sqlite_timestamp
+from ..models import (
+    Appointment,
+    AppointmentArchive,
+    Escalation,
+    EscalationArchive,
+    FollowUpTask,
+    FollowUpTaskArchive,
+)
+
+BATCH_ROWS = 5_000
+
+# tabla viva -> (tabla de archivo, columnas comunes entre comillas)
+ARCHIVES = {
+    live.__tablename__: (
+        archive.__tablename__,
+        ", ".join(f'"{name}"' for name in live.__table__.columns.keys()),
+    )
+    for live, archive in (
+        (Appointment, AppointmentArchive),
+        (FollowUpTask, FollowUpTaskArchive),
+        (Escalation, EscalationArchive),
+    )
+}
+
+# ids a mover en el lote actual, por tabla
+_CANDIDATES = {
+    "appointment": """
+        SELECT a.id FROM appointment a
+        WHERE a.date < ?
+          AND NOT EXISTS (
+              SELECT 1 FROM followuptask f
+              WHERE f.appointment_id = a.id AND f.executed = 0
+          )
+          AND NOT EXISTS (
+              SELECT 1 FROM escalation e
+              WHERE e.appointment_id = a.id AND e.status != 'resolved'
+          )
+        LIMIT ?
+    """,
+    "followuptask": """
+        SELECT f.id FROM followuptask f
+        WHERE f.executed = 1 AND f.scheduled_time < ?
+          AND NOT EXISTS (SELECT 1 FROM appointment a WHERE a.id = f.appointment_id)
+        LIMIT ?
+    """,
+    "escalation": """
+        SELECT e.id FROM escalation e
+        WHERE e.status = 'resolved' AND e.created_at < ?
+          AND NOT EXISTS (SELECT 1 FROM appointment a WHERE a.id = e.appointment_id)
+        LIMIT ?
+    """,
+}
+
+
+def union_all(table: str) -> str:
+    """
+    Subconsulta con las filas vivas y las archivadas de `table`, para usar
+    en FROM / JOIN. SQLite empuja los WHERE de fuera a cada rama, así que
+    cada una usa sus propios índices.
+    """
+    archive, columns = ARCHIVES[table]
+    return f"(SELECT {columns} FROM {table} UNION ALL SELECT {columns} FROM {archive})"
+
+
+def _move_batch(conn, table: str, cutoff_param: str, batch_rows: int) -> int:
+    archive, columns = ARCHIVES[table]
+    # BEGIN explícito: el lote entero (selección, copia y borrado) es atómico
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM temp.archive_ids")
+        conn.execute(
+            f"INSERT INTO temp.archive_ids (id) {_CANDIDATES[table]}",
+            (cutoff_param, batch_rows),
+        )
+        moved = conn.execute("SELECT COUNT(*) FROM temp.archive_ids").fetchone()[0]
+        if moved:
+            conn.execute(
+                f"""
+                INSERT INTO {archive} ({columns})
+                SELECT {columns} FROM {table}
+                WHERE id IN (SELECT id FROM temp.archive_ids)
+                """
+            )
+            conn.execute(f"DELETE FROM {table} WHERE id IN (SELECT id FROM temp.archive_ids)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return moved
+
+
+def archive_before(conn, cutoff: date, batch_rows: int = BATCH_ROWS) -> dict[str, int]:
+    """
+    Archiva lo anterior a `cutoff` (citas con fecha < cutoff; follow-ups y
+    escalados de antes de esa fecha). Devuelve las filas movidas por tabla.
+    """
+    conn.commit()
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_ids (id INTEGER PRIMARY KEY)")
+
+    cutoff_ts = sqlite_timestamp(datetime.combine(cutoff, datetime.min.time()))
+    params = {
+        "appointment": cutoff.isoformat(),
+        "followuptask": cutoff_ts,
+        "escalation": cutoff_ts,
+    }
+    moved = {}
+    try:
+        # primero las citas: follow-ups y escalados sólo salen si su cita ya salió
+        for table in ("appointment", "followuptask", "escalation"):
+            total = 0
+            while True:
+                count = _move_batch(conn, table, params[table], batch_rows)
+                total += count
+                if count < batch_rows:
+                    break
+            moved[table] = total
+    finally:
+        conn.execute("DROP TABLE IF EXISTS temp.archive_ids")
+    return moved
+
+
+if __name__ == "__main__":
+    from ..database import fan_out
+
+    parser = argparse.ArgumentParser(description="Archive closed past days (nightly job)")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="keep this many past days live")
+    parser.add_argument("--all-clinics", action="store_true", help="also every clinic shard")
+    args = parser.parse_args()
+
+    cutoff = date.today() - timedelta(days=args.days)
+
+    def run(clinic_id, engine) -> dict[str, int]:
+        conn = engine.raw_connection()
+        try:
+            return archive_before(conn, cutoff)
+        finally:
+            conn.close()
+
+    results = fan_out(run, clinics=None if args.all_clinics else [], include_default=True)
+    for clinic_id, moved in results.items():
+        name = "main" if clinic_id is None else f"clinic {clinic_id}"
+        summary = ", ".join(f"{table}={count}" for table, count in moved.items())
+        print(f"[ARCHIVE] {name}: before {cutoff.isoformat()}: {summary}")
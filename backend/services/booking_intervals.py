@@ -0,0 +1,311 @@
+"""
+Comprobación de solapes y de horario al reservar.
+
+Cada (doctor, día, versión de agenda) tiene en memoria sus intervalos
+ocupados [hora, hora + slot_minutes) ordenados por inicio, con el máximo
+fin acumulado: saber si una cita nueva pisa a otra es una búsqueda binaria,
+sin cargar el día. Como en eta_service, la versión va en la clave de la
+caché, así que un cambio hecho por otro worker nunca se pasa por alto.
+
+La reserva es optimista: se comprueba contra el índice, se inserta, y ya
+dentro de la transacción (con el lock de escritura de SQLite cogido) se
+mira la versión. Si es exactamente la del índice + 1 (la de nuestro
+INSERT), nadie ha escrito entre medias y se confirma; si no, se vuelve a
+comprobar contra las citas del día leídas dentro de la misma transacción.
+reserve_many hace lo mismo para una serie de citas con una consulta por
+paso, no una por cita. BatchChecker aplica las mismas reglas cita a cita
+a un lote que se inserta por su cuenta (importación masiva).
+"""
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import date, time
+from typing import NamedTuple, Optional
+
+from sqlmodel import Session, select
+
+from ..database import current_clinic
+from ..models import Appointment, AppointmentStatus, DoctorPreferences, ScheduleVersion
+from ..schedule_versions import cached_version
+from .result_cache import ResultCache
+
+# citas que ya no ocupan su hueco
+FREE_STATUSES = (AppointmentStatus.SKIPPED, AppointmentStatus.CANCELLED)
+
+_indexes = ResultCache()
+
+
+class BookingRejected(ValueError):
+    pass
+
+
+class SlotTaken(BookingRejected):
+    pass
+
+
+class OutsideWorkingHours(BookingRejected):
+    pass
+
+
+def _minutes(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+class DayIntervals(NamedTuple):
+    """
+    Intervalos ocupados de un doctor/día, en minutos del día. No se
+    modifica: with_interval devuelve una copia.
+    """
+    starts: list[int]
+    ends: list[int]
+    max_ends: list[int]  # max(ends[:i + 1]), por si ya hay solapes antiguos
+
+    @classmethod
+    def build(cls, intervals) -> "DayIntervals":
+        intervals = sorted(intervals)
+        starts = [start for start, _ in intervals]
+        ends = [end for _, end in intervals]
+        return cls(starts, ends, _running_max(ends))
+
+    def overlaps(self, start: int, end: int) -> bool:
+        # candidatos: los que empiezan antes de `end`; basta con el que acaba más tarde
+        i = bisect_left(self.starts, end)
+        return i > 0 and self.max_ends[i - 1] > start
+
+    def with_interval(self, start: int, end: int) -> "DayIntervals":
+        i = bisect_right(self.starts, start)
+        starts = self.starts[:i] + [start] + self.starts[i:]
+        ends = self.ends[:i] + [end] + self.ends[i:]
+        max_ends = self.max_ends[:i] + _running_max(ends[i:], self.max_ends[i - 1] if i else 0)
+        return DayIntervals(starts, ends, max_ends)
+
+
+def _running_max(values: list[int], current: int = 0) -> list[int]:
+    out = []
+    for value in values:
+        current = max(current, value)
+        out.append(current)
+    return out
+
+
+def _load_intervals(
+    session: Session, doctor_id: int, days, exclude_ids=()
+) -> dict[date, DayIntervals]:
+    """
+    Intervalos de varios días de un doctor en una sola consulta.
+    """
+    stmt = (
+        select(Appointment.date, Appointment.scheduled_time, Appointment.slot_minutes)
+        .where(Appointment.doctor_id == doctor_id)
+        .where(Appointment.date.in_(list(days)))
+        .where(Appointment.status.not_in(FREE_STATUSES))
+    )
+    if exclude_ids:
+        stmt = stmt.where(Appointment.id.not_in(list(exclude_ids)))
+    by_day: dict[date, list[tuple[int, int]]] = {day: [] for day in days}
+    for day, t, minutes in session.exec(stmt):
+        by_day[day].append((_minutes(t), _minutes(t) + minutes))
+    return {day: DayIntervals.build(intervals) for day, intervals in by_day.items()}
+
+
+def intervals_for_days(
+    session: Session, versions: dict[tuple[int, date], int]
+) -> dict[tuple[int, date], DayIntervals]:
+    """
+    Intervalos por (doctor, día), cacheados por versión; los que faltan se
+    cargan con una consulta por doctor. Las versiones tienen que haberse
+    leído antes que las citas (como hace cached_version): si las citas son
+    más nuevas, la reserva lo detecta y vuelve a comprobar.
+    """
+    clinic = current_clinic.get()
+    found, missing = {}, {}
+    for (doctor_id, day), version in versions.items():
+        index = _indexes.get((clinic, doctor_id, day, version))
+        if index is None:
+            missing.setdefault(doctor_id, []).append(day)
+        else:
+            found[doctor_id, day] = index
+    for doctor_id, days in missing.items():
+        for day, index in _load_intervals(session, doctor_id, days).items():
+            key = (clinic, doctor_id, day, versions[doctor_id, day])
+            found[doctor_id, day] = _indexes.put(key, index)
+    return found
+
+
+def _check_hours(prefs: Optional[DoctorPreferences], start: int, end: int) -> None:
+    if prefs is None:
+        return
+    if start < _minutes(prefs.workday_start) or end > _minutes(prefs.workday_end):
+        raise OutsideWorkingHours(
+            f"outside working hours ({prefs.workday_start:%H:%M}-{prefs.workday_end:%H:%M})"
+        )
+    if prefs.lunch_start and prefs.lunch_end:
+        if start < _minutes(prefs.lunch_end) and end > _minutes(prefs.lunch_start):
+            raise OutsideWorkingHours(
+                f"overlaps lunch break ({prefs.lunch_start:%H:%M}-{prefs.lunch_end:%H:%M})"
+            )
+
+
+def _current_versions(session: Session, keys) -> dict[tuple[int, date], int]:
+    # consulta directa (no session.get): tiene que ver lo escrito en esta transacción
+    doctor_ids = {doctor_id for doctor_id, _ in keys}
+    days = {day for _, day in keys}
+    stmt = select(ScheduleVersion.doctor_id, ScheduleVersion.day, ScheduleVersion.version).where(
+        ScheduleVersion.doctor_id.in_(doctor_ids), ScheduleVersion.day.in_(days)
+    )
+    current = {(doctor_id, day): version for doctor_id, day, version in session.exec(stmt)}
+    return {key: current.get(key, 0) for key in keys}
+
+
+def _span(appointment: Appointment) -> tuple[int, int]:
+    start = _minutes(appointment.scheduled_time)
+    end = start + appointment.slot_minutes
+    if end > 24 * 60:
+        raise OutsideWorkingHours("appointment must end the same day")
+    return start, end
+
+
+def _describe(appointment: Appointment) -> str:
+    return f"{appointment.date.isoformat()} {appointment.scheduled_time:%H:%M}"
+
+
+def _place(
+    indexes: dict, appointments: list[Appointment], spans: list[tuple[int, int]]
+) -> list[str]:
+    """
+    Va añadiendo cada cita a `indexes` (así también se detectan solapes
+    entre ellas) y devuelve las que no caben.
+    """
+    taken = []
+    for appointment, (start, end) in zip(appointments, spans):
+        key = (appointment.doctor_id, appointment.date)
+        if indexes[key].overlaps(start, end):
+            taken.append(_describe(appointment))
+        else:
+            indexes[key] = indexes[key].with_interval(start, end)
+    return taken
+
+
+def reserve_many(session: Session, appointments: list[Appointment]) -> list[Appointment]:
+    """
+    Inserta y confirma todas las citas en una transacción si todos sus
+    huecos están libres (tampoco pueden pisarse entre ellas) y dentro del
+    horario del doctor (DoctorPreferences: jornada y comida; sin
+    preferencias no se comprueba el horario). Si no, lanza SlotTaken u
+    OutsideWorkingHours, con todas las citas que fallan, sin escribir nada.
+    """
+    spans = [_span(appointment) for appointment in appointments]
+
+    doctor_ids = {appointment.doctor_id for appointment in appointments}
+    prefs = {
+        p.doctor_id: p
+        for p in session.exec(
+            select(DoctorPreferences).where(DoctorPreferences.doctor_id.in_(doctor_ids))
+        )
+    }
+    outside = []
+    for appointment, (start, end) in zip(appointments, spans):
+        try:
+            _check_hours(prefs.get(appointment.doctor_id), start, end)
+        except OutsideWorkingHours as e:
+            outside.append(f"{_describe(appointment)}: {e}" if len(appointments) > 1 else str(e))
+    if outside:
+        raise OutsideWorkingHours("; ".join(outside))
+
+    keys = list(dict.fromkeys((a.doctor_id, a.date) for a in appointments))
+    versions = {key: cached_version(session, *key) for key in keys}
+    indexes = intervals_for_days(session, versions)
+    taken = _place(indexes, appointments, spans)
+    if taken:
+        raise SlotTaken(_taken_message(taken, appointments))
+
+    session.add_all(appointments)
+    session.flush()  # INSERT: a partir de aquí la BD es nuestra hasta el commit
+    after = _current_versions(session, keys)
+    inserted = Counter((a.doctor_id, a.date) for a in appointments)
+    stale = [key for key in keys if after[key] != versions[key] + inserted[key]]
+    if stale:
+        # otras escrituras entre la comprobación y el INSERT: comprobar de
+        # nuevo esos días con las citas de ahora, sin las nuestras
+        ours = [a.id for a in appointments]
+        for doctor_id in {doctor_id for doctor_id, _ in stale}:
+            days = [day for d, day in stale if d == doctor_id]
+            for day, index in _load_intervals(session, doctor_id, days, exclude_ids=ours).items():
+                indexes[doctor_id, day] = index
+        pending = [i for i, a in enumerate(appointments) if (a.doctor_id, a.date) in stale]
+        taken = _place(
+            indexes, [appointments[i] for i in pending], [spans[i] for i in pending]
+        )
+        if taken:
+            session.rollback()
+            raise SlotTaken(_taken_message(taken, appointments))
+    session.commit()
+
+    clinic = current_clinic.get()
+    for key in keys:
+        _indexes.put((clinic, *key, after[key]), indexes[key])
+    return appointments
+
+
+class BatchChecker:
+    """
+    Comprueba horario y solapes de citas de un lote, una a una, contra lo ya
+    reservado y contra las anteriores del lote. Cada día se carga la primera
+    vez que aparece, apuntando su versión: unchanged() dice, ya dentro de la
+    transacción que inserta el lote, si alguien escribió en esos días entre
+    la carga y el INSERT.
+    """
+
+    def __init__(self, session: Session) -> None:
+        self.session = session
+        self._prefs: dict[int, Optional[DoctorPreferences]] = {}
+        self._indexes: dict[tuple[int, date], DayIntervals] = {}
+        self._versions: dict[tuple[int, date], int] = {}
+        self._added: Counter = Counter()
+
+    def place(self, doctor_id: int, day: date, start: time, slot_minutes: int) -> None:
+        """
+        Lanza OutsideWorkingHours o SlotTaken si la cita no cabe; si cabe,
+        queda ocupando su hueco para las siguientes.
+        """
+        begin = _minutes(start)
+        end = begin + slot_minutes
+        if end > 24 * 60:
+            raise OutsideWorkingHours("appointment must end the same day")
+        if doctor_id not in self._prefs:
+            self._prefs[doctor_id] = self.session.exec(
+                select(DoctorPreferences).where(DoctorPreferences.doctor_id == doctor_id)
+            ).first()
+        _check_hours(self._prefs[doctor_id], begin, end)
+
+        key = (doctor_id, day)
+        if key not in self._indexes:
+            # la versión antes que las citas, como en intervals_for_days
+            self._versions[key] = _current_versions(self.session, [key])[key]
+            self._indexes[key] = _load_intervals(self.session, doctor_id, [day])[day]
+        if self._indexes[key].overlaps(begin, end):
+            raise SlotTaken("slot already booked")
+        self._indexes[key] = self._indexes[key].with_interval(begin, end)
+        self._added[key] += 1
+
+    def unchanged(self) -> bool:
+        """
+        True si cada día comprobado sólo ha cambiado por las citas del lote
+        (llamar tras insertarlas, antes del commit).
+        """
+        after = _current_versions(self.session, list(self._indexes))
+        return all(
+            after[key] == self._versions[key] + self._added[key] for key in self._indexes
+        )
+
+
+def _taken_message(taken: list[str], appointments: list[Appointment]) -> str:
+    if len(appointments) == 1:
+        return "slot already booked"
+    return "slot already booked: " + ", ".join(taken)
+
+
+def reserve(session: Session, appointment: Appointment) -> Appointment:
+    """
+    reserve_many para una sola cita.
+    """
+    return reserve_many(session, [appointment])[0]
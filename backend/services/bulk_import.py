@@ -0,0 +1,298 @@
+"""
+Importación masiva de doctores, pacientes y citas desde CSV o NDJSON.
+
+Se lee en streaming, se valida fila a fila, las claves foráneas se resuelven
+contra conjuntos de ids en memoria y se inserta con executemany por bloques.
+Las citas pasan las mismas comprobaciones que POST /appointments (horario
+del doctor y solapes, también entre filas del fichero; ver
+booking_intervals.BatchChecker).
+
+Primero se valida el fichero entero sin escribir nada, dejando las filas
+válidas en un fichero temporal (en memoria hasta SPOOL_MAX_BYTES); después
+se insertan todas en una sola transacción corta. Así el lock de escritura
+de SQLite sólo se tiene mientras duran los INSERT, no mientras se lee y
+valida el fichero, y las reservas normales no esperan a la importación.
+O se confirman todas las filas válidas o ninguna (si algo falla a mitad, o
+si otra reserva tocó uno de los días mientras se importaba, se deshace todo
+y se lanza la excepción).
+"""
+import argparse
+import csv
+import io
+import json
+import pickle
+import tempfile
+from datetime import date, time
+from typing import IO, Iterator, Optional
+
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from ..models import Appointment, AppointmentStatus, ArrivalStatus, Doctor, Patient
+from .booking_intervals import BatchChecker, BookingRejected
+
+KINDS = ("doctors", "patients", "appointments")
+FORMATS = ("csv", "ndjson")
+
+CHUNK_ROWS = 1_000
+MAX_ERRORS = 1_000
+# filas validadas que se guardan en memoria antes de pasar a disco
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportConflict(BookingRejected):
+    """
+    Otra escritura cambió la agenda de un día del fichero durante la
+    importación; no se ha importado nada.
+    """
+
+
+# ---------- Lectura ----------
+
+
+def iter_records(stream: IO[bytes], fmt: str) -> Iterator[tuple[int, dict]]:
+    """
+    Devuelve (número de línea, registro) sin cargar el fichero entero.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_no, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as exc:
+            yield line_no, {"__error__": f"invalid JSON: {exc.msg}"}
+            continue
+        yield line_no, record if isinstance(record, dict) else {"__error__": "expected an object"}
+
+
+# ---------- Validación ----------
+
+
+def _required(record: dict, field: str) -> str:
+    value = record.get(field)
+    if value is None or str(value).strip() == "":
+        raise RowError(f"missing '{field}'")
+    return str(value).strip()
+
+
+def _int(
+    record: dict,
+    field: str,
+    required: bool = True,
+    default: Optional[int] = None,
+) -> Optional[int]:
+    value = record.get(field)
+    if value is None or str(value).strip() == "":
+        if required:
+            raise RowError(f"missing '{field}'")
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RowError(f"'{field}' must be an integer")
+
+
+def _parse(parser, record: dict, field: str):
+    raw = _required(record, field)
+    try:
+        return parser(raw)
+    except ValueError:
+        raise RowError(f"invalid '{field}': {raw!r}")
+
+
+class _Importer:
+    """
+    Convierte registros en filas listas para insertar, resolviendo las claves
+    foráneas contra conjuntos de ids ya existentes cargados una sola vez.
+    """
+
+    def __init__(self, session: Session, kind: str) -> None:
+        self.session = session
+        self.kind = kind
+        self.model = {"doctors": Doctor, "patients": Patient, "appointments": Appointment}[kind]
+        self.table = self.model.__table__
+        self.doctor_ids: set[int] = set()
+        self.patient_ids: set[int] = set()
+        # ids explícitos ya ocupados (sólo se carga si el fichero trae ids)
+        self.used_ids: Optional[set[int]] = None
+        self.checker: Optional[BatchChecker] = None
+
+        if kind == "appointments":
+            self.doctor_ids = set(session.exec(select(Doctor.id)).all())
+            self.patient_ids = set(session.exec(select(Patient.id)).all())
+            self.checker = BatchChecker(session)
+
+    def _row_id(self, record: dict) -> Optional[int]:
+        row_id = _int(record, "id", required=False)
+        if row_id is None:
+            return None
+        if self.used_ids is None:
+            self.used_ids = set(self.session.exec(select(self.model.id)).all())
+        if row_id in self.used_ids:
+            raise RowError(f"id {row_id} already exists")
+        self.used_ids.add(row_id)
+        return row_id
+
+    def to_row(self, record: dict) -> dict:
+        if "__error__" in record:
+            raise RowError(record["__error__"])
+
+        if self.kind == "doctors":
+            return {
+                "name": _required(record, "name"),
+                "specialty": _required(record, "specialty"),
+                "id": self._row_id(record),
+            }
+
+        if self.kind == "patients":
+            return {
+                "display_name": _required(record, "display_name"),
+                "id": self._row_id(record),
+            }
+
+        doctor_id = _int(record, "doctor_id")
+        patient_id = _int(record, "patient_id")
+        if doctor_id not in self.doctor_ids:
+            raise RowError(f"doctor {doctor_id} not found")
+        if patient_id not in self.patient_ids:
+            raise RowError(f"patient {patient_id} not found")
+
+        day = _parse(date.fromisoformat, record, "date")
+        start = _parse(time.fromisoformat, record, "time")
+        slot_minutes = _int(record, "slot_minutes", required=False, default=20)
+        if slot_minutes <= 0:
+            raise RowError("'slot_minutes' must be positive")
+        try:
+            self.checker.place(doctor_id, day, start, slot_minutes)
+        except BookingRejected as exc:
+            raise RowError(str(exc))
+
+        return {
+            "id": self._row_id(record),
+            "doctor_id": doctor_id,
+            "patient_id": patient_id,
+            "date": day,
+            "scheduled_time": start,
+            "current_time": start,
+            "slot_minutes": slot_minutes,
+            "status": AppointmentStatus.SCHEDULED,
+            "arrival_status": ArrivalStatus.NOT_ARRIVED,
+        }
+
+
+# ---------- Importación ----------
+
+
+def import_records(
+    session: Session,
+    kind: str,
+    stream: IO[bytes],
+    fmt: str = "csv",
+    dry_run: bool = False,
+    chunk_rows: int = CHUNK_ROWS,
+    max_errors: int = MAX_ERRORS,
+) -> dict:
+    """
+    Importa `stream` (CSV con cabecera o NDJSON) como `kind`.
+    Las filas inválidas (también las citas que se solapan o caen fuera de
+    horario) no se insertan y se devuelven en `errors` (como mucho
+    `max_errors`; `error_count` lleva el total). Las válidas se confirman
+    juntas al final, en una transacción que sólo dura los INSERT; si algo
+    falla antes, no queda ninguna. Con dry_run sólo se valida.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {KINDS}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+
+    importer = _Importer(session, kind)
+    report = {
+        "kind": kind,
+        "dry_run": dry_run,
+        "rows_read": 0,
+        "rows_valid": 0,
+        "rows_inserted": 0,
+        "error_count": 0,
+        "errors": [],
+    }
+
+    chunk: list[dict] = []
+    chunks = 0
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+
+        def flush() -> None:
+            nonlocal chunks
+            if not chunk:
+                return
+            if not dry_run:
+                pickle.dump(chunk, spool, protocol=pickle.HIGHEST_PROTOCOL)
+                chunks += 1
+            report["rows_valid"] += len(chunk)
+            chunk.clear()
+
+        try:
+            # 1) validar todo sin escribir: las lecturas no abren transacción
+            for line_no, record in iter_records(stream, fmt):
+                report["rows_read"] += 1
+                try:
+                    row = importer.to_row(record)
+                except RowError as exc:
+                    report["error_count"] += 1
+                    if len(report["errors"]) < max_errors:
+                        report["errors"].append({"line": line_no, "error": str(exc)})
+                    continue
+
+                chunk.append(row)
+                if chunk_rows and len(chunk) >= chunk_rows:
+                    flush()
+            flush()
+
+            # 2) insertar: el primer INSERT toma el lock de escritura, que se
+            # suelta en el commit
+            if not dry_run and chunks:
+                spool.seek(0)
+                for _ in range(chunks):
+                    session.execute(insert(importer.table), pickle.load(spool))
+                # los días validados pueden haber cambiado antes del primer
+                # INSERT; desde él, el lock es nuestro
+                if importer.checker and not importer.checker.unchanged():
+                    raise ImportConflict("appointments changed during the import; nothing was imported")
+                session.commit()
+                report["rows_inserted"] = report["rows_valid"]
+        except Exception:
+            session.rollback()
+            raise
+
+    return report
+
+
+if __name__ == "__main__":
+    from ..database import engine, init_db
+
+    parser = argparse.ArgumentParser(description="Bulk import for HealthcareApp")
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+
+    init_db()
+    with open(args.path, "rb") as f, Session(engine) as session:
+        result = import_records(session, args.kind, f, fmt=fmt, dry_run=args.dry_run)
+    print(json.dumps(result, indent=2))
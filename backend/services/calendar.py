@@ -1,6 +1,9 @@
 from datetime import datetime
+from ..logs import get_logger, log_event
 from ..models import Appointment, Doctor, Patient
 
+log = get_logger(__name__)
+
 
 def add_appointment_to_calendar(appointment: Appointment, doctor: Doctor, patient: Patient) -> str:
     """
@@ -14,10 +17,12 @@ def add_appointment_to_calendar(appointment: Appointment, doctor: Doctor, patien
     start_dt = datetime.combine(appointment.date, appointment.scheduled_time)
     end_dt = datetime.combine(appointment.date, appointment.current_time)
 
-    # Para el hackatón, basta con un log bien explicado.
-    print(
-        f"[CALENDAR] Adding event for doctor={doctor.name}, patient={patient.display_name}, "
-        f"start={start_dt.isoformat()}, end={end_dt.isoformat()}, event_id={event_id}"
+    # Para el hackatón, basta con un log bien explicado (el paciente por id:
+    # su nombre no va a los logs).
+    log_event(
+        log, "calendar.event_added",
+        doctor=doctor.name, patient_id=patient.id,
+        start=start_dt.isoformat(), end=end_dt.isoformat(), event_id=event_id,
     )
 
     return event_id
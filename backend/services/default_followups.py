@@ -0,0 +1,100 @@
+"""
+Follow-ups por defecto de una cita (sin sesión: sólo construye las tareas).
+
+- 1 recordatorio antes de la cita (2h antes)
+- 1 check-in después de la cita (4h después de visit_end_time, o de la hora
+  programada si la visita aún no ha terminado)
+
+build_default_followups_many() pide los mensajes de todas en un lote e
+insert_missing() las guarda de golpe (un executemany) sin duplicar las que
+ya existan.
+"""
+from datetime import datetime, timedelta
+from typing import Sequence
+
+from sqlalchemy import bindparam, exists, insert, select
+from sqlmodel import Session
+
+from ..models import Appointment, FollowUpChannel, FollowUpTask, FollowUpType, Patient
+from .llm_client import MessageRequest, generate_messages
+
+REMINDER_BEFORE = timedelta(hours=2)
+CHECKIN_AFTER = timedelta(hours=4)
+
+
+def _default_schedule(appointment: Appointment) -> list[tuple[FollowUpType, datetime]]:
+    scheduled_dt = datetime.combine(appointment.date, appointment.scheduled_time)
+    if appointment.visit_end_time:
+        checkin_time = appointment.visit_end_time + CHECKIN_AFTER
+    else:
+        checkin_time = scheduled_dt + CHECKIN_AFTER
+    return [
+        (FollowUpType.REMINDER, scheduled_dt - REMINDER_BEFORE),
+        (FollowUpType.CHECKIN, checkin_time),
+    ]
+
+
+def build_default_followups_many(
+    rows: Sequence[tuple[Appointment, Patient]],
+    channel: FollowUpChannel,
+) -> list[FollowUpTask]:
+    """
+    Tareas de muchas citas, con todos los mensajes pedidos en un solo lote
+    al generador (services/llm_client.py). El paciente no se le pasa: los
+    mensajes no llevan PHI.
+    """
+    planned = [
+        (appointment, followup_type, when)
+        for appointment, _ in rows
+        for followup_type, when in _default_schedule(appointment)
+    ]
+    messages = generate_messages([MessageRequest(followup_type) for _, followup_type, _ in planned])
+    return [
+        FollowUpTask(
+            appointment_id=appointment.id,
+            type=followup_type,
+            channel=channel,
+            scheduled_time=when,
+            message=message,
+        )
+        for (appointment, followup_type, when), message in zip(planned, messages)
+    ]
+
+
+def build_default_followups(
+    appointment: Appointment,
+    patient: Patient,
+    channel: FollowUpChannel,
+) -> list[FollowUpTask]:
+    return build_default_followups_many([(appointment, patient)], channel)
+
+
+_COLUMNS = ("appointment_id", "type", "channel", "scheduled_time", "message", "executed", "created_at")
+
+
+def _guarded_insert():
+    # INSERT ... SELECT ? ... WHERE NOT EXISTS (misma cita y tipo): aunque
+    # otra petición programe la misma cita a la vez, no hay duplicados
+    table = FollowUpTask.__table__
+    params = {name: bindparam(name, type_=table.c[name].type) for name in _COLUMNS}
+    already = select(table.c.id).where(
+        table.c.appointment_id == params["appointment_id"],
+        table.c.type == params["type"],
+    )
+    return insert(table).from_select(
+        list(_COLUMNS), select(*params.values()).where(~exists(already))
+    )
+
+
+_GUARDED_INSERT = _guarded_insert()
+
+
+def insert_missing(session: Session, tasks: list[FollowUpTask]) -> int:
+    """
+    Inserta `tasks` en un solo executemany (sin commit), saltándose las de
+    una cita que ya tenga una tarea de ese tipo. Devuelve las insertadas.
+    """
+    if not tasks:
+        return 0
+    rows = [{name: getattr(task, name) for name in _COLUMNS} for task in tasks]
+    return session.execute(_GUARDED_INSERT, rows).rowcount
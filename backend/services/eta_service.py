@@ -1,9 +1,35 @@
 from datetime import datetime, date, time, timedelta
-from typing import List
+from typing import List, Optional
 
 from sqlmodel import Session, select
 
+from ..database import current_clinic
 from ..models import Appointment, AppointmentStatus, Doctor
+from .result_cache import ResultCache
+from .single_flight import SingleFlight
+
+# Peticiones concurrentes para el mismo (doctor, día, versión de agenda)
+# comparten un único cálculo, y el resultado se guarda para las siguientes;
+# la versión (schedule_versions.py) garantiza que nunca se reutiliza un
+# resultado anterior a un cambio, aunque el cambio venga de otro worker.
+_flight = SingleFlight()
+_results = ResultCache()
+
+# citas que siguen en la agenda pero no ocupan hueco en la cola
+OFF_QUEUE_STATUSES = (AppointmentStatus.COMPLETED, AppointmentStatus.CANCELLED)
+
+
+def _shared(key, fn):
+    """
+    Resultado cacheado para `key` (en la BD de la clínica actual), o fn()
+    con single-flight.
+    """
+    key = (current_clinic.get(), *key)
+    value = _results.get(key)
+    if value is None:
+        value = _flight.do(key, lambda: _results.put(key, fn()))
+    return value
+
 
 def to_datetime(d: date, t: time) -> datetime:
     return datetime.combine(d, t)
@@ -23,15 +49,20 @@ def compute_doctor_delay_for_day(session: Session, doctor: Doctor, day: date) ->
         .order_by(Appointment.scheduled_time)
     )
     appointments = session.exec(stmt).all()
+    return doctor_delay_from_appointments(appointments)
 
-    if not appointments:
-        return 0
 
-    # si hay visitas ya completadas, miramos la última
+def doctor_delay_from_appointments(appointments) -> int:
+    """
+    Igual que compute_doctor_delay_for_day pero sobre citas ya cargadas
+    (filas de un mismo doctor/día, en cualquier orden).
+    """
+    # si hay visitas ya completadas, miramos la última (por hora programada)
     last_done = None
     for app in appointments:
         if app.status in (AppointmentStatus.IN_PROGRESS, AppointmentStatus.COMPLETED):
-            last_done = app
+            if last_done is None or app.scheduled_time >= last_done.scheduled_time:
+                last_done = app
 
     if not last_done or not last_done.visit_start_time:
         # no sabemos aún, devolvemos 0
@@ -47,6 +78,7 @@ def compute_doctor_delay_for_day(session: Session, doctor: Doctor, day: date) ->
 def compute_eta_for_appointment(
     session: Session,
     appointment: Appointment,
+    version: Optional[int] = None,
 ) -> dict:
     """
     Calcula ETA para una cita:
@@ -57,46 +89,111 @@ def compute_eta_for_appointment(
       - current_delay_minutes
       - eta_time
       - queue_position
+    Con `version` (versión de agenda del día) el cálculo del día se comparte
+    entre peticiones y se cachea.
     """
+    if version is not None:
+        etas = etas_for_day(session, appointment.doctor_id, appointment.date, version)
+    else:
+        etas = _load_etas_for_day(session, appointment.doctor_id, appointment.date)
+    return _eta_from_day(appointment, etas)
+
+
+def _eta_from_day(appointment: Appointment, etas: dict[int, dict]) -> dict:
+    if appointment.id in etas:
+        return etas[appointment.id]
+
+    original = appointment.scheduled_time.strftime("%H:%M")
+    return {
+        "original_time": original,
+        "eta_time": appointment.current_time.strftime("%H:%M"),
+        "current_delay_minutes": 0,
+        "queue_position": len(etas) + 1,
+    }
+
+
+def _load_etas_for_day(session: Session, doctor_id: int, day: date) -> dict[int, dict]:
     stmt = (
         select(Appointment)
-        .where(Appointment.doctor_id == appointment.doctor_id)
-        .where(Appointment.date == appointment.date)
+        .where(Appointment.doctor_id == doctor_id)
+        .where(Appointment.date == day)
         .order_by(Appointment.current_time)
     )
-    same_day = session.exec(stmt).all()
+    return compute_etas_for_day(session.exec(stmt).all())
+
+
+def etas_for_day(session: Session, doctor_id: int, day: date, version: int) -> dict[int, dict]:
+    """
+    ETAs del día, compartidas por (doctor, día, versión).
+    """
+    return _shared(
+        ("etas", doctor_id, day, version),
+        lambda: _load_etas_for_day(session, doctor_id, day),
+    )
+
+
+# "HH:MM" precalculado para cada minuto del día (evita strftime en bucles grandes)
+_HHMM = [f"{m // 60:02d}:{m % 60:02d}" for m in range(24 * 60)]
+
+
+def format_hhmm(t: time) -> str:
+    return _HHMM[t.hour * 60 + t.minute]
 
-    # posición en cola
-    position = 1
-    current_time_pointer = to_datetime(appointment.date, same_day[0].current_time)
-
-    eta_dt = None
-    for app in same_day:
-        slot_duration = timedelta(minutes=app.slot_minutes)
-        if app.id == appointment.id:
-            eta_dt = current_time_pointer
-            break
-        # visitas completadas pueden adelantar la cola
-        if app.status == AppointmentStatus.COMPLETED:
-            current_time_pointer = current_time_pointer  # sin cambio
-        else:
-            current_time_pointer += slot_duration
-            position += 1
 
-    if eta_dt is None:
-        eta_dt = to_datetime(appointment.date, appointment.current_time)
+def _seconds_of_day(t: time) -> int:
+    return t.hour * 3600 + t.minute * 60 + t.second
 
-    original_dt = to_datetime(appointment.date, appointment.scheduled_time)
-    delay_minutes = int((eta_dt - original_dt).total_seconds() // 60)
 
+def compute_etas_for_day(appointments) -> dict[int, dict]:
+    """
+    Calcula la ETA de todas las citas de un doctor/día en una sola pasada.
+    `appointments` debe venir ordenado por current_time; acepta modelos
+    Appointment o filas con los mismos atributos.
+    Devuelve {appointment_id: eta} con el mismo formato que
+    compute_eta_for_appointment.
+    """
+    queue = [
+        (
+            _seconds_of_day(app.scheduled_time),
+            _seconds_of_day(app.current_time),
+            app.status not in OFF_QUEUE_STATUSES,
+            app.slot_minutes,
+        )
+        for app in appointments
+    ]
     return {
-        "original_time": appointment.scheduled_time.strftime("%H:%M"),
-        "eta_time": eta_dt.strftime("%H:%M"),
-        "current_delay_minutes": max(delay_minutes, 0),
-        "queue_position": position,
+        app.id: {
+            "original_time": format_hhmm(app.scheduled_time),
+            "eta_time": eta_time,
+            "current_delay_minutes": delay_minutes,
+            "queue_position": position,
+        }
+        for app, (eta_time, delay_minutes, position) in zip(appointments, queue_etas(queue))
     }
 
 
+def queue_etas(queue) -> list[tuple[str, int, int]]:
+    """
+    Pasada de compute_etas_for_day sobre tuplas (hora programada, hora
+    actual en segundos del día, ocupa hueco, slot_minutes) ordenadas por hora
+    actual. Devuelve (eta "HH:MM", retraso en minutos, posición) por cita.
+    """
+    out = []
+    if not queue:
+        return out
+
+    # posición en cola; trabajamos en segundos del día para ir rápido
+    position = 1
+    pointer = queue[0][1]
+    for scheduled, _, in_queue, slot_minutes in queue:
+        out.append((_HHMM[(pointer // 60) % len(_HHMM)], max((pointer - scheduled) // 60, 0), position))
+        # visitas completadas y canceladas no ocupan hueco en la cola
+        if in_queue:
+            pointer += slot_minutes * 60
+            position += 1
+    return out
+
+
 def recommend_time_slots(
     session: Session,
     doctor: Doctor,
@@ -104,6 +201,7 @@ def recommend_time_slots(
     start_hour: int = 9,
     end_hour: int = 13,
     slot_minutes: int = 20,
+    version: Optional[int] = None,
 ) -> dict:
     """
     Genera slots posibles y estima la espera basada en las citas ya programadas.
@@ -111,11 +209,29 @@ def recommend_time_slots(
     - recommended: lista con 2–3 mejores opciones
     - all_slots: todos los slots con waiting_time_mins
     Esto encaja con la pantalla 2 del PDF: Recommended Times + All Available Times. :contentReference[oaicite:5]{index=5}
+    Con `version` el cálculo se comparte entre peticiones y se cachea.
     """
+    params = (doctor.id, day, start_hour, end_hour, slot_minutes)
+    if version is not None:
+        return _shared(
+            ("slots", *params, version),
+            lambda: _compute_time_slots(session, *params),
+        )
+    return _compute_time_slots(session, *params)
+
+
+def _compute_time_slots(
+    session: Session,
+    doctor_id: int,
+    day: date,
+    start_hour: int,
+    end_hour: int,
+    slot_minutes: int,
+) -> dict:
     # sacar citas del día
     stmt = (
         select(Appointment)
-        .where(Appointment.doctor_id == doctor.id)
+        .where(Appointment.doctor_id == doctor_id)
         .where(Appointment.date == day)
         .order_by(Appointment.current_time)
     )
@@ -137,7 +253,7 @@ def recommend_time_slots(
         # contamos cuántas citas hay antes de esa hora
         before_count = 0
         for app in appointments:
-            if app.current_time <= slot and app.status != AppointmentStatus.COMPLETED:
+            if app.current_time <= slot and app.status not in OFF_QUEUE_STATUSES:
                 before_count += 1
         estimated_wait = before_count * slot_minutes  # muy simplificado
         all_slots.append(
@@ -0,0 +1,294 @@
+"""
+Reparto de FollowUpTask entre varios workers con leases.
+
+Un worker reclama sus tareas con un solo UPDATE ... RETURNING que les pone
+`claimed_by` (su id) y `lease_until` (ahora + lease): mientras dure el
+lease ningún otro worker puede llevárselas, así que se pueden lanzar tantos
+workers como haga falta sobre la misma BD. Tras enviar, complete() marca la
+tarea ejecutada, sólo si el lease sigue siendo suyo.
+
+Si un worker muere a mitad de un lote, sus tareas siguen con executed = 0 y
+otro las vuelve a reclamar cuando caduca el lease. Una tarea cuyo envío
+falla se suelta con lease_until = ahora + RETRY_DELAY: nadie la reintenta
+antes. El reenvío lleva la
+misma clave de idempotencia (idempotency_key) que el primer intento, así
+que el proveedor lo descarta: el paciente recibe cada mensaje una vez.
+
+    python -m backend.services.followup_leases [--batch 100] [--lease-seconds 120] [--loop 5] [--all-clinics]
+
+Las funciones reciben una conexión DB-API de SQLite (engine.raw_connection()).
+"""
+import argparse
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Sequence
+
+from ..config import FOLLOWUP_CLAIM_BATCH, FOLLOWUP_LEASE_SECONDS, FOLLOWUP_RETRY_SECONDS
+from ..database import sqlite_timestamp
+from ..logs import get_logger, log_context, log_event
+from .notifications import send_followup
+
+log = get_logger(__name__)
+
+DEFAULT_LEASE = timedelta(seconds=FOLLOWUP_LEASE_SECONDS)
+RETRY_DELAY = timedelta(seconds=FOLLOWUP_RETRY_SECONDS)
+
+
+class ClaimedTask(NamedTuple):
+    id: int
+    appointment_id: int
+    channel: str
+    message: str
+
+
+_RETURNING = "RETURNING id, appointment_id, channel, message"
+
+# la cita no está cancelada (cancel_appointment borra sus pendientes, pero
+# una tarea creada a la vez que la cancelación no debe salir)
+_NOT_CANCELLED = """
+    NOT EXISTS (
+        SELECT 1 FROM appointment a
+        WHERE a.id = followuptask.appointment_id AND a.status = 'CANCELLED'
+    )
+"""
+
+# pendientes y vencidas, sin lease o con el lease caducado
+_CLAIM_DUE = f"""
+    UPDATE followuptask
+    SET claimed_by = ?, lease_until = ?
+    WHERE id IN (
+        SELECT id FROM followuptask
+        WHERE executed = 0 AND scheduled_time <= ?
+          AND (lease_until IS NULL OR lease_until < ?)
+          AND {_NOT_CANCELLED}
+        ORDER BY scheduled_time
+        LIMIT ?
+    )
+    {_RETURNING}
+"""
+
+
+def worker_id() -> str:
+    """
+    Id de este proceso en claimed_by.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def idempotency_key(task_id: int, scope: Optional[str] = None) -> str:
+    """
+    Clave con la que se envía la tarea, igual en todos los intentos.
+    `scope` distingue shards (los ids de follow-up se repiten entre clínicas).
+    """
+    return f"followup-{scope}-{task_id}" if scope else f"followup-{task_id}"
+
+
+def _claimed(conn, sql: str, params: Sequence) -> list[ClaimedTask]:
+    try:
+        # las filas de RETURNING hay que leerlas antes del commit
+        rows = conn.execute(sql, params).fetchall()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [ClaimedTask(*row) for row in rows]
+
+
+def claim_due(
+    conn,
+    worker: str,
+    limit: int = FOLLOWUP_CLAIM_BATCH,
+    lease: timedelta = DEFAULT_LEASE,
+    now: Optional[datetime] = None,
+) -> list[ClaimedTask]:
+    """
+    Reclama hasta `limit` tareas vencidas (las más antiguas primero),
+    incluidas las de leases caducados.
+    """
+    now = now or datetime.utcnow()
+    now_ts = sqlite_timestamp(now)
+    return _claimed(
+        conn, _CLAIM_DUE, (worker, sqlite_timestamp(now + lease), now_ts, now_ts, limit)
+    )
+
+
+def claim_ids(
+    conn,
+    worker: str,
+    task_ids: Sequence[int],
+    lease: timedelta = DEFAULT_LEASE,
+    now: Optional[datetime] = None,
+) -> list[ClaimedTask]:
+    """
+    Reclama tareas concretas (planificador, pipeline) si siguen pendientes
+    y nadie tiene un lease vigente sobre ellas.
+    """
+    if not task_ids:
+        return []
+    now = now or datetime.utcnow()
+    marks = ", ".join("?" for _ in task_ids)
+    sql = f"""
+        UPDATE followuptask
+        SET claimed_by = ?, lease_until = ?
+        WHERE id IN ({marks}) AND executed = 0
+          AND (lease_until IS NULL OR lease_until < ?)
+          AND {_NOT_CANCELLED}
+        {_RETURNING}
+    """
+    return _claimed(
+        conn, sql, (worker, sqlite_timestamp(now + lease), *task_ids, sqlite_timestamp(now))
+    )
+
+
+def complete(conn, worker: str, task_id: int, now: Optional[datetime] = None) -> bool:
+    """
+    Marca la tarea ejecutada. False si ya no era nuestra (el lease caducó
+    y otro worker la reclamó: ese la completará con la misma clave).
+    """
+    now = now or datetime.utcnow()
+    cur = conn.execute(
+        """
+        UPDATE followuptask
+        SET executed = 1, executed_at = ?, lease_until = NULL
+        WHERE id = ? AND claimed_by = ? AND executed = 0
+        """,
+        (sqlite_timestamp(now), task_id, worker),
+    )
+    conn.commit()
+    return cur.rowcount == 1
+
+
+def release(
+    conn,
+    worker: str,
+    task_id: int,
+    retry_after: timedelta = RETRY_DELAY,
+    now: Optional[datetime] = None,
+) -> None:
+    """
+    Suelta una tarea que no se pudo enviar. Hasta dentro de `retry_after`
+    nadie la vuelve a reclamar (ni este worker en la misma ronda).
+    """
+    now = now or datetime.utcnow()
+    conn.execute(
+        """
+        UPDATE followuptask
+        SET claimed_by = NULL, lease_until = ?
+        WHERE id = ? AND claimed_by = ? AND executed = 0
+        """,
+        (sqlite_timestamp(now + retry_after), task_id, worker),
+    )
+    conn.commit()
+
+
+def destinations(conn, tasks: Sequence[ClaimedTask]) -> dict[int, str]:
+    """
+    Destino de cada tarea (por id), con una consulta por lote.
+    """
+    appointment_ids = sorted({task.appointment_id for task in tasks})
+    patients = {}
+    if appointment_ids:
+        marks = ", ".join("?" for _ in appointment_ids)
+        patients = dict(
+            conn.execute(
+                f"SELECT id, patient_id FROM appointment WHERE id IN ({marks})",
+                appointment_ids,
+            ).fetchall()
+        )
+    # Para el demo no guardamos teléfono/email reales (como en /followups/run_once)
+    return {
+        task.id: (
+            f"patient-{patients[task.appointment_id]}"
+            if task.appointment_id in patients
+            else "unknown-patient"
+        )
+        for task in tasks
+    }
+
+
+def send_claimed(
+    conn, worker: str, tasks: Sequence[ClaimedTask], scope: Optional[str] = None
+) -> int:
+    """
+    Envía las tareas reclamadas y las va completando una a una (si el
+    worker cae, sólo se reintenta lo que no llegó a completar). Las que
+    fallan al enviar se sueltan. Devuelve las enviadas.
+    """
+    sent = 0
+    to = destinations(conn, tasks)
+    for task in tasks:
+        with log_context(task_id=task.id):
+            try:
+                known = send_followup(
+                    task.channel, to[task.id], task.message,
+                    idempotency_key=idempotency_key(task.id, scope),
+                )
+            except Exception:
+                log_event(log, "followup.send_failed", level=logging.WARNING, exc_info=True)
+                release(conn, worker, task.id)
+                continue
+            if not known:
+                # no se reintenta: con otro worker fallaría igual
+                log_event(log, "followup.unknown_channel", level=logging.WARNING, channel=task.channel)
+        if complete(conn, worker, task.id):
+            sent += known
+    return sent
+
+
+def run_due(
+    conn,
+    worker: Optional[str] = None,
+    batch: int = FOLLOWUP_CLAIM_BATCH,
+    lease: timedelta = DEFAULT_LEASE,
+    scope: Optional[str] = None,
+) -> int:
+    """
+    Reclama y envía lotes de tareas vencidas hasta que no quede ninguna
+    libre. Devuelve las enviadas. Las que fallan esperan a RETRY_DELAY, así
+    que la ronda no las vuelve a coger; si aun así un lote sólo trae tareas
+    ya vistas en esta ronda, se para.
+    """
+    worker = worker or worker_id()
+    sent = 0
+    seen: set[int] = set()
+    while True:
+        tasks = claim_due(conn, worker, batch, lease)
+        sent += send_claimed(conn, worker, tasks, scope)
+        ids = {task.id for task in tasks}
+        if len(tasks) < batch or ids <= seen:
+            return sent
+        seen |= ids
+
+
+if __name__ == "__main__":
+    from ..database import fan_out
+
+    parser = argparse.ArgumentParser(description="Follow-up worker (safe to run several at once)")
+    parser.add_argument("--batch", type=int, default=FOLLOWUP_CLAIM_BATCH, help="tasks claimed per round")
+    parser.add_argument("--lease-seconds", type=float, default=FOLLOWUP_LEASE_SECONDS, help="how long a claim lasts")
+    parser.add_argument("--loop", type=float, default=0, help="keep running, sleeping this many seconds between rounds")
+    parser.add_argument("--all-clinics", action="store_true", help="also every clinic shard")
+    args = parser.parse_args()
+
+    lease = timedelta(seconds=args.lease_seconds)
+    me = worker_id()
+
+    def run(clinic_id, engine) -> int:
+        conn = engine.raw_connection()
+        try:
+            return run_due(conn, me, args.batch, lease, scope=clinic_id)
+        finally:
+            conn.close()
+
+    while True:
+        results = fan_out(run, clinics=None if args.all_clinics else [], include_default=True)
+        for clinic_id, sent in results.items():
+            if sent:
+                name = "main" if clinic_id is None else f"clinic {clinic_id}"
+                print(f"[FOLLOWUP] {name}: sent {sent} followups ({me})")
+        if not args.loop:
+            break
+        time.sleep(args.loop)
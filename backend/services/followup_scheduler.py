@@ -0,0 +1,347 @@
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from ..config import FOLLOWUP_SCHEDULER_POLL_SECONDS
+from ..data_version import DataVersionWatcher
+from ..database import current_clinic
+from ..logs import get_logger, log_context, log_event
+from ..models import FollowUpTask
+from .followup_leases import RETRY_DELAY, claim_ids, send_claimed, worker_id
+
+log = get_logger(__name__)
+
+# tope de la espera entre reintentos de carga
+MAX_RETRY_SECONDS = 60.0
+
+try:  # elección de líder entre workers (no existe en Windows)
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class FollowUpScheduler:
+    """
+    Planificador en proceso para FollowUpTask:
+    - Carga en un min-heap las tareas pendientes de la ventana [.., ahora + window]
+      (como mucho max_loaded a la vez, así la memoria queda acotada).
+    - Duerme exactamente hasta la siguiente tarea; notify_task() lo despierta
+      antes si se programa algo más temprano.
+    - Al vaciar la ventana vuelve a leer la BD, así que tras un reinicio
+      se reconstruye solo.
+    - Con `poll` (y BD SQLite) comprueba cada `poll` si otro proceso ha
+      escrito (PRAGMA data_version) y en ese caso carga las tareas con id
+      mayor que la última vista: las creadas por otros workers o pipelines,
+      que no pueden llamar a notify_task() de este proceso.
+    - Cada tarea se reclama con un lease (followup_leases.py) antes de
+      enviarla, así que puede convivir con otros workers de follow-ups.
+    """
+
+    def __init__(
+        self,
+        engine,
+        window: timedelta = timedelta(hours=6),
+        max_loaded: int = 10_000,
+        poll: Optional[timedelta] = None,
+        scope: Optional[str] = None,
+        retry_delay: timedelta = timedelta(seconds=1),
+    ) -> None:
+        self.engine = engine
+        self.window = window
+        self.max_loaded = max_loaded
+        self.poll = poll
+        # clínica de la BD (para las claves de idempotencia) e id en claimed_by
+        self.scope = scope
+        self.worker = worker_id()
+        # primera espera tras un fallo al cargar la ventana (luego se dobla)
+        self.retry_delay = retry_delay
+        self._load_failures = 0
+
+        self._watcher: Optional[DataVersionWatcher] = None
+        if poll is not None and engine.url.get_backend_name() == "sqlite" and engine.url.database:
+            self._watcher = DataVersionWatcher(engine.url.database)
+        # mayor id de FollowUpTask ya considerado
+        self._last_id = 0
+
+        self._heap: list[tuple[datetime, int]] = []
+        # hasta qué hora tenemos cargadas todas las tareas pendientes (None = recargando)
+        self._horizon: Optional[datetime] = None
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- API pública ----------
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(
+            target=self._run, name="followup-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._watcher is not None:
+            self._watcher.close()
+
+    def notify_task(self, task_id: int, scheduled_time: datetime) -> None:
+        """
+        Avisar de una tarea nueva (o reprogramada) ya guardada en BD.
+        Si cae fuera de la ventana cargada no hace falta: se leerá al recargar.
+        """
+        with self._cond:
+            if self._horizon is not None and scheduled_time > self._horizon:
+                return
+            heapq.heappush(self._heap, (scheduled_time, task_id))
+            self._cond.notify()
+
+    def wake(self) -> None:
+        """
+        Fuerza una recarga de la ventana (p.ej. tras insertar muchas tareas).
+        """
+        with self._cond:
+            self._heap.clear()
+            self._horizon = None
+            self._cond.notify()
+
+    # ---------- Bucle interno ----------
+
+    def _wait(self, seconds: float) -> None:
+        # con polling no dormimos más de `poll` seguidos
+        if self.poll is not None:
+            seconds = min(seconds, self.poll.total_seconds())
+        self._cond.wait(timeout=seconds)
+
+    def _run(self) -> None:
+        while True:
+            task_id = None
+            reload = False
+
+            if self._watcher is not None and self._horizon is not None:
+                try:
+                    if self._watcher.changed():
+                        self._load_new()
+                except Exception:
+                    log_event(log, "scheduler.load_failed", level=logging.ERROR, exc_info=True)
+
+            with self._cond:
+                if self._stopped:
+                    return
+
+                now = datetime.utcnow()
+                if not self._heap:
+                    if self._horizon is None or now >= self._horizon:
+                        self._horizon = None
+                        reload = True
+                    else:
+                        # nada pendiente en la ventana: dormimos hasta su final
+                        self._wait((self._horizon - now).total_seconds())
+                        continue
+                else:
+                    due, next_id = self._heap[0]
+                    wait = (due - now).total_seconds()
+                    if wait > 0:
+                        self._wait(wait)
+                        continue
+                    heapq.heappop(self._heap)
+                    task_id = next_id
+
+            if reload:
+                try:
+                    self._load_window()
+                    self._load_failures = 0
+                except Exception:
+                    # p.ej. "database is locked" al arrancar: la ventana sigue
+                    # sin cargar y se reintenta, cada vez más espaciado
+                    self._load_failures += 1
+                    log_event(
+                        log, "scheduler.load_failed", level=logging.ERROR,
+                        exc_info=True, attempt=self._load_failures,
+                    )
+                    self._backoff()
+            elif task_id is not None:
+                with log_context(task_id=task_id, clinic=self.scope):
+                    try:
+                        self._execute(task_id)
+                    except Exception:
+                        log_event(log, "scheduler.task_failed", level=logging.ERROR, exc_info=True)
+                        # p.ej. BD bloqueada al reclamar: se reintenta más tarde
+                        self.notify_task(task_id, datetime.utcnow() + RETRY_DELAY)
+
+    def _backoff(self) -> None:
+        delay = self.retry_delay.total_seconds() * 2 ** min(self._load_failures - 1, 10)
+        with self._cond:
+            if not self._stopped:
+                self._cond.wait(timeout=min(delay, MAX_RETRY_SECONDS))
+
+    def _load_window(self) -> None:
+        horizon = datetime.utcnow() + self.window
+
+        with Session(self.engine) as session:
+            # antes que la ventana: lo que se cree mientras leemos lo verá _load_new
+            last_id = session.exec(select(func.max(FollowUpTask.id))).one() or 0
+            stmt = (
+                select(FollowUpTask.scheduled_time, FollowUpTask.id)
+                .where(FollowUpTask.executed == False)  # noqa: E712
+                .where(FollowUpTask.scheduled_time <= horizon)
+                .order_by(FollowUpTask.scheduled_time)
+                .limit(self.max_loaded)
+            )
+            rows = session.exec(stmt).all()
+
+        if len(rows) == self.max_loaded:
+            # ventana llena: el horizonte real es la última tarea cargada
+            horizon = rows[-1][0]
+
+        with self._cond:
+            # conservamos lo notificado mientras leíamos (duplicados no importan:
+            # _execute solo envía si la tarea sigue pendiente)
+            self._heap.extend((t, i) for t, i in rows)
+            heapq.heapify(self._heap)
+            self._horizon = horizon
+            self._last_id = max(self._last_id, last_id)
+
+    def _load_new(self) -> None:
+        """
+        Tareas con id mayor que la última vista que caen en la ventana.
+        """
+        with Session(self.engine) as session:
+            rows = session.exec(
+                select(FollowUpTask.id, FollowUpTask.scheduled_time, FollowUpTask.executed)
+                .where(FollowUpTask.id > self._last_id)
+                .order_by(FollowUpTask.id)
+                .limit(self.max_loaded + 1)
+            ).all()
+        if not rows:
+            return
+        if len(rows) > self.max_loaded:
+            # alta masiva: sale más barato releer la ventana entera
+            self.wake()
+            return
+
+        self._last_id = rows[-1][0]
+        for task_id, scheduled_time, executed in rows:
+            if not executed:
+                self.notify_task(task_id, scheduled_time)
+
+    def _execute(self, task_id: int) -> bool:
+        conn = self.engine.raw_connection()
+        try:
+            # lease antes de enviar: si otro worker ya la ejecutó o la está
+            # enviando, no se reclama y no se envía dos veces
+            tasks = claim_ids(conn, self.worker, [task_id])
+            if not tasks:
+                self._retry_after_lease(conn, task_id)
+                return False
+            sent = send_claimed(conn, self.worker, tasks, self.scope) == 1
+            # si el envío falló, release() la dejó pendiente hasta RETRY_DELAY
+            self._retry_after_lease(conn, task_id)
+            return sent
+        finally:
+            conn.close()
+
+    def _retry_after_lease(self, conn, task_id: int) -> None:
+        """
+        Si sigue pendiente con lease (de otro worker, o el de reintento tras
+        un envío fallido), volvemos a mirarla cuando caduque (por si ese
+        worker muere sin completarla).
+        """
+        row = conn.execute(
+            "SELECT lease_until FROM followuptask WHERE id = ? AND executed = 0", (task_id,)
+        ).fetchone()
+        if row is not None and row[0] is not None:
+            self.notify_task(task_id, datetime.fromisoformat(row[0]) + timedelta(seconds=1))
+
+
+# ---------- Instancias del proceso (una por shard) ----------
+
+_schedulers: dict[Optional[str], FollowUpScheduler] = {}
+# las clínicas nuevas arrancan el suyo desde las peticiones (ver main.py)
+_schedulers_lock = threading.Lock()
+_leader_locks: dict[str, object] = {}
+
+
+def _acquire_leadership(engine) -> bool:
+    """
+    Con varios workers sólo uno ejecuta el planificador de cada BD: el que
+    consiga el flock junto a su fichero. El SO lo suelta si el proceso
+    muere, y el worker que lo sustituya lo vuelve a coger al arrancar.
+    """
+    if fcntl is None or engine.url.get_backend_name() != "sqlite" or not engine.url.database:
+        return True
+    path = f"{engine.url.database}.scheduler.lock"
+    if path in _leader_locks:
+        return True
+
+    lock = open(path, "a")
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _leader_locks[path] = lock
+    return True
+
+
+def start_scheduler(engine, clinic_id: Optional[str] = None) -> Optional[FollowUpScheduler]:
+    """
+    Arranca el planificador de la BD de `clinic_id` (None = DATABASE_URL)
+    si este proceso es su líder; si no, devuelve None (las tareas que cree
+    este worker las recoge el líder por polling).
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(clinic_id)
+        if scheduler is None:
+            if not _acquire_leadership(engine):
+                return None
+            poll = (
+                timedelta(seconds=FOLLOWUP_SCHEDULER_POLL_SECONDS)
+                if FOLLOWUP_SCHEDULER_POLL_SECONDS > 0
+                else None
+            )
+            scheduler = FollowUpScheduler(engine, poll=poll, scope=clinic_id)
+            scheduler.start()
+            _schedulers[clinic_id] = scheduler
+        return scheduler
+
+
+def stop_scheduler() -> None:
+    while _schedulers:
+        _, scheduler = _schedulers.popitem()
+        scheduler.stop()
+    while _leader_locks:
+        _, lock = _leader_locks.popitem()
+        lock.close()
+
+
+def notify_followup_scheduled(task: FollowUpTask) -> None:
+    """
+    Llamar tras hacer commit de un FollowUpTask nuevo (en la BD de la
+    clínica de la petición). No hace nada si su planificador no está
+    arrancado en este proceso.
+    """
+    scheduler = _schedulers.get(current_clinic.get())
+    if scheduler is not None:
+        scheduler.notify_task(task.id, task.scheduled_time)
+
+
+def notify_followups_bulk() -> None:
+    """
+    Igual que notify_followup_scheduled tras un alta masiva: el planificador
+    relee su ventana en vez de recibir las tareas una a una.
+    """
+    scheduler = _schedulers.get(current_clinic.get())
+    if scheduler is not None:
+        scheduler.wake()
@@ -1,5 +1,207 @@
+"""
+Mensajes de follow-up y clasificación de respuestas de pacientes.
+
+Los mensajes los escribe un MessageGenerator intercambiable
+(MESSAGE_GENERATOR): las plantillas de siempre, el modelo local de prueba o
+cualquier clase "paquete.modulo:Clase" (p.ej. un cliente de LLM). Se piden
+por lotes con generate_many(), y cada petición es sólo (tipo, idioma,
+contexto sin PHI): el generador nunca ve al paciente, así que el mismo
+mensaje sirve para muchas tareas. Las peticiones repetidas de un lote se
+generan una vez y las ya generadas salen de una caché LRU.
+
+    python -m backend.services.llm_client [--tasks 200] [--batch 50] [--languages 2]
+
+mide con el modelo local lo que ahorran los lotes y la caché.
+"""
+import abc
+import argparse
+import hashlib
+import importlib
+import threading
+import time
+from typing import NamedTuple, Optional, Sequence
+
+from fastapi.concurrency import run_in_threadpool
+
+from ..config import MESSAGE_CACHE_SIZE, MESSAGE_GENERATOR, MESSAGE_LANGUAGE
 from ..models import Appointment, Patient, FollowUpType
 from .aparavi_client import redact_text_with_aparavi
+from .result_cache import ResultCache
+
+
+class MessageRequest(NamedTuple):
+    type: FollowUpType
+    language: str = MESSAGE_LANGUAGE
+    # pares (clave, valor) sin datos del paciente; forma parte de la clave de caché
+    context: tuple = ()
+
+
+class MessageGenerator(abc.ABC):
+    """
+    Interfaz de los generadores: generate_many() recibe un lote y devuelve
+    un mensaje por petición, en el mismo orden. agenerate_many() es la
+    versión para rutas async; por defecto corre generate_many en el
+    threadpool.
+    """
+
+    @abc.abstractmethod
+    def generate_many(self, requests: Sequence[MessageRequest]) -> list[str]:
+        ...
+
+    async def agenerate_many(self, requests: Sequence[MessageRequest]) -> list[str]:
+        # los generadores con cliente asíncrono pueden sobrescribirlo
+        return await run_in_threadpool(self.generate_many, list(requests))
+
+
+_TEMPLATES = {
+    FollowUpType.REMINDER: (
+        "Hi! This is a gentle reminder about your upcoming appointment. "
+        "If you feel unwell or need to reschedule, please contact the clinic."
+    ),
+    FollowUpType.CHECKIN: (
+        "Hi! We hope you are feeling okay after your recent visit. "
+        "If your symptoms get worse or you feel worried, please contact your doctor or local emergency services."
+    ),
+}
+_FALLBACK = "Hi! This is a follow-up message from your clinic."
+
+
+class TemplateGenerator(MessageGenerator):
+    """
+    Plantillas estáticas con tono empático (en inglés para cualquier idioma).
+    """
+
+    def generate_many(self, requests: Sequence[MessageRequest]) -> list[str]:
+        return [_TEMPLATES.get(request.type, _FALLBACK) for request in requests]
+
+
+_OPENERS = ("Hi!", "Hello!", "Hi there!", "Good day!")
+
+
+class LocalModel(MessageGenerator):
+    """
+    Modelo local de prueba, determinista: la misma petición da siempre el
+    mismo texto (saludo elegido por hash) y cada llamada tarda
+    `call_latency` más `message_latency` por mensaje, como un modelo remoto
+    que acepta lotes. Cuenta llamadas y mensajes generados.
+    """
+
+    def __init__(self, call_latency: float = 0.02, message_latency: float = 0.002) -> None:
+        self.call_latency = call_latency
+        self.message_latency = message_latency
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.generated = 0
+
+    def generate_many(self, requests: Sequence[MessageRequest]) -> list[str]:
+        time.sleep(self.call_latency + self.message_latency * len(requests))
+        with self._lock:
+            self.calls += 1
+            self.generated += len(requests)
+        return [self._write(request) for request in requests]
+
+    def _write(self, request: MessageRequest) -> str:
+        seed = repr((request.type.value, request.language, request.context)).encode()
+        opener = _OPENERS[hashlib.sha256(seed).digest()[0] % len(_OPENERS)]
+        body = _TEMPLATES.get(request.type, _FALLBACK).removeprefix("Hi! ")
+        return f"{opener} {body}"
+
+
+class CachedGenerator(MessageGenerator):
+    """
+    Envuelve otro generador: al de dentro sólo le llegan, en una llamada,
+    las peticiones distintas del lote que no estén ya en la caché.
+    """
+
+    def __init__(self, generator: MessageGenerator, max_entries: int = MESSAGE_CACHE_SIZE) -> None:
+        self.generator = generator
+        self.cache = ResultCache(max_entries)
+        self._lock = threading.Lock()
+        # peticiones servidas sin generar / generadas
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, requests: Sequence[MessageRequest]) -> tuple[dict, list[MessageRequest]]:
+        found = {}
+        for request in requests:
+            if request not in found:
+                message = self.cache.get(request)
+                if message is not None:
+                    found[request] = message
+        missing = list(dict.fromkeys(r for r in requests if r not in found))
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(requests) - len(missing)
+        return found, missing
+
+    def _store(self, found: dict, missing: list[MessageRequest], messages: list[str]) -> None:
+        for request, message in zip(missing, messages):
+            found[request] = self.cache.put(request, message)
+
+    def generate_many(self, requests: Sequence[MessageRequest]) -> list[str]:
+        found, missing = self._lookup(requests)
+        if missing:
+            self._store(found, missing, self.generator.generate_many(missing))
+        return [found[request] for request in requests]
+
+    async def agenerate_many(self, requests: Sequence[MessageRequest]) -> list[str]:
+        # los aciertos de caché no salen del event loop
+        found, missing = self._lookup(requests)
+        if missing:
+            self._store(found, missing, await self.generator.agenerate_many(missing))
+        return [found[request] for request in requests]
+
+    def hit_rate(self) -> float:
+        with self._lock:
+            total = self.hits + self.misses
+            return self.hits / total if total else 0.0
+
+
+_BUILTIN = {"templates": TemplateGenerator, "local": LocalModel}
+
+
+def load_generator(spec: str) -> MessageGenerator:
+    """
+    "templates", "local" o "paquete.modulo:Clase" (se instancia sin argumentos).
+    """
+    if spec in _BUILTIN:
+        return _BUILTIN[spec]()
+    module_name, _, class_name = spec.partition(":")
+    if not class_name:
+        raise ValueError(f"unknown message generator '{spec}'")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+# Generador del proceso, creado en el primer uso (como el cliente de Aparavi)
+_generator: Optional[CachedGenerator] = None
+_generator_lock = threading.Lock()
+
+
+def message_generator() -> CachedGenerator:
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = CachedGenerator(load_generator(MESSAGE_GENERATOR))
+    return _generator
+
+
+def set_message_generator(generator: MessageGenerator) -> CachedGenerator:
+    """
+    Cambia el generador del proceso (con la caché vacía).
+    """
+    global _generator
+    with _generator_lock:
+        _generator = CachedGenerator(generator)
+    return _generator
+
+
+def generate_messages(requests: Sequence[MessageRequest]) -> list[str]:
+    return message_generator().generate_many(requests)
+
+
+async def generate_messages_async(requests: Sequence[MessageRequest]) -> list[str]:
+    return await message_generator().agenerate_many(requests)
 
 
 def generate_followup_message(
@@ -8,22 +210,10 @@ def generate_followup_message(
     followup_type: FollowUpType,
 ) -> str:
     """
-    Genera mensajes de recordatorio / check-in con tono empático.
-    De momento son plantillas estáticas (sin PII).
+    Genera un mensaje de recordatorio / check-in con tono empático (sin PII).
+    Para varias tareas mejor generate_messages(), en un solo lote.
     """
-    if followup_type == FollowUpType.REMINDER:
-        return (
-            "Hi! This is a gentle reminder about your upcoming appointment. "
-            "If you feel unwell or need to reschedule, please contact the clinic."
-        )
-
-    if followup_type == FollowUpType.CHECKIN:
-        return (
-            "Hi! We hope you are feeling okay after your recent visit. "
-            "If your symptoms get worse or you feel worried, please contact your doctor or local emergency services."
-        )
-
-    return "Hi! This is a follow-up message from your clinic."
+    return generate_messages([MessageRequest(followup_type)])[0]
 
 
 def classify_patient_reply(raw_message: str) -> str:
@@ -46,3 +236,40 @@ def classify_patient_reply(raw_message: str) -> str:
         return "NEED_HUMAN_REVIEW"
 
     return "OK"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark message batching and cache with the local model")
+    parser.add_argument("--tasks", type=int, default=200, help="messages to generate")
+    parser.add_argument("--batch", type=int, default=50, help="requests per generate_many call")
+    parser.add_argument("--languages", type=int, default=2, help="distinct languages among the tasks")
+    parser.add_argument("--call-latency", type=float, default=0.02, help="seconds per model call")
+    parser.add_argument("--message-latency", type=float, default=0.002, help="seconds per generated message")
+    args = parser.parse_args()
+
+    types = list(FollowUpType)
+    requests = [
+        MessageRequest(types[i % len(types)], f"lang{i % args.languages}")
+        for i in range(args.tasks)
+    ]
+
+    def bench(name: str, generator: MessageGenerator, model: LocalModel, batch: int) -> None:
+        start = time.perf_counter()
+        for i in range(0, len(requests), batch):
+            generator.generate_many(requests[i:i + batch])
+        elapsed = time.perf_counter() - start
+        print(
+            f"[MESSAGES] {name}: {elapsed:.3f}s, {model.calls} model calls, "
+            f"{model.generated} messages generated"
+        )
+
+    one_by_one = LocalModel(args.call_latency, args.message_latency)
+    bench("one by one, no cache", one_by_one, one_by_one, 1)
+
+    batched = LocalModel(args.call_latency, args.message_latency)
+    bench(f"batches of {args.batch}, no cache", batched, batched, args.batch)
+
+    model = LocalModel(args.call_latency, args.message_latency)
+    cached = CachedGenerator(model)
+    bench(f"batches of {args.batch}, cached", cached, model, args.batch)
+    print(f"[MESSAGES] cache hit rate {cached.hit_rate():.1%}")
@@ -1,31 +1,66 @@
+from typing import Optional
+
 from ..config import (
     SMS_PROVIDER_API_KEY,
     EMAIL_PROVIDER_API_KEY,
     VOICE_PROVIDER_API_KEY,
 )
+from ..logs import get_logger, log_event
+
+log = get_logger(__name__)
 
 
-def send_sms(to: str, message: str) -> None:
+def send_sms(to: str, message: str, idempotency_key: Optional[str] = None) -> None:
     """
     Envío de SMS – placeholder.
     Aquí puedes integrar Twilio u otro proveedor.
     """
-    # ej. si tuvieras un cliente real:
+    # ej. si tuvieras un cliente real (el proveedor descarta los reenvíos
+    # con la misma idempotency_key):
     # client = TwilioClient(SMS_PROVIDER_API_KEY)
-    # client.send_sms(to=to, body=message)
-    print(f"[SMS] To: {to} | Message: {message}")
+    # client.send_sms(to=to, body=message, idempotency_key=idempotency_key)
+    log_event(
+        log, "notification.sent", sampled=True,
+        channel="sms", to=to, message=message, idempotency_key=idempotency_key,
+    )
 
 
-def send_email(to: str, subject: str, body: str) -> None:
+def send_email(to: str, subject: str, body: str, idempotency_key: Optional[str] = None) -> None:
     """
     Envío de email – placeholder.
     """
-    print(f"[EMAIL] To: {to} | Subject: {subject} | Body: {body}")
+    log_event(
+        log, "notification.sent", sampled=True,
+        channel="email", to=to, subject=subject, message=body, idempotency_key=idempotency_key,
+    )
 
 
-def send_voice_call(to: str, script_text: str) -> None:
+def send_voice_call(to: str, script_text: str, idempotency_key: Optional[str] = None) -> None:
     """
     Llamada de voz – placeholder.
     Aquí integrarías un proveedor tipo Twilio Voice o similar.
     """
-    print(f"[VOICE] To: {to} | Script: {script_text}")
+    log_event(
+        log, "notification.sent", sampled=True,
+        channel="voice", to=to, message=script_text, idempotency_key=idempotency_key,
+    )
+
+
+def send_followup(channel, to: str, message: str, idempotency_key: Optional[str] = None) -> bool:
+    """
+    Envía un follow-up por el canal indicado (FollowUpChannel o string,
+    p.ej. "sms" / "SMS" tal y como lo guarda SQLite). `idempotency_key`
+    identifica el mensaje entre reintentos (ver services/followup_leases.py).
+    Devuelve False si el canal no es conocido.
+    """
+    name = str(getattr(channel, "value", channel)).lower()
+
+    if name == "sms":
+        send_sms(to, message, idempotency_key)
+    elif name == "email":
+        send_email(to, "Appointment follow-up", message, idempotency_key)
+    elif name == "voice":
+        send_voice_call(to, message, idempotency_key)
+    else:
+        return False
+    return True
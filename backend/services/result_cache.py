@@ -0,0 +1,42 @@
+"""
+Caché LRU en memoria para resultados calculados.
+
+Pensada para claves que incluyen la versión de agenda (schedule_versions.py):
+una entrada nunca se invalida, simplemente deja de pedirse cuando sube la
+versión y acaba saliendo por LRU. Como la versión vive en la BD, cada
+worker tiene su propia caché y todas siguen siendo coherentes. Como en
+single_flight, los valores se comparten: no modificarlos.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 2048) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> Any:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
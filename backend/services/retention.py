@@ -0,0 +1,181 @@
+"""
+Retención de follow-ups ejecutados y compactación incremental.
+
+Las FollowUpTask ejecutadas no se borraban nunca. Este job borra las
+ejecutadas hace más de N días (en `followuptask` y en
+`followuptask_archive`), dejando antes su recuento en followupdaysummary
+(día, tipo, canal), y después devuelve al sistema las páginas libres con
+`PRAGMA incremental_vacuum` (auto_vacuum incremental, migración 3).
+
+Todo va por lotes cortos, cada uno en su propia transacción, con una pausa
+entre lotes: un worker que quiera escribir espera como mucho un lote.
+
+    python -m backend.services.retention [--days 180] [--purge-only] [--all-clinics]
+
+Las funciones reciben una conexión DB-API de SQLite (engine.raw_connection()).
+"""
+import argparse
+import time
+from datetime import date, datetime, timedelta
+from typing import NamedTuple
+
+from ..config import FOLLOWUP_RETENTION_DAYS
+from ..database import sqlite_timestamp
+from ..migrations import AUTO_VACUUM_INCREMENTAL
+
+BATCH_ROWS = 2_000
+VACUUM_PAGES = 1_000
+PAUSE_SECONDS = 0.05
+
+TABLES = ("followuptask", "followuptask_archive")
+
+
+class RetentionReport(NamedTuple):
+    rows_deleted: dict[str, int]
+    pages_freed: int
+    bytes_reclaimed: int
+    incremental_vacuum: bool
+
+
+def _db_pages(conn) -> tuple[int, int, int]:
+    """
+    (páginas del fichero, páginas libres, tamaño de página)
+    """
+    return (
+        conn.execute("PRAGMA page_count").fetchone()[0],
+        conn.execute("PRAGMA freelist_count").fetchone()[0],
+        conn.execute("PRAGMA page_size").fetchone()[0],
+    )
+
+
+def _purge_batch(conn, table: str, cutoff_ts: str, summarize: bool, batch_rows: int) -> int:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM temp.retention_ids")
+        conn.execute(
+            f"""
+            INSERT INTO temp.retention_ids (id)
+            SELECT id FROM {table}
+            WHERE executed = 1 AND scheduled_time < ?
+              AND (executed_at IS NULL OR executed_at < ?)
+            LIMIT ?
+            """,
+            (cutoff_ts, cutoff_ts, batch_rows),
+        )
+        deleted = conn.execute("SELECT COUNT(*) FROM temp.retention_ids").fetchone()[0]
+        if deleted and summarize:
+            conn.execute(
+                f"""
+                INSERT INTO followupdaysummary (day, type, channel, executed)
+                SELECT date(scheduled_time), type, channel, COUNT(*)
+                FROM {table}
+                WHERE id IN (SELECT id FROM temp.retention_ids)
+                GROUP BY date(scheduled_time), type, channel
+                ON CONFLICT (day, type, channel) DO UPDATE SET
+                    executed = executed + excluded.executed
+                """
+            )
+        if deleted:
+            conn.execute(f"DELETE FROM {table} WHERE id IN (SELECT id FROM temp.retention_ids)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return deleted
+
+
+def incremental_vacuum(conn, pages: int = VACUUM_PAGES, pause: float = PAUSE_SECONDS) -> int:
+    """
+    Devuelve al sistema las páginas libres, de `pages` en `pages`.
+    No hace nada si la BD no tiene auto_vacuum incremental.
+    Devuelve las páginas liberadas.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        return 0
+    conn.commit()
+    freed = 0
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free:
+        # executescript y no execute: el módulo sqlite3 sólo da un paso a los
+        # PRAGMA sin filas y incremental_vacuum libera una página por paso
+        conn.executescript(f"PRAGMA incremental_vacuum({int(min(free, pages))})")
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free:
+            break
+        freed += free - remaining
+        free = remaining
+        time.sleep(pause)
+    return freed
+
+
+def purge_executed_followups(
+    conn,
+    older_than: date,
+    summarize: bool = True,
+    batch_rows: int = BATCH_ROWS,
+    pause: float = PAUSE_SECONDS,
+) -> RetentionReport:
+    """
+    Borra los follow-ups ejecutados antes de `older_than` (con summarize,
+    sumando antes su recuento a followupdaysummary) y compacta el fichero.
+    """
+    conn.commit()
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS retention_ids (id INTEGER PRIMARY KEY)")
+    pages_before, _, page_size = _db_pages(conn)
+
+    cutoff_ts = sqlite_timestamp(datetime.combine(older_than, datetime.min.time()))
+    deleted = {}
+    try:
+        for table in TABLES:
+            total = 0
+            while True:
+                count = _purge_batch(conn, table, cutoff_ts, summarize, batch_rows)
+                total += count
+                if count < batch_rows:
+                    break
+                time.sleep(pause)
+            deleted[table] = total
+    finally:
+        conn.execute("DROP TABLE IF EXISTS temp.retention_ids")
+
+    vacuumed = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+    incremental_vacuum(conn, pause=pause)
+    pages_after, _, _ = _db_pages(conn)
+
+    freed = max(pages_before - pages_after, 0)
+    return RetentionReport(
+        rows_deleted=deleted,
+        pages_freed=freed,
+        bytes_reclaimed=freed * page_size,
+        incremental_vacuum=vacuumed,
+    )
+
+
+if __name__ == "__main__":
+    from ..database import fan_out
+
+    parser = argparse.ArgumentParser(description="Executed follow-up retention (nightly job)")
+    parser.add_argument("--days", type=int, default=FOLLOWUP_RETENTION_DAYS, help="keep this many days of executed tasks")
+    parser.add_argument("--purge-only", action="store_true", help="delete without keeping daily counts")
+    parser.add_argument("--all-clinics", action="store_true", help="also every clinic shard")
+    args = parser.parse_args()
+
+    older_than = date.today() - timedelta(days=args.days)
+
+    def run(clinic_id, engine) -> RetentionReport:
+        conn = engine.raw_connection()
+        try:
+            return purge_executed_followups(conn, older_than, summarize=not args.purge_only)
+        finally:
+            conn.close()
+
+    results = fan_out(run, clinics=None if args.all_clinics else [], include_default=True)
+    for clinic_id, report in results.items():
+        name = "main" if clinic_id is None else f"clinic {clinic_id}"
+        rows = ", ".join(f"{table}={count}" for table, count in report.rows_deleted.items())
+        print(
+            f"[RETENTION] {name}: before {older_than.isoformat()}: deleted {rows}; "
+            f"reclaimed {report.bytes_reclaimed} bytes ({report.pages_freed} pages)"
+        )
+        if not report.incremental_vacuum:
+            print(f"[RETENTION] {name}: auto_vacuum is not incremental; run the migrations to enable it")
@@ -0,0 +1,279 @@
+"""
+Rollups diarios por doctor: conteos, espera y duración de visita.
+
+Las esperas y duraciones se resumen en histogramas de cubos fijos
+(1 minuto hasta 60, 5 minutos hasta 240 y un cubo de desbordamiento), que se
+suman entre días. Así los percentiles de cualquier rango salen de mezclar
+unas decenas de filas, con un error de como mucho medio cubo.
+
+Todo el cálculo se hace con agregados SQL (GROUP BY en SQLite), no fila a
+fila en Python. Lo rellena el job nocturno (python -m backend.services.rollups)
+y, al cerrarse la jornada de un doctor, rollup_closed_day().
+"""
+import argparse
+import json
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from ..database import sqlite_timestamp
+from .archive import union_all
+
+FINE_LIMIT = 60      # minutos con cubos de 1 minuto
+COARSE_LIMIT = 240   # minutos con cubos de 5 minutos
+COARSE_WIDTH = 5
+OVERFLOW_BUCKET = FINE_LIMIT + (COARSE_LIMIT - FINE_LIMIT) // COARSE_WIDTH
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# No-show: cita saltada sin que el paciente llegara (un skip con el paciente
+# presente es del médico). Es la misma definición para los KPIs en vivo
+# (pathway_kpis) y los rollups.
+NO_SHOW_SQL = "arrival_status = 'SKIPPED'"
+
+# redondeado: julianday arrastra error de coma flotante (15 min -> 14.9999)
+_MINUTES = "ROUND((julianday({end}) - julianday({start})) * 1440, 3)"
+
+
+def _bucket_sql(minutes: str) -> str:
+    return f"""
+        CASE
+            WHEN {minutes} < 0 THEN 0
+            WHEN {minutes} < {FINE_LIMIT} THEN CAST({minutes} AS INTEGER)
+            WHEN {minutes} < {COARSE_LIMIT}
+                THEN {FINE_LIMIT} + CAST(({minutes} - {FINE_LIMIT}) / {COARSE_WIDTH} AS INTEGER)
+            ELSE {OVERFLOW_BUCKET}
+        END
+    """
+
+
+_WAIT = _MINUTES.format(start="patient_arrival_time", end="visit_start_time")
+_VISIT = _MINUTES.format(start="visit_start_time", end="visit_end_time")
+
+_FILTER = "date >= ? AND date <= ?{doctor}"
+
+# días archivados incluidos (ver archive.py)
+_APPOINTMENTS = union_all("appointment")
+
+_COUNTS_SQL = f"""
+    SELECT doctor_id, date,
+           COUNT(*),
+           SUM(status = 'COMPLETED'),
+           SUM(status = 'SKIPPED'),
+           SUM({NO_SHOW_SQL}),
+           SUM(CASE WHEN status != 'SKIPPED' THEN slot_minutes ELSE 0 END),
+           COUNT(visit_start_time IS NOT NULL AND patient_arrival_time IS NOT NULL OR NULL),
+           COALESCE(SUM(MAX({_WAIT}, 0)), 0),
+           COUNT(visit_end_time IS NOT NULL AND visit_start_time IS NOT NULL OR NULL),
+           COALESCE(SUM(MAX({_VISIT}, 0)), 0)
+    FROM {_APPOINTMENTS}
+    WHERE {{filter}} AND status != 'CANCELLED'
+    GROUP BY doctor_id, date
+"""
+
+_HIST_SQL = f"""
+    SELECT doctor_id, date, {{bucket}} AS bucket, COUNT(*)
+    FROM {_APPOINTMENTS}
+    WHERE {{filter}} AND {{start}} IS NOT NULL AND {{end}} IS NOT NULL
+    GROUP BY doctor_id, date, bucket
+"""
+
+
+# ---------- Sketch: histograma de cubos fijos ----------
+
+
+def bucket_bounds(bucket: int) -> tuple[float, float]:
+    """
+    [inicio, fin) en minutos del cubo. El de desbordamiento no tiene fin.
+    """
+    if bucket < FINE_LIMIT:
+        return float(bucket), float(bucket + 1)
+    if bucket < OVERFLOW_BUCKET:
+        lower = FINE_LIMIT + (bucket - FINE_LIMIT) * COARSE_WIDTH
+        return float(lower), float(lower + COARSE_WIDTH)
+    return float(COARSE_LIMIT), float("inf")
+
+
+def merge_histograms(histograms: Iterable[str]) -> Counter:
+    """
+    Suma histogramas serializados (JSON {bucket: count}).
+    """
+    merged: Counter = Counter()
+    for raw in histograms:
+        for bucket, count in json.loads(raw).items():
+            merged[int(bucket)] += count
+    return merged
+
+
+def histogram_quantile(histogram: Counter, q: float) -> Optional[float]:
+    """
+    Cuantil aproximado: punto medio del cubo en el que cae (el límite
+    inferior si es el de desbordamiento).
+    """
+    total = sum(histogram.values())
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= target:
+            lower, upper = bucket_bounds(bucket)
+            return lower if upper == float("inf") else (lower + upper) / 2
+    return bucket_bounds(max(histogram))[0]
+
+
+def summarize(rollups: Iterable) -> dict:
+    """
+    Mezcla rollups diarios (filas DoctorDayRollup) en un resumen del rango.
+    """
+    rollups = list(rollups)
+    total = sum(r.total_appointments for r in rollups)
+    booked = sum(r.booked_minutes for r in rollups)
+
+    def duration(count_attr: str, sum_attr: str, hist_attr: str) -> dict:
+        count = sum(getattr(r, count_attr) for r in rollups)
+        histogram = merge_histograms(getattr(r, hist_attr) for r in rollups)
+        summary = {
+            "count": count,
+            "mean": sum(getattr(r, sum_attr) for r in rollups) / count if count else None,
+        }
+        for q in QUANTILES:
+            summary[f"p{round(q * 100)}"] = histogram_quantile(histogram, q)
+        return summary
+
+    visit = duration("visit_count", "visit_sum_minutes", "visit_histogram")
+    visit_minutes = sum(r.visit_sum_minutes for r in rollups)
+
+    return {
+        "days": len(rollups),
+        "total_appointments": total,
+        "completed": sum(r.completed for r in rollups),
+        "skipped": sum(r.skipped for r in rollups),
+        "no_shows": sum(r.no_shows for r in rollups),
+        "no_show_rate": sum(r.no_shows for r in rollups) / total if total else 0.0,
+        "wait_minutes": duration("wait_count", "wait_sum_minutes", "wait_histogram"),
+        "visit_minutes": visit,
+        "booked_minutes": booked,
+        # minutos de visita reales / minutos reservados
+        "utilization": visit_minutes / booked if booked else None,
+    }
+
+
+# ---------- Cálculo de rollups ----------
+
+
+def compute_rollups(
+    conn,
+    start: date,
+    end: date,
+    doctor_id: Optional[int] = None,
+) -> int:
+    """
+    (Re)calcula los rollups de [start, end] y los guarda con un upsert.
+    Devuelve cuántos (doctor, día) se han escrito.
+    """
+    doctor_filter = " AND doctor_id = ?" if doctor_id is not None else ""
+    where = _FILTER.format(doctor=doctor_filter)
+    params = [start.isoformat(), end.isoformat()]
+    if doctor_id is not None:
+        params.append(doctor_id)
+
+    rows = {}
+    for row in conn.execute(_COUNTS_SQL.format(filter=where), params).fetchall():
+        key = (row[0], row[1])
+        rows[key] = {
+            "counts": row[2:],
+            "wait": {},
+            "visit": {},
+        }
+
+    for name, begin, finish in (
+        ("wait", "patient_arrival_time", "visit_start_time"),
+        ("visit", "visit_start_time", "visit_end_time"),
+    ):
+        sql = _HIST_SQL.format(
+            bucket=_bucket_sql(_MINUTES.format(start=begin, end=finish)),
+            filter=where,
+            start=begin,
+            end=finish,
+        )
+        for doc_id, day, bucket, count in conn.execute(sql, params).fetchall():
+            rows[(doc_id, day)][name][bucket] = count
+
+    now = sqlite_timestamp(datetime.utcnow())
+    conn.executemany(
+        """
+        INSERT INTO doctordayrollup (
+            doctor_id, day, total_appointments, completed, skipped, no_shows,
+            booked_minutes, wait_count, wait_sum_minutes, visit_count,
+            visit_sum_minutes, wait_histogram, visit_histogram, computed_at
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (doctor_id, day) DO UPDATE SET
+            total_appointments = excluded.total_appointments,
+            completed = excluded.completed,
+            skipped = excluded.skipped,
+            no_shows = excluded.no_shows,
+            booked_minutes = excluded.booked_minutes,
+            wait_count = excluded.wait_count,
+            wait_sum_minutes = excluded.wait_sum_minutes,
+            visit_count = excluded.visit_count,
+            visit_sum_minutes = excluded.visit_sum_minutes,
+            wait_histogram = excluded.wait_histogram,
+            visit_histogram = excluded.visit_histogram,
+            computed_at = excluded.computed_at
+        """,
+        [
+            (
+                doc_id,
+                day,
+                *data["counts"],
+                json.dumps(data["wait"]),
+                json.dumps(data["visit"]),
+                now,
+            )
+            for (doc_id, day), data in rows.items()
+        ],
+    )
+    conn.commit()
+    return len(rows)
+
+
+def rollup_closed_day(engine, doctor_id: int, day: date) -> int:
+    """
+    Hook de cierre: rollup del día de un doctor en cuanto no le quedan citas
+    por atender (lo lanzan end_visit y skip). El job nocturno lo recalcula
+    igualmente, por si la jornada se corrige después.
+    """
+    conn = engine.raw_connection()
+    try:
+        return compute_rollups(conn, day, day, doctor_id)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from ..database import fan_out, init_db
+
+    yesterday = date.today() - timedelta(days=1)
+
+    parser = argparse.ArgumentParser(description="Daily doctor rollups (nightly job)")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, default=yesterday)
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, default=None)
+    parser.add_argument("--doctor-id", type=int, default=None)
+    parser.add_argument("--all-clinics", action="store_true", help="also every clinic shard")
+    args = parser.parse_args()
+
+    def run(clinic_id, engine) -> int:
+        init_db(target=engine)
+        conn = engine.raw_connection()
+        try:
+            return compute_rollups(conn, args.start, args.end or args.start, args.doctor_id)
+        finally:
+            conn.close()
+
+    results = fan_out(run, clinics=None if args.all_clinics else [], include_default=True)
+    for clinic_id, written in results.items():
+        name = "main" if clinic_id is None else f"clinic {clinic_id}"
+        print(f"[ROLLUPS] {name}: {written} doctor-days written")
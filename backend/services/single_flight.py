@@ -0,0 +1,77 @@
+"""
+Single-flight: las llamadas concurrentes con la misma clave comparten una
+única ejecución y su resultado (o su excepción).
+
+Sirve tanto desde el threadpool (endpoints `def`) como desde el event loop
+(endpoints `async def`): las llamadas en curso son concurrent.futures.Future,
+que un hilo puede esperar con result() y una corrutina con
+asyncio.wrap_future(). El resultado se comparte: quien lo reciba no debe
+modificarlo.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+from fastapi.concurrency import run_in_threadpool
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+        # el loop sólo guarda referencias débiles a sus tareas: sin esto una
+        # ejecución lanzada por do_async podría recogerse antes de acabar
+        self._tasks: set[asyncio.Task] = set()
+
+    def _join(self, key: Hashable) -> tuple[Future, bool]:
+        """
+        Devuelve (future de la llamada en curso, True si nos toca ejecutarla).
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future, fn: Callable[[], Any]) -> None:
+        try:
+            result = fn()
+        except BaseException as exc:
+            self._forget(key)
+            future.set_exception(exc)
+        else:
+            self._forget(key)
+            future.set_result(result)
+
+    def _forget(self, key: Hashable) -> None:
+        # antes de resolver: quien llegue después ya lanza un cálculo nuevo
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Ejecuta fn() o espera a la ejecución en curso con la misma clave.
+        """
+        future, leader = self._join(key)
+        if leader:
+            self._finish(key, future, fn)
+        return future.result()
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Igual que do() desde una corrutina; fn (síncrona) va al threadpool.
+        Si se cancela la petición que la lanzó, la ejecución sigue para el resto.
+        """
+        future, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(run_in_threadpool(self._finish, key, future, fn))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
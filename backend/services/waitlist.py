@@ -0,0 +1,297 @@
+"""
+Lista de espera que rellena los huecos que se liberan (skip y cancelaciones).
+
+Cada worker tiene en memoria las entradas en espera agrupadas por
+("doctor", id, día) y ("specialty", nombre, día), cada grupo ordenado por
+el inicio de su ventana: para un hueco liberado sólo se miran las entradas
+de ese doctor/especialidad y día que ya pueden empezar a esa hora (búsqueda
+binaria), nunca la lista entera. Gana la más antigua (FIFO) cuya ventana
+incluya la hora y a la que le baste la duración del hueco.
+
+Coherencia entre workers:
+- antes de cada búsqueda se leen las altas nuevas (id > último visto);
+- la entrada elegida se reclama con un UPDATE condicional (status =
+  'WAITING'): si otro worker ya la ofreció o se canceló, se descarta y se
+  prueba la siguiente;
+- cada WAITLIST_RELOAD_SECONDS se relee todo, para recoger las entradas
+  que vuelven a estar en espera.
+
+Una oferta caduca a los WAITLIST_OFFER_MINUTES: expire_offers() devuelve
+esas entradas a la espera y ofrece su hueco a la siguiente.
+"""
+import threading
+import time as clock
+from bisect import bisect_right, insort
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, NamedTuple, Optional
+
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from ..config import WAITLIST_OFFER_MINUTES, WAITLIST_RELOAD_SECONDS
+from ..database import current_clinic
+from ..models import Doctor, WaitlistEntry, WaitlistStatus
+from .notifications import send_followup
+
+OFFER_TTL = timedelta(minutes=WAITLIST_OFFER_MINUTES)
+
+# columnas que se limpian cuando una oferta vuelve a la espera
+NOT_OFFERED = {
+    "status": WaitlistStatus.WAITING,
+    "offered_doctor_id": None,
+    "offered_time": None,
+    "offered_at": None,
+    "offer_expires_at": None,
+}
+
+
+def _minutes(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+class _Waiting(NamedTuple):
+    earliest: int
+    id: int
+    latest: int
+    slot_minutes: int
+
+
+# lo que necesita el índice (filas ligeras en vez de modelos)
+_INDEXED_COLUMNS = (
+    WaitlistEntry.id,
+    WaitlistEntry.doctor_id,
+    WaitlistEntry.specialty,
+    WaitlistEntry.day,
+    WaitlistEntry.earliest,
+    WaitlistEntry.latest,
+    WaitlistEntry.slot_minutes,
+)
+
+
+def _keys(entry) -> list[tuple]:
+    keys = []
+    if entry.doctor_id is not None:
+        keys.append(("doctor", entry.doctor_id, entry.day))
+    if entry.specialty:
+        keys.append(("specialty", entry.specialty.lower(), entry.day))
+    return keys
+
+
+class WaitlistIndex:
+    def __init__(self, reload_seconds: float = WAITLIST_RELOAD_SECONDS) -> None:
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._buckets: dict[tuple, list[_Waiting]] = {}
+        self._entry_keys: dict[int, list[tuple]] = {}
+        self._last_id = 0
+        self._loaded_at: Optional[float] = None
+
+    def add(self, entry: WaitlistEntry) -> None:
+        with self._lock:
+            self._add(entry)
+
+    def _add(self, entry) -> None:
+        if entry.id in self._entry_keys:
+            return
+        item = _Waiting(_minutes(entry.earliest), entry.id, _minutes(entry.latest), entry.slot_minutes)
+        keys = _keys(entry)
+        for key in keys:
+            insort(self._buckets.setdefault(key, []), item)
+        self._entry_keys[entry.id] = keys
+        self._last_id = max(self._last_id, entry.id)
+
+    def discard(self, entry_id: int) -> None:
+        with self._lock:
+            for key in self._entry_keys.pop(entry_id, ()):
+                bucket = self._buckets[key]
+                bucket[:] = [item for item in bucket if item.id != entry_id]
+                if not bucket:
+                    del self._buckets[key]
+
+    def sync(self, session: Session) -> None:
+        """
+        Lee las entradas en espera nuevas (o todas, la primera vez y cada
+        reload_seconds).
+        """
+        stmt = select(*_INDEXED_COLUMNS).where(
+            WaitlistEntry.status == WaitlistStatus.WAITING,
+            WaitlistEntry.day >= date.today(),
+        )
+        with self._lock:
+            full = self._loaded_at is None or clock.monotonic() - self._loaded_at >= self.reload_seconds
+            if full:
+                self._buckets.clear()
+                self._entry_keys.clear()
+                self._loaded_at = clock.monotonic()
+            else:
+                stmt = stmt.where(WaitlistEntry.id > self._last_id)
+            for entry in session.exec(stmt):
+                self._add(entry)
+
+    def candidates(self, doctor: Doctor, day: date, start: time, slot_minutes: int) -> list[int]:
+        """
+        Ids de las entradas que aceptan el hueco, la más antigua primero.
+        """
+        at = _minutes(start)
+        found = set()
+        with self._lock:
+            for key in (("doctor", doctor.id, day), ("specialty", doctor.specialty.lower(), day)):
+                bucket = self._buckets.get(key, ())
+                # sólo las que ya pueden empezar a esa hora
+                upto = bisect_right(bucket, (at, float("inf")))
+                found.update(
+                    item.id
+                    for item in bucket[:upto]
+                    if item.latest >= at and item.slot_minutes <= slot_minutes
+                )
+        return sorted(found)
+
+
+# uno por BD (principal y clínicas)
+_indexes: dict[Optional[str], WaitlistIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def waitlist_index() -> WaitlistIndex:
+    """
+    Índice de la BD de la clínica actual.
+    """
+    clinic_id = current_clinic.get()
+    with _indexes_lock:
+        index = _indexes.get(clinic_id)
+        if index is None:
+            index = _indexes[clinic_id] = WaitlistIndex()
+        return index
+
+
+def offer_freed_slot(
+    session: Session,
+    doctor: Doctor,
+    day: date,
+    start: time,
+    slot_minutes: int,
+    exclude: Iterable[int] = (),
+) -> Optional[WaitlistEntry]:
+    """
+    Reserva el hueco liberado para la mejor entrada en espera (la marca
+    OFFERED con el hueco) y la devuelve; None si nadie lo quiere o el hueco
+    ya ha empezado. El aviso al paciente se manda aparte con send_offer().
+    """
+    if datetime.combine(day, start) <= datetime.now():
+        return None
+
+    index = waitlist_index()
+    index.sync(session)
+    skip = set(exclude)
+    for entry_id in index.candidates(doctor, day, start, slot_minutes):
+        if entry_id in skip:
+            continue
+        index.discard(entry_id)
+        now = datetime.utcnow()
+        claimed = session.exec(
+            update(WaitlistEntry)
+            .where(WaitlistEntry.id == entry_id, WaitlistEntry.status == WaitlistStatus.WAITING)
+            .values(
+                status=WaitlistStatus.OFFERED,
+                offered_doctor_id=doctor.id,
+                offered_time=start,
+                offered_at=now,
+                offer_expires_at=now + OFFER_TTL,
+            )
+        ).rowcount
+        session.commit()
+        if claimed:
+            return session.get(WaitlistEntry, entry_id)
+    return None
+
+
+def expire_offers(session: Session, now: Optional[datetime] = None) -> list[WaitlistEntry]:
+    """
+    Devuelve a la espera las ofertas caducadas y ofrece cada hueco a la
+    siguiente entrada (no a la misma). Devuelve las ofertas nuevas, para
+    avisar con send_offer().
+    """
+    now = now or datetime.utcnow()
+    expired = session.exec(
+        select(WaitlistEntry).where(
+            WaitlistEntry.status == WaitlistStatus.OFFERED,
+            WaitlistEntry.offer_expires_at < now,
+        )
+    ).all()
+    offers = []
+    for entry in expired:
+        doctor_id, start = entry.offered_doctor_id, entry.offered_time
+        # condicional: si la acepta justo ahora, gana la aceptación
+        reopened = session.exec(
+            update(WaitlistEntry)
+            .where(
+                WaitlistEntry.id == entry.id,
+                WaitlistEntry.status == WaitlistStatus.OFFERED,
+                WaitlistEntry.offer_expires_at < now,
+            )
+            .values(**NOT_OFFERED)
+        ).rowcount
+        session.commit()
+        if not reopened:
+            continue
+        session.refresh(entry)
+        doctor = session.get(Doctor, doctor_id)
+        if doctor is not None:
+            offer = offer_freed_slot(session, doctor, entry.day, start, entry.slot_minutes, exclude=[entry.id])
+            if offer is not None:
+                offers.append(offer)
+        # después de ofrecer: para el siguiente hueco vuelve a contar
+        waitlist_index().add(entry)
+    return offers
+
+
+def claim_offer(session: Session, entry_id: int, now: Optional[datetime] = None) -> bool:
+    """
+    Marca BOOKED la entrada si su oferta sigue vigente (UPDATE condicional:
+    de dos aceptaciones a la vez sólo una lo consigue). Luego hay que
+    reservar la cita, o devolverla a la espera con reopen_offer().
+    """
+    now = now or datetime.utcnow()
+    claimed = session.exec(
+        update(WaitlistEntry)
+        .where(
+            WaitlistEntry.id == entry_id,
+            WaitlistEntry.status == WaitlistStatus.OFFERED,
+            WaitlistEntry.offer_expires_at >= now,
+        )
+        .values(status=WaitlistStatus.BOOKED)
+    ).rowcount
+    session.commit()
+    return claimed == 1
+
+
+def reopen_offer(session: Session, entry: WaitlistEntry) -> None:
+    """
+    Devuelve a la espera una entrada reclamada con claim_offer() cuyo hueco
+    no se pudo reservar.
+    """
+    session.exec(
+        update(WaitlistEntry)
+        .where(
+            WaitlistEntry.id == entry.id,
+            WaitlistEntry.status == WaitlistStatus.BOOKED,
+            WaitlistEntry.appointment_id.is_(None),
+        )
+        .values(**NOT_OFFERED)
+    )
+    session.commit()
+    session.refresh(entry)
+    if entry.status == WaitlistStatus.WAITING:
+        waitlist_index().add(entry)
+
+
+def send_offer(entry: WaitlistEntry, doctor_name: str) -> None:
+    """
+    Avisa al paciente del hueco ofrecido por su canal.
+    """
+    message = (
+        f"Good news! A slot with {doctor_name} opened up on {entry.day.isoformat()} "
+        f"at {entry.offered_time:%H:%M}. Accept it in the app to book it."
+    )
+    # Para el demo no guardamos teléfono/email reales (como en /followups/run_once)
+    send_followup(entry.channel, f"patient-{entry.patient_id}", message)
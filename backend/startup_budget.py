@@ -0,0 +1,97 @@
+"""
+Comprobación del presupuesto de arranque en modo FAST_START.
+
+Mide, en procesos nuevos y contra una base de datos temporal ya migrada:
+- import: tiempo de `import backend.main`
+- first_request: desde el inicio del import hasta la respuesta de GET /ready
+  (import + startup + primera petición; el import del cliente de pruebas
+  no cuenta)
+
+Toma la mediana de varias ejecuciones y sale con código 1 si alguna métrica
+supera su presupuesto, para usarlo en CI:
+
+    python -m backend.startup_budget [--runs 5]
+
+Presupuestos (ms) configurables con STARTUP_IMPORT_BUDGET_MS y
+STARTUP_FIRST_REQUEST_BUDGET_MS.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "1500"))
+FIRST_REQUEST_BUDGET_MS = float(os.getenv("STARTUP_FIRST_REQUEST_BUDGET_MS", "2000"))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, time
+start = time.perf_counter()
+import backend.main as main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+client_loaded = time.perf_counter()
+with TestClient(main.app) as client:
+    response = client.get("/ready")
+done = time.perf_counter()
+print(json.dumps({
+    "import": (imported - start) * 1000,
+    "first_request": ((done - client_loaded) + (imported - start)) * 1000,
+    "status": response.status_code,
+}))
+"""
+
+
+def _run(args: list[str], env: dict) -> str:
+    result = subprocess.run(
+        [sys.executable, *args],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout
+
+
+def measure(runs: int = 3) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'budget.db')}",
+            "FAST_START": "1",
+        }
+        _run(["-m", "backend.migrations"], env)
+
+        samples = []
+        for _ in range(runs):
+            output = _run(["-c", _PROBE], env)
+            sample = json.loads(output.strip().splitlines()[-1])
+            if sample["status"] != 200:
+                raise RuntimeError(f"/ready answered {sample['status']}")
+            samples.append(sample)
+
+    return {
+        "import_ms": statistics.median(s["import"] for s in samples),
+        "first_request_ms": statistics.median(s["first_request"] for s in samples),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fast-start budget check")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    result = measure(args.runs)
+    budgets = {"import_ms": IMPORT_BUDGET_MS, "first_request_ms": FIRST_REQUEST_BUDGET_MS}
+
+    failed = False
+    for metric, value in result.items():
+        ok = value <= budgets[metric]
+        failed |= not ok
+        print(f"{metric}: {value:.0f} ms (budget {budgets[metric]:.0f} ms) {'OK' if ok else 'OVER'}")
+    sys.exit(1 if failed else 0)
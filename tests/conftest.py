@@ -0,0 +1,64 @@
+"""
+Cada test trabaja sobre su propia BD: una clínica nueva (un shard con el
+esquema migrado) que el cliente elige con X-Clinic-Id y que queda en
+current_clinic para el código que se llama directamente.
+
+Las variables de entorno se fijan antes de importar backend (config.py las
+lee al importarse).
+"""
+import os
+import tempfile
+import uuid
+
+_TMP = tempfile.mkdtemp(prefix="healthcareapp-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'main.db')}"
+os.environ["CLINIC_DATABASE_DIR"] = os.path.join(_TMP, "clinics")
+os.environ["FOLLOWUP_SCHEDULER_ENABLED"] = "0"
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+
+from backend.database import clinic_db_path, create_clinic, current_clinic  # noqa: E402
+
+
+@pytest.fixture
+def clinic() -> str:
+    clinic_id = uuid.uuid4().hex[:12]
+    create_clinic(clinic_id)
+    token = current_clinic.set(clinic_id)
+    yield clinic_id
+    current_clinic.reset(token)
+
+
+@pytest.fixture
+def db(clinic):
+    from backend.database import get_engine
+
+    return get_engine(clinic)
+
+
+@pytest.fixture
+def db_path(clinic) -> str:
+    return clinic_db_path(clinic)
+
+
+@pytest.fixture
+def session(db):
+    with Session(db, expire_on_commit=False) as s:
+        yield s
+
+
+@pytest.fixture
+def raw_conn(db):
+    conn = db.raw_connection()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def client(clinic):
+    from backend.main import app
+
+    with TestClient(app, headers={"X-Clinic-Id": clinic}) as c:
+        yield c
@@ -0,0 +1,90 @@
+"""
+Altas mínimas para los tests (directas en BD, sin pasar por las rutas).
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+
+from sqlmodel import Session
+
+from backend.models import (
+    Appointment,
+    AppointmentStatus,
+    ArrivalStatus,
+    Doctor,
+    DoctorPreferences,
+    FollowUpChannel,
+    FollowUpTask,
+    FollowUpType,
+    Patient,
+)
+
+
+def add_doctor(session: Session, name: str = "Dr. Test", specialty: str = "General") -> Doctor:
+    doctor = Doctor(name=name, specialty=specialty)
+    session.add(doctor)
+    session.commit()
+    session.refresh(doctor)
+    return doctor
+
+
+def add_preferences(
+    session: Session, doctor: Doctor, start: time = time(8), end: time = time(18), **kwargs
+) -> DoctorPreferences:
+    prefs = DoctorPreferences(doctor_id=doctor.id, workday_start=start, workday_end=end, **kwargs)
+    session.add(prefs)
+    session.commit()
+    return prefs
+
+
+def add_patient(session: Session, name: str = "Test Patient") -> Patient:
+    patient = Patient(display_name=name)
+    session.add(patient)
+    session.commit()
+    session.refresh(patient)
+    return patient
+
+
+def add_appointment(
+    session: Session,
+    doctor: Doctor,
+    patient: Patient,
+    day: Optional[date] = None,
+    at: time = time(10),
+    status: AppointmentStatus = AppointmentStatus.SCHEDULED,
+    **kwargs,
+) -> Appointment:
+    appointment = Appointment(
+        doctor_id=doctor.id,
+        patient_id=patient.id,
+        date=day or date.today() + timedelta(days=1),
+        scheduled_time=at,
+        current_time=at,
+        status=status,
+        arrival_status=ArrivalStatus.NOT_ARRIVED,
+        **kwargs,
+    )
+    session.add(appointment)
+    session.commit()
+    session.refresh(appointment)
+    return appointment
+
+
+def add_followup(
+    session: Session,
+    appointment: Appointment,
+    when: Optional[datetime] = None,
+    type: FollowUpType = FollowUpType.REMINDER,
+    channel: FollowUpChannel = FollowUpChannel.SMS,
+    message: str = "hello",
+) -> FollowUpTask:
+    task = FollowUpTask(
+        appointment_id=appointment.id,
+        type=type,
+        channel=channel,
+        scheduled_time=when or datetime.utcnow() - timedelta(minutes=1),
+        message=message,
+    )
+    session.add(task)
+    session.commit()
+    session.refresh(task)
+    return task
@@ -0,0 +1,60 @@
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from backend import changelog
+from backend.models import Escalation
+from backend.services.analytics_export import export_incremental
+
+from .factories import add_appointment, add_doctor, add_followup, add_patient
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def _rows(summary: dict, table: str) -> list[dict]:
+    if "path" not in summary[table]:
+        return []
+    return pq.read_table(summary[table]["path"]).to_pylist()
+
+
+def test_incremental_export_follows_late_changes(session, raw_conn, tmp_path):
+    changelog.install(raw_conn)
+    out_dir, state = str(tmp_path / "out"), str(tmp_path / "state.json")
+    old_day = date.today() - timedelta(days=30)
+    appointment = add_appointment(session, add_doctor(session), add_patient(session), day=old_day)
+    task = add_followup(session, appointment)
+
+    first = export_incremental(raw_conn, out_dir, state)
+    assert [row["id"] for row in _rows(first, "appointments")] == [appointment.id]
+    assert [row["executed"] for row in _rows(first, "followups")] == [False]
+
+    # cambios semanas después del día de la cita
+    task.executed = True
+    task.executed_at = datetime.utcnow()
+    session.add(task)
+    session.add(Escalation(appointment_id=appointment.id, notes="call back"))
+    session.commit()
+
+    second = export_incremental(raw_conn, out_dir, state)
+    assert second["appointments"]["rows"] == 0
+    assert [row["executed"] for row in _rows(second, "followups")] == [True]
+    assert [row["notes"] for row in _rows(second, "escalations")] == ["call back"]
+    assert second["followups"]["from_seq"] == first["followups"]["to_seq"]
+
+    third = export_incremental(raw_conn, out_dir, state)
+    assert all(third[table]["rows"] == 0 for table in third)
+    assert len(os.listdir(out_dir)) == 5
+
+
+def test_expired_consumer_falls_back_to_full_export(session, raw_conn, tmp_path):
+    changelog.install(raw_conn)
+    out_dir, state = str(tmp_path / "out"), str(tmp_path / "state.json")
+    add_appointment(session, add_doctor(session), add_patient(session))
+    export_incremental(raw_conn, out_dir, state)
+
+    changelog.unregister_consumer(raw_conn, "analytics_export")
+    add_appointment(session, add_doctor(session), add_patient(session))
+    summary = export_incremental(raw_conn, out_dir, state)
+    assert summary["appointments"]["rows"] == 2
+    assert summary["appointments"]["from_seq"] is None
@@ -0,0 +1,56 @@
+from datetime import date, time, timedelta
+
+import pytest
+from sqlmodel import select
+
+from backend.models import Appointment, FollowUpTask
+from backend.services.appointment_series import MAX_OCCURRENCES, occurrences
+
+from .factories import add_appointment, add_doctor, add_patient, add_preferences
+
+START = date.today() + timedelta(days=7)
+
+
+def _series(client, doctor, patient, **kw):
+    body = {"doctor_id": doctor.id, "patient_id": patient.id,
+            "start_date": START.isoformat(), "time": "10:00", **kw}
+    return client.post("/appointments/series", json=body)
+
+
+def test_occurrences():
+    assert occurrences(START, 2, count=3) == [START, START + timedelta(weeks=2), START + timedelta(weeks=4)]
+    assert occurrences(START, until=START + timedelta(days=20)) == [
+        START, START + timedelta(weeks=1), START + timedelta(weeks=2),
+    ]
+    with pytest.raises(ValueError):
+        occurrences(START)
+    with pytest.raises(ValueError):
+        occurrences(START, count=MAX_OCCURRENCES + 1)
+
+
+def test_series_is_created_with_payments_and_followups(client, session):
+    doctor, patient = add_doctor(session), add_patient(session)
+
+    response = _series(client, doctor, patient, count=4)
+    assert response.status_code == 200
+    ids = [item["id"] for item in response.json()["appointments"]]
+    assert len(ids) == 4
+
+    # finish_series corre tras la respuesta (BackgroundTasks del TestClient)
+    session.expire_all()
+    appointments = session.exec(select(Appointment).where(Appointment.id.in_(ids))).all()
+    assert all(a.payment_link for a in appointments)
+    tasks = session.exec(select(FollowUpTask).where(FollowUpTask.appointment_id.in_(ids))).all()
+    assert len(tasks) == 8
+
+
+def test_one_conflict_rejects_the_whole_series(client, session):
+    doctor, patient = add_doctor(session), add_patient(session)
+    add_preferences(session, doctor, time(8), time(18))
+    add_appointment(session, doctor, patient, day=START + timedelta(weeks=2), at=time(10, 10))
+
+    response = _series(client, doctor, patient, count=4)
+    assert response.status_code == 409
+    assert (START + timedelta(weeks=2)).isoformat() in response.json()["detail"]
+    assert _series(client, doctor, patient, count=2, time="19:00").status_code == 422
+    assert len(session.exec(select(Appointment)).all()) == 1
@@ -0,0 +1,23 @@
+from datetime import date, timedelta
+
+from backend.services.archive import archive_before
+
+from .factories import add_appointment, add_doctor, add_patient
+
+
+def test_archived_ids_are_not_reused(session, raw_conn):
+    doctor, patient = add_doctor(session), add_patient(session)
+    past = date.today() - timedelta(days=60)
+    archived = [add_appointment(session, doctor, patient, day=past).id for _ in range(3)]
+
+    assert archive_before(raw_conn, date.today())["appointment"] == 3
+    fresh = add_appointment(session, doctor, patient)
+    assert fresh.id > max(archived)
+
+    # el archivo siguiente no choca con los ids que ya están archivados
+    session.delete(fresh)
+    session.commit()
+    add_appointment(session, doctor, patient, day=past)
+    assert archive_before(raw_conn, date.today())["appointment"] == 1
+    ids = [row[0] for row in raw_conn.execute("SELECT id FROM appointment_archive ORDER BY id")]
+    assert len(ids) == len(set(ids)) == 4
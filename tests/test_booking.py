@@ -0,0 +1,89 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
+
+import pytest
+from sqlmodel import Session, func, select
+
+from backend.models import Appointment, AppointmentStatus
+from backend.services import booking_intervals
+from backend.services.booking_intervals import SlotTaken, reserve
+
+from .factories import add_appointment, add_doctor, add_patient, add_preferences
+
+DAY = date.today() + timedelta(days=2)
+
+
+def _book(client, doctor, patient, at: str, slot_minutes: int = 20):
+    return client.post("/appointments/", json={
+        "doctor_id": doctor.id, "patient_id": patient.id,
+        "date": DAY.isoformat(), "time": at, "slot_minutes": slot_minutes,
+    })
+
+
+def _count(session: Session) -> int:
+    return session.exec(select(func.count()).select_from(Appointment)).one()
+
+
+def test_overlaps_are_rejected_and_neighbours_accepted(client, session):
+    doctor, patient = add_doctor(session), add_patient(session)
+    add_appointment(session, doctor, patient, day=DAY, at=time(10))
+
+    assert _book(client, doctor, patient, "10:10").status_code == 409
+    assert _book(client, doctor, patient, "09:50", slot_minutes=15).status_code == 409
+    assert _book(client, doctor, patient, "09:40").status_code == 200  # acaba a las 10:00
+    assert _book(client, doctor, patient, "10:20").status_code == 200
+    # una cita cancelada deja libre su hueco
+    add_appointment(session, doctor, patient, day=DAY, at=time(12), status=AppointmentStatus.CANCELLED)
+    assert _book(client, doctor, patient, "12:00").status_code == 200
+
+
+def test_working_hours_and_lunch(client, session):
+    doctor, patient = add_doctor(session), add_patient(session)
+    add_preferences(session, doctor, time(9), time(17), lunch_start=time(13), lunch_end=time(14))
+
+    early = _book(client, doctor, patient, "08:50")
+    assert early.status_code == 422
+    assert early.json()["detail"] == "outside working hours (09:00-17:00)"
+    assert _book(client, doctor, patient, "16:50").status_code == 422
+    assert _book(client, doctor, patient, "12:50").json()["detail"] == "overlaps lunch break (13:00-14:00)"
+    assert _book(client, doctor, patient, "14:00").status_code == 200
+
+
+def test_write_between_check_and_insert_is_caught(session, db, monkeypatch):
+    doctor, patient = add_doctor(session), add_patient(session)
+    original = booking_intervals.intervals_for_days
+
+    def racing(*args, **kwargs):
+        indexes = original(*args, **kwargs)
+        # otro worker reserva el mismo hueco después de que lo demos por libre
+        with Session(db) as other:
+            add_appointment(other, doctor, patient, day=DAY, at=time(10, 10))
+        return indexes
+
+    monkeypatch.setattr(booking_intervals, "intervals_for_days", racing)
+    mine = Appointment(doctor_id=doctor.id, patient_id=patient.id, date=DAY,
+                       scheduled_time=time(10), current_time=time(10))
+    with pytest.raises(SlotTaken):
+        reserve(session, mine)
+    assert _count(session) == 1
+
+
+def test_concurrent_bookings_of_one_slot(session, db):
+    doctor, patient = add_doctor(session), add_patient(session)
+
+    def book(_):
+        with Session(db) as own:
+            try:
+                reserve(own, Appointment(doctor_id=doctor.id, patient_id=patient.id, date=DAY,
+                                         scheduled_time=time(11), current_time=time(11)))
+                return True
+            except SlotTaken:
+                return False
+
+    with ThreadPoolExecutor(8) as pool:
+        # cada hilo con la clínica del test (clave de la caché de índices)
+        results = list(pool.map(lambda i: contextvars.copy_context().run(book, i), range(8)))
+
+    assert results.count(True) == 1
+    assert _count(session) == 1
@@ -0,0 +1,118 @@
+import io
+import time as clock
+from datetime import date, time, timedelta
+
+import pytest
+from sqlmodel import Session, func, select
+
+from backend.models import Appointment
+from backend.services import bulk_import
+from backend.services.booking_intervals import reserve
+from backend.services.bulk_import import ImportConflict, import_records
+
+from .factories import add_appointment, add_doctor, add_patient, add_preferences
+
+DAY = date.today() + timedelta(days=3)
+
+
+def _csv(rows: list[str]) -> io.BytesIO:
+    return io.BytesIO(("doctor_id,patient_id,date,time,slot_minutes\n" + "\n".join(rows)).encode())
+
+
+def _count(session: Session) -> int:
+    return session.exec(select(func.count()).select_from(Appointment)).one()
+
+
+def test_overlapping_and_out_of_hours_rows_are_reported(session):
+    doctor = add_doctor(session)
+    add_preferences(session, doctor, time(8), time(14))
+    patient = add_patient(session)
+    add_appointment(session, doctor, patient, day=DAY, at=time(9))
+    d, p = doctor.id, patient.id
+
+    report = import_records(session, "appointments", _csv([
+        f"{d},{p},{DAY},09:10,20",  # pisa la cita existente
+        f"{d},{p},{DAY},10:00,20",
+        f"{d},{p},{DAY},10:10,20",  # pisa la fila anterior del fichero
+        f"{d},{p},{DAY},13:50,20",  # acaba después de la jornada
+    ]))
+
+    assert report["rows_inserted"] == 1
+    assert [(e["line"], e["error"]) for e in report["errors"]] == [
+        (2, "slot already booked"),
+        (4, "slot already booked"),
+        (5, "outside working hours (08:00-14:00)"),
+    ]
+    assert _count(session) == 2
+
+
+def test_failure_midway_leaves_nothing(session, monkeypatch):
+    doctor, patient = add_doctor(session), add_patient(session)
+
+    def broken_records(stream, fmt):
+        for i in range(5):
+            yield i + 2, {"doctor_id": doctor.id, "patient_id": patient.id,
+                          "date": DAY.isoformat(), "time": f"{8 + i:02d}:00"}
+        raise OSError("connection reset")
+
+    monkeypatch.setattr(bulk_import, "iter_records", broken_records)
+    with pytest.raises(OSError):
+        import_records(session, "appointments", io.BytesIO(), chunk_rows=2)
+    assert _count(session) == 0
+
+
+def test_concurrent_booking_aborts_the_import(session, db, monkeypatch):
+    doctor, patient = add_doctor(session), add_patient(session)
+
+    def records(stream, fmt):
+        yield 2, {"doctor_id": doctor.id, "patient_id": patient.id,
+                  "date": DAY.isoformat(), "time": "09:00"}
+        # otra reserva del mismo día, confirmada antes de nuestro INSERT
+        with Session(db) as other:
+            add_appointment(other, doctor, patient, day=DAY, at=time(9, 10))
+
+    monkeypatch.setattr(bulk_import, "iter_records", records)
+    with pytest.raises(ImportConflict):
+        import_records(session, "appointments", io.BytesIO())
+    assert _count(session) == 1
+
+
+def test_booking_is_not_blocked_while_the_file_is_read(session, db, monkeypatch):
+    doctor, other_doctor, patient = add_doctor(session), add_doctor(session, "Dr. B"), add_patient(session)
+    waited = []
+
+    def records(stream, fmt):
+        for i in range(6):
+            yield i + 2, {"doctor_id": doctor.id, "patient_id": patient.id,
+                          "date": DAY.isoformat(), "time": f"{8 + i:02d}:00"}
+            if i == 3:
+                # ya se han validado varios bloques: una reserva normal no
+                # tiene que esperar al final de la importación
+                started = clock.perf_counter()
+                with Session(db) as other:
+                    reserve(other, Appointment(
+                        doctor_id=other_doctor.id, patient_id=patient.id, date=DAY,
+                        scheduled_time=time(9), current_time=time(9),
+                    ))
+                waited.append(clock.perf_counter() - started)
+
+    monkeypatch.setattr(bulk_import, "iter_records", records)
+    # filas validadas a disco desde el primer bloque
+    monkeypatch.setattr(bulk_import, "SPOOL_MAX_BYTES", 1)
+    report = import_records(session, "appointments", io.BytesIO(), chunk_rows=2)
+
+    assert report["rows_inserted"] == 6
+    assert waited[0] < 1.0
+    assert _count(session) == 7
+
+
+def test_import_endpoint(client, session):
+    doctor, patient = add_doctor(session), add_patient(session)
+    body = _csv([f"{doctor.id},{patient.id},{DAY},09:00,20",
+                 f"{doctor.id},{patient.id},{DAY},09:00,20"]).getvalue()
+
+    response = client.post("/import/appointments", content=body)
+    assert response.status_code == 200
+    report = response.json()
+    assert report["rows_inserted"] == 1
+    assert report["errors"] == [{"line": 3, "error": "slot already booked"}]
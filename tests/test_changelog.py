@@ -0,0 +1,88 @@
+from datetime import date
+
+from backend import changelog
+
+from .factories import add_appointment, add_doctor, add_followup, add_patient
+from .test_pathway_kpis import _Recorder
+
+
+def _log_size(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM changelog").fetchone()[0]
+
+
+def test_filtered_consumer_advances_past_other_tables(session, raw_conn):
+    changelog.install(raw_conn)
+    seq = changelog.register_consumer(raw_conn, "kpis")
+
+    appointment = add_appointment(session, add_doctor(session), add_patient(session))
+    after_appointment = changelog.latest_seq(raw_conn)
+    add_followup(session, appointment)
+    add_followup(session, appointment)
+    end = changelog.latest_seq(raw_conn)
+
+    batch = changelog.read_batch(raw_conn, seq, tables=("appointment",))
+    assert [change.row_id for change in batch.changes] == [appointment.id]
+    assert batch.seq == end > after_appointment
+    assert not batch.more
+
+    assert changelog.ack(raw_conn, "kpis", batch.seq)
+    # nada que no haya visto el único consumidor
+    assert _log_size(raw_conn) == 0
+
+
+def test_batch_limit_stops_at_last_change(session, raw_conn):
+    changelog.install(raw_conn)
+    seq = changelog.register_consumer(raw_conn, "kpis")
+    doctor, patient = add_doctor(session), add_patient(session)
+    first = add_appointment(session, doctor, patient)
+    add_appointment(session, doctor, patient)
+
+    batch = changelog.read_batch(raw_conn, seq, tables=("appointment",), limit=1)
+    assert [change.row_id for change in batch.changes] == [first.id]
+    assert batch.seq == batch.changes[-1].seq
+    assert batch.more
+
+
+def test_idle_consumer_expires_and_stops_pinning(session, raw_conn):
+    changelog.install(raw_conn)
+    changelog.register_consumer(raw_conn, "active")
+    changelog.register_consumer(raw_conn, "idle")
+    add_appointment(session, add_doctor(session), add_patient(session))
+
+    changelog.ack(raw_conn, "active", changelog.latest_seq(raw_conn))
+    assert _log_size(raw_conn) > 0  # "idle" lo retiene
+
+    raw_conn.execute("UPDATE changelog_consumer SET last_ack = 0 WHERE name = 'idle'")
+    changelog.ack(raw_conn, "active", changelog.latest_seq(raw_conn))
+    assert _log_size(raw_conn) == 0
+    # al volver, el caducado se entera de que tiene que recargar
+    assert not changelog.ack(raw_conn, "idle", changelog.latest_seq(raw_conn))
+
+
+def test_unregister_releases_the_log(session, raw_conn):
+    changelog.install(raw_conn)
+    changelog.register_consumer(raw_conn, "gone")
+    add_appointment(session, add_doctor(session), add_patient(session))
+    assert _log_size(raw_conn) > 0
+
+    changelog.unregister_consumer(raw_conn, "gone")
+    assert _log_size(raw_conn) == 0
+
+
+def test_expired_kpi_subject_reloads_the_window(session, raw_conn, db_path):
+    changelog.install(raw_conn)
+    doctor, patient = add_doctor(session), add_patient(session)
+    kept = add_appointment(session, doctor, patient, day=date.today())
+
+    subject = _Recorder(db_path)
+    subject.poll_once()
+    add_appointment(session, doctor, patient, day=date.today())
+    raw_conn.execute("DELETE FROM changelog_consumer")
+    raw_conn.commit()
+    subject.poll_once()  # ack() rechazado: vuelve a empezar
+
+    subject.sent.clear()
+    added_while_away = add_appointment(session, doctor, patient, day=date.today())
+    subject.poll_once()
+    assert {values["id"] for values in subject.sent} >= {added_while_away.id}
+    assert kept.id in subject._last_sent
@@ -0,0 +1,55 @@
+import uuid
+from datetime import date
+
+from backend import main
+from backend.database import create_clinic, current_clinic
+
+from .factories import add_appointment, add_doctor, add_patient
+
+
+def test_etags_are_scoped_to_the_clinic(client, session, clinic):
+    doctor = add_doctor(session)
+    day = date.today()
+    add_appointment(session, doctor, add_patient(session), day=day)
+    params = {"doctor_id": doctor.id, "day": day.isoformat()}
+
+    response = client.get("/doctor/schedule", params=params)
+    etag = response.headers["ETag"]
+    assert etag.startswith(f'"{clinic}/')
+    assert "X-Clinic-Id" in response.headers["Vary"]
+
+    # otra clínica con los mismos ids y versiones no valida la caché
+    other = uuid.uuid4().hex[:12]
+    create_clinic(other)
+    token = current_clinic.set(other)
+    try:
+        from backend.database import get_engine
+        from sqlmodel import Session
+
+        with Session(get_engine(other), expire_on_commit=False) as s:
+            add_appointment(s, add_doctor(s), add_patient(s), day=day)
+    finally:
+        current_clinic.reset(token)
+    elsewhere = client.get(
+        "/doctor/schedule", params=params, headers={"X-Clinic-Id": other, "If-None-Match": etag}
+    )
+    assert elsewhere.status_code == 200
+    assert elsewhere.headers["ETag"] != etag
+
+
+def test_routing_errors_carry_cors_headers(client):
+    response = client.get(
+        "/doctors/", headers={"X-Clinic-Id": "no-such-clinic", "Origin": "https://app.example"}
+    )
+    assert response.status_code == 404
+    assert response.headers["access-control-allow-origin"] in ("*", "https://app.example")
+
+
+def test_new_clinics_get_a_scheduler(client, monkeypatch):
+    started = []
+    monkeypatch.setattr(main, "FOLLOWUP_SCHEDULER_ENABLED", True)
+    monkeypatch.setattr(main, "start_scheduler", lambda engine, clinic_id=None: started.append(clinic_id))
+
+    clinic_id = uuid.uuid4().hex[:12]
+    create_clinic(clinic_id)
+    assert started == [clinic_id]
@@ -0,0 +1,116 @@
+import os
+import time as clock
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from sqlmodel import Session
+
+from backend.models import Appointment, AppointmentStatus, ArrivalStatus, Doctor, Patient
+from backend.routes.doctor_dashboard import BOARD_COLUMNS, get_waiting_room_board
+from backend.routes.appointments import CACHE_CONTROL
+
+from .factories import add_appointment, add_doctor, add_patient
+
+
+def test_schedule_revalidates_with_etag(client, session):
+    doctor = add_doctor(session)
+    day = date.today()
+    add_appointment(session, doctor, add_patient(session), day=day)
+    params = {"doctor_id": doctor.id, "day": day.isoformat()}
+
+    first = client.get("/doctor/schedule", params=params)
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == CACHE_CONTROL
+    etag = first.headers["ETag"]
+
+    cached = client.get("/doctor/schedule", params=params, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["Cache-Control"] == CACHE_CONTROL
+
+    add_appointment(session, doctor, add_patient(session), day=day, at=time(11))
+    changed = client.get("/doctor/schedule", params=params, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_cancelled_appointments_leave_schedule_and_board(client, session):
+    doctor = add_doctor(session)
+    day = date.today()
+    add_appointment(session, doctor, add_patient(session, "Gone"), day=day, at=time(8),
+                    status=AppointmentStatus.CANCELLED)
+    kept = add_appointment(session, doctor, add_patient(session, "Kept"), day=day, at=time(9))
+
+    schedule = client.get("/doctor/schedule", params={"doctor_id": doctor.id, "day": day.isoformat()})
+    assert [row["appointment_id"] for row in schedule.json()["rows"]] == [kept.id]
+
+    board = client.get("/doctor/board", params={"day": day.isoformat()}).json()
+    [row] = board["doctors"][0]["rows"]
+    assert (row["appointment_id"], row["queue_position"]) == (kept.id, 1)
+
+
+# 100 doctores x 40 pacientes: el caso de la pantalla de una clínica grande
+BOARD_BUDGET_MS = float(os.getenv("BOARD_BUDGET_MS", "50"))
+
+
+def test_board_groups_by_doctor_in_both_formats(client, session):
+    day = date.today()
+    first, second = add_doctor(session, "Dr. A", "Cardiology"), add_doctor(session, "Dr. B")
+    done = add_appointment(session, first, add_patient(session, "Ana"), day=day, at=time(9),
+                           status=AppointmentStatus.COMPLETED, slot_minutes=20,
+                           visit_start_time=datetime.combine(day, time(9, 15)))
+    waiting = add_appointment(session, first, add_patient(session, "Bea"), day=day, at=time(9, 20),
+                              slot_minutes=20)
+    other = add_appointment(session, second, add_patient(session, "Carla"), day=day, at=time(10))
+
+    full = client.get("/doctor/board", params={"day": day.isoformat()}).json()
+    assert full["date"] == day.isoformat()
+    board_a, board_b = full["doctors"]
+    assert (board_a["doctor_name"], board_a["specialty"], board_a["current_delay_minutes"]) == (
+        "Dr. A", "Cardiology", 15)
+    assert board_a["rows"] == [
+        {"appointment_id": done.id, "patient_name": "Ana", "time": "09:00",
+         "status": AppointmentStatus.COMPLETED.value, "arrival_status": ArrivalStatus.NOT_ARRIVED.value,
+         "eta_time": "09:00", "queue_position": 1, "delay_minutes": 0},
+        {"appointment_id": waiting.id, "patient_name": "Bea", "time": "09:20",
+         "status": AppointmentStatus.SCHEDULED.value, "arrival_status": ArrivalStatus.NOT_ARRIVED.value,
+         "eta_time": "09:00", "queue_position": 1, "delay_minutes": 0},
+    ]
+    assert [row["appointment_id"] for row in board_b["rows"]] == [other.id]
+
+    compact = client.get("/doctor/board", params={"day": day.isoformat(), "compact": True}).json()
+    assert compact["columns"] == BOARD_COLUMNS
+    for full_doctor, compact_doctor in zip(full["doctors"], compact["doctors"]):
+        assert {k: v for k, v in compact_doctor.items() if k != "rows"} == {
+            k: v for k, v in full_doctor.items() if k != "rows"}
+        assert [dict(zip(compact["columns"], row)) for row in compact_doctor["rows"]] == full_doctor["rows"]
+
+
+@pytest.mark.skipif(os.getenv("SKIP_BOARD_BUDGET") == "1", reason="SKIP_BOARD_BUDGET=1")
+def test_board_stays_within_budget(db):
+    day = date.today()
+    with Session(db) as session:
+        doctors = [Doctor(name=f"Dr. {i}", specialty="General") for i in range(100)]
+        patients = [Patient(display_name=f"Patient {i}") for i in range(4000)]
+        session.add_all(doctors + patients)
+        session.commit()
+        start = datetime.combine(day, time(8))
+        for d, doctor in enumerate(doctors):
+            for j in range(40):
+                at = start + timedelta(minutes=12 * j)
+                session.add(Appointment(
+                    doctor_id=doctor.id, patient_id=patients[d * 40 + j].id, date=day,
+                    scheduled_time=at.time(), current_time=at.time(),
+                    status=AppointmentStatus.COMPLETED if j < 10 else AppointmentStatus.SCHEDULED,
+                    arrival_status=ArrivalStatus.NOT_ARRIVED, slot_minutes=12,
+                    visit_start_time=at + timedelta(minutes=5) if j < 10 else None,
+                ))
+        session.commit()
+
+    for compact in (False, True):
+        best = float("inf")
+        for _ in range(10):
+            with Session(db) as session:
+                started = clock.perf_counter()
+                get_waiting_room_board(day, compact, session)
+                best = min(best, (clock.perf_counter() - started) * 1000)
+        assert best <= BOARD_BUDGET_MS, (compact, best)
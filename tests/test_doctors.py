@@ -0,0 +1,26 @@
+from .factories import add_doctor
+
+
+def test_list_keeps_plain_list_by_default(client, session):
+    first = add_doctor(session, "Dr. A", "Cardiology")
+    second = add_doctor(session, "Dr. B", "General")
+
+    response = client.get("/doctors/")
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": first.id, "name": "Dr. A", "specialty": "Cardiology"},
+        {"id": second.id, "name": "Dr. B", "specialty": "General"},
+    ]
+    assert client.get("/doctors/", params={"fields": "name"}).json() == [
+        {"name": "Dr. A"}, {"name": "Dr. B"},
+    ]
+
+
+def test_pagination_is_opt_in(client, session):
+    ids = [add_doctor(session, f"Dr. {i}").id for i in range(3)]
+
+    page = client.get("/doctors/", params={"limit": 2}).json()
+    assert [item["id"] for item in page["items"]] == ids[:2]
+    rest = client.get("/doctors/", params={"cursor": page["next_cursor"], "limit": 2}).json()
+    assert [item["id"] for item in rest["items"]] == ids[2:]
+    assert rest["next_cursor"] is None
@@ -0,0 +1,73 @@
+import threading
+from datetime import datetime, timedelta
+
+from backend.services import followup_leases
+from backend.services.followup_leases import RETRY_DELAY, claim_due, complete, run_due
+from backend.services.followup_scheduler import FollowUpScheduler
+
+from .factories import add_appointment, add_doctor, add_followup, add_patient
+
+
+def _broken_send(*args, **kwargs):
+    raise ConnectionError("provider down")
+
+
+def _run_with_timeout(fn, timeout: float = 5.0):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "run_due did not return"
+    return result[0]
+
+
+def test_leases_keep_other_workers_out_until_they_expire(session, raw_conn):
+    task = add_followup(session, add_appointment(session, add_doctor(session), add_patient(session)))
+    now = datetime.utcnow()
+
+    assert [t.id for t in claim_due(raw_conn, "w1", now=now)] == [task.id]
+    assert claim_due(raw_conn, "w2", now=now) == []
+    # w1 muere sin completarla: al caducar su lease la coge w2
+    later = now + followup_leases.DEFAULT_LEASE + timedelta(seconds=1)
+    assert [t.id for t in claim_due(raw_conn, "w2", now=later)] == [task.id]
+    assert not complete(raw_conn, "w1", task.id)
+    assert complete(raw_conn, "w2", task.id)
+
+
+def test_failed_send_backs_off_instead_of_looping(session, raw_conn, monkeypatch):
+    monkeypatch.setattr(followup_leases, "send_followup", _broken_send)
+    appointment = add_appointment(session, add_doctor(session), add_patient(session))
+    tasks = [add_followup(session, appointment) for _ in range(3)]
+
+    assert _run_with_timeout(lambda: run_due(raw_conn, "w1", batch=2)) == 0
+    for task in tasks:
+        session.refresh(task)
+        assert not task.executed and task.claimed_by is None
+        assert task.lease_until > datetime.utcnow() + RETRY_DELAY - timedelta(seconds=5)
+    # mientras no pase la espera nadie la reintenta
+    assert claim_due(raw_conn, "w2") == []
+
+
+def test_round_stops_when_failed_tasks_come_back_at_once(session, raw_conn, monkeypatch):
+    monkeypatch.setattr(followup_leases, "send_followup", _broken_send)
+    real_release = followup_leases.release
+    monkeypatch.setattr(
+        followup_leases, "release",
+        lambda conn, worker, task_id: real_release(conn, worker, task_id, retry_after=timedelta(seconds=-1)),
+    )
+    add_followup(session, add_appointment(session, add_doctor(session), add_patient(session)))
+
+    assert _run_with_timeout(lambda: run_due(raw_conn, "w1", batch=1)) == 0
+
+
+def test_scheduler_retries_a_failed_send(db, session, monkeypatch):
+    monkeypatch.setattr(followup_leases, "send_followup", _broken_send)
+    task = add_followup(session, add_appointment(session, add_doctor(session), add_patient(session)))
+
+    scheduler = FollowUpScheduler(db)
+    scheduler._horizon = datetime.utcnow() + timedelta(days=1)
+    assert not scheduler._execute(task.id)
+
+    [(when, task_id)] = scheduler._heap
+    assert task_id == task.id
+    assert when > datetime.utcnow() + RETRY_DELAY - timedelta(seconds=5)
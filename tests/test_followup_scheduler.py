@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+
+from backend.services import followup_leases
+from backend.services.followup_scheduler import FollowUpScheduler
+
+from .factories import add_appointment, add_doctor, add_followup, add_patient
+
+
+def _wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_sends_due_task(db, session, monkeypatch):
+    sent = []
+    monkeypatch.setattr(followup_leases, "send_followup", lambda *a, **kw: sent.append(a) or True)
+    appointment = add_appointment(session, add_doctor(session), add_patient(session))
+    task = add_followup(session, appointment)
+
+    scheduler = FollowUpScheduler(db)
+    scheduler.start()
+    try:
+        assert _wait_for(lambda: sent)
+    finally:
+        scheduler.stop()
+    session.refresh(task)
+    assert task.executed
+    assert len(sent) == 1
+
+
+def test_window_load_failure_is_retried(db, session, monkeypatch):
+    sent = []
+    monkeypatch.setattr(followup_leases, "send_followup", lambda *a, **kw: sent.append(a) or True)
+    appointment = add_appointment(session, add_doctor(session), add_patient(session))
+    add_followup(session, appointment)
+
+    scheduler = FollowUpScheduler(db, retry_delay=timedelta(milliseconds=20))
+    real_load = scheduler._load_window
+    failures = []
+
+    def flaky_load():
+        if len(failures) < 2:
+            failures.append(1)
+            raise RuntimeError("database is locked")
+        real_load()
+
+    monkeypatch.setattr(scheduler, "_load_window", flaky_load)
+    scheduler.start()
+    try:
+        # el hilo sobrevive a los fallos y acaba enviando
+        assert _wait_for(lambda: sent)
+        assert scheduler._thread.is_alive()
+    finally:
+        scheduler.stop()
+    assert len(failures) == 2
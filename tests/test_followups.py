@@ -0,0 +1,82 @@
+from datetime import date, time, timedelta
+
+from sqlalchemy import event
+from sqlmodel import select
+
+from backend.models import AppointmentStatus, FollowUpTask, FollowUpType
+
+from .factories import add_appointment, add_doctor, add_followup, add_patient
+
+DAY = date.today() + timedelta(days=1)
+
+
+def _schedule_day(client, **params):
+    response = client.post("/followups/schedule_day", params={"day": DAY.isoformat(), **params})
+    assert response.status_code == 200
+    return response.json()
+
+
+def _tasks(session) -> list[tuple[int, FollowUpType]]:
+    session.expire_all()
+    return sorted((t.appointment_id, t.type) for t in session.exec(select(FollowUpTask)))
+
+
+def test_schedule_day_is_idempotent_and_skips_scheduled_appointments(client, session):
+    doctor = add_doctor(session)
+    first = add_appointment(session, doctor, add_patient(session), day=DAY, at=time(9))
+    second = add_appointment(session, doctor, add_patient(session), day=DAY, at=time(10))
+    # ya tiene su follow-up: se queda como está
+    done = add_appointment(session, doctor, add_patient(session), day=DAY, at=time(11))
+    add_followup(session, done)
+    add_appointment(session, doctor, add_patient(session), day=DAY, at=time(12),
+                    status=AppointmentStatus.CANCELLED)
+
+    result = _schedule_day(client, doctor_id=doctor.id)
+    assert (result["appointments"], result["tasks_created"]) == (2, 4)
+    expected = sorted(
+        [(a.id, t) for a in (first, second) for t in (FollowUpType.REMINDER, FollowUpType.CHECKIN)]
+        + [(done.id, FollowUpType.REMINDER)]
+    )
+    assert _tasks(session) == expected
+
+    again = _schedule_day(client, doctor_id=doctor.id)
+    assert (again["appointments"], again["tasks_created"]) == (0, 0)
+    assert _tasks(session) == expected
+
+
+def test_schedule_day_for_whole_clinic(client, session):
+    doctors = [add_doctor(session, "Dr. A"), add_doctor(session, "Dr. B")]
+    appointments = [add_appointment(session, d, add_patient(session), day=DAY) for d in doctors]
+    # otro día: fuera
+    add_appointment(session, doctors[0], add_patient(session), day=DAY + timedelta(days=1))
+
+    result = _schedule_day(client)
+    assert (result["doctor_id"], result["appointments"], result["tasks_created"]) == (None, 2, 4)
+    assert {appointment_id for appointment_id, _ in _tasks(session)} == {a.id for a in appointments}
+
+
+def test_schedule_day_inserts_in_one_statement_and_transaction(client, session, db):
+    doctor = add_doctor(session)
+    for hour in range(9, 14):
+        add_appointment(session, doctor, add_patient(session), day=DAY, at=time(hour))
+
+    inserts, commits = [], []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("INSERT INTO FOLLOWUPTASK"):
+            inserts.append((executemany, len(parameters)))
+
+    def on_commit(conn):
+        commits.append(conn)
+
+    event.listen(db, "before_cursor_execute", before_cursor_execute)
+    event.listen(db, "commit", on_commit)
+    try:
+        result = _schedule_day(client, doctor_id=doctor.id)
+    finally:
+        event.remove(db, "before_cursor_execute", before_cursor_execute)
+        event.remove(db, "commit", on_commit)
+
+    assert result["tasks_created"] == 10
+    assert inserts == [(True, 10)]
+    assert len(commits) == 1
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from backend.models import FollowUpType
+from backend.services.llm_client import (
+    CachedGenerator,
+    LocalModel,
+    MessageGenerator,
+    MessageRequest,
+    TemplateGenerator,
+    generate_messages_async,
+    load_generator,
+    message_generator,
+    set_message_generator,
+)
+
+
+def test_generators_must_implement_generate_many():
+    class Incomplete(MessageGenerator):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_cache_generates_each_distinct_request_once():
+    model = LocalModel(call_latency=0, message_latency=0)
+    generator = CachedGenerator(model)
+    reminder, checkin = MessageRequest(FollowUpType.REMINDER), MessageRequest(FollowUpType.CHECKIN)
+
+    first = generator.generate_many([reminder, checkin, reminder])
+    assert first[0] == first[2]
+    assert (model.calls, model.generated) == (1, 2)
+
+    assert generator.generate_many([checkin, reminder]) == [first[1], first[0]]
+    assert model.calls == 1
+    assert generator.hit_rate() == 3 / 5
+
+
+def test_async_path_shares_the_cache():
+    previous = message_generator().generator
+    model = LocalModel(call_latency=0, message_latency=0)
+    generator = set_message_generator(model)
+    reminder, checkin = MessageRequest(FollowUpType.REMINDER), MessageRequest(FollowUpType.CHECKIN)
+    try:
+        [message] = generator.generate_many([reminder])
+        assert asyncio.run(generate_messages_async([reminder, checkin, reminder]))[::2] == [message, message]
+        assert (model.calls, model.generated) == (2, 2)
+
+        # todo en caché: ni hilo ni llamada al modelo
+        assert asyncio.run(generator.agenerate_many([checkin, reminder]))[1] == message
+        assert model.calls == 2
+        assert generator.hit_rate() == 4 / 6
+    finally:
+        set_message_generator(previous)
+
+
+def test_default_agenerate_many_runs_generate_many():
+    assert asyncio.run(TemplateGenerator().agenerate_many([MessageRequest(FollowUpType.REMINDER)])) == (
+        TemplateGenerator().generate_many([MessageRequest(FollowUpType.REMINDER)]))
+
+
+def test_load_generator():
+    assert isinstance(load_generator("templates"), TemplateGenerator)
+    assert isinstance(load_generator("backend.services.llm_client:LocalModel"), LocalModel)
+    with pytest.raises(ValueError):
+        load_generator("nope")
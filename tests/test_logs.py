@@ -0,0 +1,130 @@
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+
+from backend import logs
+from backend.logs import JsonFormatter, _NonBlockingQueueHandler, log_context, log_event
+
+
+def _capture(monkeypatch, name: str, maxsize: int = 0):
+    """
+    Logger con su propia cola y sin hilo escritor: los registros se quedan
+    en la cola para mirarlos. Al acabar el test el logger vuelve a como estaba.
+    """
+    log_queue: queue.Queue = queue.Queue(maxsize=maxsize)
+    handler = _NonBlockingQueueHandler(log_queue)
+    logger = logging.getLogger(name)
+    monkeypatch.setattr(logger, "level", logging.DEBUG)
+    monkeypatch.setattr(logger, "propagate", False)
+    monkeypatch.setattr(logger, "handlers", [handler])
+    return logger, handler, log_queue
+
+
+def _lines(log_queue: queue.Queue) -> list[dict]:
+    formatter = JsonFormatter()
+    lines = []
+    while not log_queue.empty():
+        lines.append(json.loads(formatter.format(log_queue.get_nowait())))
+    return lines
+
+
+def test_json_line_carries_context_ids(clinic, monkeypatch):
+    logger, _, log_queue = _capture(monkeypatch, "tests.logs.shape")
+
+    with log_context(task_id=7):
+        log_event(logger, "followup.executed", channel="sms")
+    log_event(logger, "followup.failed", level=logging.ERROR, attempt=2)
+
+    first, second = _lines(log_queue)
+    assert set(first) == {"ts", "level", "logger", "event", "clinic", "task_id", "channel"}
+    assert (first["level"], first["logger"], first["event"]) == ("info", "tests.logs.shape", "followup.executed")
+    assert (first["clinic"], first["task_id"], first["channel"]) == (clinic, 7, "sms")
+    # el contexto sólo dura el bloque
+    assert "task_id" not in second
+    assert (second["level"], second["attempt"]) == ("error", 2)
+
+
+def test_request_id_is_echoed_and_logged(client, monkeypatch):
+    monkeypatch.setattr(logs, "LOG_SAMPLE_RATE", 1.0)
+    _, _, log_queue = _capture(monkeypatch, "backend.requests")
+
+    response = client.get("/doctors/", headers={"X-Request-Id": "req-123"})
+    assert response.headers["X-Request-Id"] == "req-123"
+    generated = client.get("/doctors/").headers["X-Request-Id"]
+
+    done = [line for line in _lines(log_queue) if line["event"] == "request.done"]
+    assert [line["request_id"] for line in done] == ["req-123", generated]
+    assert (done[0]["path"], done[0]["status"], done[0]["sample_rate"]) == ("/doctors/", 200, 1.0)
+
+
+def test_sampling_drops_info_but_never_warnings(monkeypatch):
+    logger, _, log_queue = _capture(monkeypatch, "tests.logs.sampling")
+
+    monkeypatch.setattr(logs, "LOG_SAMPLE_RATE", 0.0)
+    log_event(logger, "noisy", sampled=True)
+    log_event(logger, "slow", level=logging.WARNING, sampled=True)
+    log_event(logger, "always")
+    assert [line["event"] for line in _lines(log_queue)] == ["slow", "always"]
+
+    monkeypatch.setattr(logs, "LOG_SAMPLE_RATE", 0.25)
+    monkeypatch.setattr(logs.random, "random", lambda: 0.1)
+    log_event(logger, "noisy", sampled=True)
+    [line] = _lines(log_queue)
+    assert line["sample_rate"] == 0.25
+
+
+def test_full_queue_drops_instead_of_blocking(monkeypatch):
+    logger, handler, log_queue = _capture(monkeypatch, "tests.logs.full", maxsize=1)
+
+    started = time.perf_counter()
+    for i in range(100):
+        log_event(logger, "burst", i=i)
+    assert time.perf_counter() - started < 1.0
+    assert handler.dropped == 99
+    assert [line["i"] for line in _lines(log_queue)] == [0]
+
+    # el siguiente que entra cuenta los perdidos
+    log_event(logger, "after")
+    [line] = _lines(log_queue)
+    assert (line["event"], line["dropped_before"]) == ("after", 99)
+    assert handler.dropped == 0
+
+
+def test_dropped_count_is_exact_across_threads():
+    log_queue: queue.Queue = queue.Queue(maxsize=8)
+    handler = _NonBlockingQueueHandler(log_queue)
+    threads, per_thread = 8, 500
+    received, done = [], threading.Event()
+
+    def drain():
+        while not (done.is_set() and log_queue.empty()):
+            try:
+                received.append(log_queue.get(timeout=0.01))
+            except queue.Empty:
+                pass
+
+    def burst():
+        for i in range(per_thread):
+            handler.enqueue(logging.LogRecord("tests", logging.INFO, __file__, 0, "x", None, None))
+
+    # cambios de hilo muy frecuentes: sin lock se pierden incrementos
+    previous = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        reader = threading.Thread(target=drain)
+        reader.start()
+        writers = [threading.Thread(target=burst) for _ in range(threads)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        done.set()
+        reader.join()
+    finally:
+        sys.setswitchinterval(previous)
+
+    dropped = sum(getattr(record, "fields", {}).get("dropped_before", 0) for record in received)
+    assert len(received) + dropped + handler.dropped == threads * per_thread
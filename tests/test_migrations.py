@@ -0,0 +1,95 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from backend import changelog, migrations, startup_budget
+
+
+@pytest.fixture
+def fresh_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    yield engine
+    engine.dispose()
+
+
+def _columns(engine, table: str) -> set[str]:
+    with engine.connect() as conn:
+        return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def test_upgrade_from_empty_reaches_head_once(fresh_engine):
+    assert [v for v, _ in migrations.pending(fresh_engine)] == [v for v, _, _ in migrations.MIGRATIONS]
+
+    assert migrations.upgrade(fresh_engine) == [v for v, _, _ in migrations.MIGRATIONS]
+    assert migrations.pending(fresh_engine) == []
+    with fresh_engine.connect() as conn:
+        assert migrations.current_version(conn) == migrations.HEAD
+
+    assert migrations.upgrade(fresh_engine) == []
+
+
+def test_upgrade_adds_lease_columns_to_an_old_schema(fresh_engine):
+    migrations.upgrade(fresh_engine)
+    with fresh_engine.connect() as conn:
+        for table in ("followuptask", "followuptask_archive"):
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN claimed_by"))
+            conn.execute(text(f"ALTER TABLE {table} DROP COLUMN lease_until"))
+        conn.execute(text("PRAGMA user_version = 5"))
+        conn.commit()
+
+    assert 6 in migrations.upgrade(fresh_engine)
+    for table in ("followuptask", "followuptask_archive"):
+        assert {"claimed_by", "lease_until"} <= _columns(fresh_engine, table)
+
+
+def test_upgrade_rebuilds_live_tables_with_autoincrement(fresh_engine):
+    migrations.upgrade(fresh_engine)
+    raw = fresh_engine.raw_connection()
+    try:
+        changelog.install(raw)
+    finally:
+        raw.close()
+    with fresh_engine.connect() as conn:
+        # esquema de antes de la versión 7: INTEGER PRIMARY KEY a secas
+        ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'appointment'").scalar()
+        triggers = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = 'appointment'"
+        ).scalars().all()
+        conn.exec_driver_sql("DROP TABLE appointment")
+        conn.exec_driver_sql(ddl.replace(" AUTOINCREMENT", ""))
+        for sql in triggers:
+            conn.exec_driver_sql(sql)
+        conn.exec_driver_sql("DELETE FROM sqlite_sequence")
+        conn.exec_driver_sql(
+            "INSERT INTO appointment_archive (id, doctor_id, patient_id, date, scheduled_time,"
+            " current_time, status, arrival_status, slot_minutes)"
+            " VALUES (41, 1, 1, '2020-01-01', '10:00:00', '10:00:00', 'COMPLETED', 'ARRIVED', 20)"
+        )
+        conn.exec_driver_sql("PRAGMA user_version = 6")
+        conn.commit()
+
+    assert 7 in migrations.upgrade(fresh_engine)
+    with fresh_engine.connect() as conn:
+        ddl = conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'appointment'").scalar()
+        assert "AUTOINCREMENT" in ddl
+        assert sorted(triggers) == sorted(conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = 'appointment'"
+        ).scalars().all())
+        conn.exec_driver_sql(
+            "INSERT INTO appointment (doctor_id, patient_id, date, scheduled_time, current_time,"
+            " status, arrival_status, slot_minutes)"
+            " VALUES (1, 1, '2030-01-01', '10:00:00', '10:00:00', 'SCHEDULED', 'NOT_ARRIVED', 20)"
+        )
+        assert conn.exec_driver_sql("SELECT max(id) FROM appointment").scalar() == 42
+        assert conn.exec_driver_sql(
+            "SELECT row_id FROM changelog WHERE tbl = 'appointment'"
+        ).scalars().all() == [42]
+
+
+@pytest.mark.skipif(os.getenv("SKIP_STARTUP_BUDGET") == "1", reason="SKIP_STARTUP_BUDGET=1")
+def test_fast_start_stays_within_budget():
+    result = startup_budget.measure(runs=3)
+
+    assert result["import_ms"] <= startup_budget.IMPORT_BUDGET_MS, result
+    assert result["first_request_ms"] <= startup_budget.FIRST_REQUEST_BUDGET_MS, result
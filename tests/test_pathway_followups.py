@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import changelog
+from backend.database import sqlite_timestamp
+from backend.pathway_followups import FollowUpObserver, FollowUpSubject
+from backend.services import followup_leases
+
+from .factories import add_appointment, add_doctor, add_followup, add_patient
+
+
+def test_observer_sends_once_without_local_state(session, db_path, clinic, monkeypatch):
+    keys = []
+    monkeypatch.setattr(
+        followup_leases, "send_followup", lambda *a, idempotency_key=None: keys.append(idempotency_key) or True
+    )
+    appointment = add_appointment(session, add_doctor(session), add_patient(session))
+    task = add_followup(session, appointment)
+    row = {"id": task.id, "channel": "SMS"}
+
+    observer = FollowUpObserver(db_path, scope=clinic)
+    observer.on_change(None, row, 1, True)
+    # la misma tarea otra vez (p.ej. tras reiniciar): ya está ejecutada
+    FollowUpObserver(db_path, scope=clinic).on_change(None, row, 2, True)
+
+    session.refresh(task)
+    assert task.executed
+    assert keys == [followup_leases.idempotency_key(task.id, clinic)]
+
+
+class _Recorder(FollowUpSubject):
+    """
+    El subject sin Pathway: guarda los ids que emitiría.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        super().__init__(db_path)
+        self.sent: list = []
+
+    def next(self, **values):
+        self.sent.append(values["id"])
+
+    def commit(self):
+        pass
+
+
+@pytest.mark.parametrize("with_changelog", [False, True])
+def test_failed_send_is_emitted_again_when_its_lease_expires(
+    session, raw_conn, db_path, clinic, monkeypatch, with_changelog
+):
+    if with_changelog:
+        changelog.install(raw_conn)
+    task = add_followup(session, add_appointment(session, add_doctor(session), add_patient(session)))
+    subject, observer = _Recorder(db_path), FollowUpObserver(db_path, scope=clinic)
+    row = {"id": task.id, "channel": "SMS"}
+
+    subject.poll_once()
+    assert subject.sent == [task.id]
+
+    def down(*args, **kwargs):
+        raise ConnectionError("provider down")
+
+    monkeypatch.setattr(followup_leases, "send_followup", down)
+    observer.on_change(None, row, 1, True)
+    session.refresh(task)
+    assert not task.executed and task.lease_until is not None
+
+    # mientras dura la espera de reintento no se emite
+    subject.poll_once()
+    assert subject.sent == [task.id]
+
+    subject.poll_once(now=task.lease_until + timedelta(seconds=1))
+    assert subject.sent == [task.id, task.id]
+
+    # y al volver a llegar al observer (ya sin lease) se envía
+    raw_conn.execute("UPDATE followuptask SET lease_until = ? WHERE id = ?",
+                     (sqlite_timestamp(datetime.utcnow() - timedelta(seconds=1)), task.id))
+    raw_conn.commit()
+    monkeypatch.setattr(followup_leases, "send_followup", lambda *a, **kw: True)
+    observer.on_change(None, row, 2, True)
+    session.refresh(task)
+    assert task.executed
@@ -0,0 +1,178 @@
+from datetime import date, datetime, time, timedelta
+
+import pathway as pw
+from pathway.internals.parse_graph import G
+
+from backend import changelog, pathway_kpis
+from backend.models import Appointment, AppointmentStatus, ArrivalStatus
+from backend.pathway_kpis import AppointmentChangesSubject, KPIObserver
+
+from .factories import add_appointment, add_doctor, add_patient
+
+
+class _Recorder(AppointmentChangesSubject):
+    """
+    El subject sin Pathway: guarda lo que enviaría en vez de enviarlo.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        super().__init__(db_path)
+        self.sent: list = []
+        self.deleted: list = []
+
+    def next(self, **values):
+        self.sent.append(values)
+
+    def delete(self, **values):
+        self.deleted.append(values)
+
+    def commit(self):
+        pass
+
+
+def _retracted_ids(subject: _Recorder) -> set:
+    return {values["id"] for values in subject.deleted}
+
+
+def test_full_read_retracts_deleted_and_out_of_window(session, db_path):
+    doctor = add_doctor(session)
+    patient = add_patient(session)
+    kept = add_appointment(session, doctor, patient, day=date.today())
+    deleted = add_appointment(session, doctor, patient, day=date.today(), at=time(11))
+    moved = add_appointment(session, doctor, patient, day=date.today(), at=time(12))
+
+    subject = _Recorder(db_path)
+    subject.poll_once()
+    assert {values["id"] for values in subject.sent} == {kept.id, deleted.id, moved.id}
+
+    session.delete(deleted)
+    moved.date = date.today() - timedelta(days=400)
+    session.add(moved)
+    session.commit()
+
+    subject.sent.clear()
+    subject.poll_once()
+    assert subject.sent == []
+    assert _retracted_ids(subject) == {deleted.id, moved.id}
+    assert set(subject._last_sent) == {kept.id}
+
+
+def test_changelog_read_retracts_deleted(session, db_path, raw_conn):
+    changelog.install(raw_conn)
+    doctor = add_doctor(session)
+    patient = add_patient(session)
+    kept = add_appointment(session, doctor, patient, day=date.today())
+    deleted = add_appointment(session, doctor, patient, day=date.today(), at=time(11))
+
+    subject = _Recorder(db_path)
+    subject.poll_once()
+    assert set(subject._last_sent) == {kept.id, deleted.id}
+
+    session.delete(deleted)
+    session.commit()
+    subject.poll_once()
+    assert _retracted_ids(subject) == {deleted.id}
+    assert set(subject._last_sent) == {kept.id}
+
+
+def test_no_show_counts_only_absent_patients(session, db_path):
+    doctor = add_doctor(session)
+    patient = add_patient(session)
+    absent = add_appointment(session, doctor, patient, day=date.today())
+    absent.status = AppointmentStatus.SKIPPED
+    absent.arrival_status = ArrivalStatus.SKIPPED
+    present = add_appointment(session, doctor, patient, day=date.today(), at=time(11))
+    present.status = AppointmentStatus.SKIPPED
+    present.arrival_status = ArrivalStatus.ARRIVED
+    session.add_all([absent, present])
+    session.commit()
+
+    subject = _Recorder(db_path)
+    subject.poll_once()
+    no_show = {values["id"]: values["no_show"] for values in subject.sent}
+    assert no_show == {absent.id: 1, present.id: 0}
+
+
+def test_skip_keeps_arrived_patient(client, session):
+    doctor = add_doctor(session)
+    patient = add_patient(session)
+    appointment = add_appointment(session, doctor, patient, day=date.today())
+    appointment.arrival_status = ArrivalStatus.ARRIVED
+    appointment.patient_arrival_time = datetime.utcnow()
+    session.add(appointment)
+    session.commit()
+
+    response = client.post("/doctor/skip", json={"appointment_id": appointment.id})
+    assert response.status_code == 200
+
+    session.expire_all()
+    skipped = session.get(Appointment, appointment.id)
+    assert skipped.status == AppointmentStatus.SKIPPED
+    assert skipped.arrival_status == ArrivalStatus.ARRIVED
+
+
+def _kpi_row(doctor_id: int, day: str, total: int, no_shows: int = 0) -> dict:
+    return dict(
+        doctor_id=doctor_id,
+        day=day,
+        total=total,
+        queue_length=total,
+        no_shows=no_shows,
+        wait_sum=0.0,
+        wait_count=0,
+        current_delay=0,
+    )
+
+
+def test_observer_removes_groups_left_without_appointments(session, raw_conn, db_path):
+    doctor = add_doctor(session)
+    today = date.today().isoformat()
+    observer = KPIObserver(db_path)
+
+    observer.on_change(None, _kpi_row(doctor.id, today, 4, no_shows=1), 1, True)
+    observer.on_time_end(1)
+    row = raw_conn.execute(
+        "SELECT total_appointments, no_show_rate FROM doctorkpi WHERE doctor_id = ?", (doctor.id,)
+    ).fetchone()
+    assert tuple(row) == (4, 0.25)
+
+    # una actualización (retracción + adición en el mismo instante) se queda
+    observer.on_change(None, _kpi_row(doctor.id, today, 4, no_shows=1), 2, False)
+    observer.on_change(None, _kpi_row(doctor.id, today, 3), 2, True)
+    observer.on_time_end(2)
+    assert raw_conn.execute("SELECT COUNT(*) FROM doctorkpi").fetchone()[0] == 1
+
+    # retracción sola: el grupo se quedó sin citas
+    observer.on_change(None, _kpi_row(doctor.id, today, 3), 3, False)
+    observer.on_time_end(3)
+    observer.on_end()
+    assert raw_conn.execute("SELECT COUNT(*) FROM doctorkpi").fetchone()[0] == 0
+
+
+class _OneRound(AppointmentChangesSubject):
+    """
+    Una sola ronda y fin del stream, para que pw.run() termine.
+    """
+
+    def run(self) -> None:
+        self.poll_once()
+
+
+def test_pipeline_writes_kpis_to_each_clinic_shard(client, session, clinic, monkeypatch):
+    doctor = add_doctor(session)
+    patient = add_patient(session)
+    add_appointment(session, doctor, patient, day=date.today())
+    add_appointment(session, doctor, patient, day=date.today(), at=time(11))
+    monkeypatch.setattr(pathway_kpis, "AppointmentChangesSubject", _OneRound)
+
+    G.clear()
+    try:
+        pathway_kpis.build_pipeline(clinics=[clinic])
+        pw.run(monitoring_level=pw.MonitoringLevel.NONE)
+    finally:
+        G.clear()
+
+    response = client.get("/doctor/kpis", params={"day": date.today().isoformat()})
+    assert response.status_code == 200
+    [kpi] = response.json()
+    assert (kpi["doctor_id"], kpi["total_appointments"], kpi["queue_length"]) == (doctor.id, 2, 2)
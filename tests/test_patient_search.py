@@ -0,0 +1,63 @@
+from backend.models import Patient
+from backend.patient_search import search_patients
+
+
+def _add(session, names: list[str]) -> None:
+    session.add_all([Patient(display_name=name) for name in names])
+    session.commit()
+
+
+def _names(matches) -> list[str]:
+    return [m.display_name for m in matches]
+
+
+def test_best_match_wins_regardless_of_insert_order(session, raw_conn):
+    # cientos de coincidencias peores antes de la mejor
+    _add(session, ["Mariana Lopez"] * 300 + ["Ana Zed"])
+
+    assert _names(search_patients(raw_conn, "ana", limit=1)) == ["Ana Zed", "Mariana Lopez"]
+
+
+def test_pages_are_disjoint_and_follow_one_order(session, raw_conn):
+    _add(session, [f"{first} {last}" for first in ("Ana", "Juana", "Mariana", "Anabel")
+                   for last in ("Ruiz", "Gil", "Sanz", "Vega", "Cano")])
+    _add(session, ["Anna Ruiz", "Anya Gil"])  # sólo aproximadas
+
+    everything = search_patients(raw_conn, "ana", limit=100)
+    pages = []
+    for offset in range(0, len(everything), 7):
+        pages.extend(search_patients(raw_conn, "ana", limit=7, offset=offset)[:7])
+
+    assert [m.id for m in pages] == [m.id for m in everything]
+    assert len({m.id for m in pages}) == len(pages) == 20
+    scores = [m.score for m in pages]
+    assert scores == sorted(scores)
+    assert scores[0] == 0.0 and scores[-1] == 1.0
+
+
+def test_fuzzy_matches_follow_exact_ones_across_pages(session, raw_conn):
+    _add(session, ["Gonzalo Perez", "Gonzalez Ruiz", "Gonzales Vega"])
+
+    exact = search_patients(raw_conn, "gonzalez", limit=1)
+    assert _names(exact) == ["Gonzalez Ruiz", "Gonzales Vega"]
+    # una errata antes que dos
+    assert _names(search_patients(raw_conn, "gonzalez", limit=1, offset=1)) == [
+        "Gonzales Vega", "Gonzalo Perez",
+    ]
+    assert _names(search_patients(raw_conn, "gonzalez", limit=1, offset=2)) == ["Gonzalo Perez"]
+
+
+def test_short_words_fall_back_to_a_scan(session, raw_conn):
+    _add(session, ["Li Wu", "Wu Li", "Lia Wunder", "Bo Li"])
+
+    assert _names(search_patients(raw_conn, "li wu")) == ["Li Wu", "Wu Li", "Lia Wunder"]
+
+
+def test_search_endpoint(client, session):
+    _add(session, ["Li Wu", "Bo Li"])
+
+    response = client.get("/patients/search", params={"q": "li wu"})
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["display_name"] for item in body["items"]] == ["Li Wu"]
+    assert body["next_offset"] is None
@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import event
+
+from backend.models import ActionItem, Escalation
+from backend.services.archive import archive_before
+
+from .factories import add_appointment, add_doctor, add_followup, add_patient
+
+
+def _add_extras(session, appointment, n: int = 1) -> None:
+    for i in range(n):
+        session.add(ActionItem(appointment_id=appointment.id, title=f"Task {i}", description="Blood test"))
+        session.add(Escalation(appointment_id=appointment.id, notes=f"reply {i}"))
+        session.add(Escalation(appointment_id=appointment.id, status="resolved"))
+    session.commit()
+    for i in range(n):
+        add_followup(session, appointment, when=datetime.utcnow() + timedelta(hours=i + 1))
+
+
+@contextmanager
+def _count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_visit_of_live_appointment(client, session):
+    doctor = add_doctor(session, "Dr. Visit")
+    patient = add_patient(session)
+    appointment = add_appointment(session, doctor, patient, day=date.today(), at=time(9, 30),
+                                  payment_link="https://pay.example/1")
+    _add_extras(session, appointment)
+
+    response = client.get(f"/patients/{patient.id}/visit/{appointment.id}")
+    assert response.status_code == 200
+    visit = response.json()
+    assert visit["appointment"] == {
+        "id": appointment.id,
+        "doctor_id": doctor.id,
+        "doctor_name": "Dr. Visit",
+        "date": date.today().isoformat(),
+        "scheduled_time": "09:30",
+        "current_time": "09:30",
+        "slot_minutes": 20,
+        "status": "scheduled",
+        "arrival_status": "not_arrived",
+        "archived": False,
+    }
+    assert visit["eta"]["queue_position"] == 1
+    assert visit["payment_link"] == "https://pay.example/1"
+    assert [item["title"] for item in visit["action_items"]] == ["Task 0"]
+    assert [task["type"] for task in visit["pending_followups"]] == ["reminder"]
+    # los resueltos no salen
+    assert [esc["notes"] for esc in visit["open_escalations"]] == ["reply 0"]
+
+
+def test_visit_of_archived_appointment(client, session, raw_conn):
+    doctor = add_doctor(session)
+    patient = add_patient(session)
+    appointment = add_appointment(session, doctor, patient, day=date.today() - timedelta(days=30))
+    session.add(ActionItem(appointment_id=appointment.id, title="Rest", description="Two days"))
+    session.commit()
+    archive_before(raw_conn, date.today())
+
+    visit = client.get(f"/patients/{patient.id}/visit/{appointment.id}").json()
+    assert visit["appointment"]["archived"] is True
+    assert visit["eta"] is None
+    assert [item["title"] for item in visit["action_items"]] == ["Rest"]
+    assert visit["pending_followups"] == visit["open_escalations"] == []
+
+
+def test_visit_of_another_patient_is_not_found(client, session):
+    doctor = add_doctor(session)
+    owner, other = add_patient(session, "Owner"), add_patient(session, "Other")
+    appointment = add_appointment(session, doctor, owner)
+
+    response = client.get(f"/patients/{other.id}/visit/{appointment.id}")
+    assert response.status_code == 404
+    assert client.get(f"/patients/{owner.id}/visit/999999").status_code == 404
+
+
+def test_visit_runs_a_fixed_number_of_queries(client, session, db):
+    patient = add_patient(session)
+    counts = []
+    # doctores distintos: ninguna de las dos peticiones encuentra la ETA en caché
+    for n in (1, 5):
+        appointment = add_appointment(session, add_doctor(session), patient, day=date.today())
+        _add_extras(session, appointment, n)
+        with _count_statements(db) as statements:
+            visit = client.get(f"/patients/{patient.id}/visit/{appointment.id}").json()
+        assert len(visit["action_items"]) == n
+        counts.append(len(statements))
+
+    # cita + doctor, citas del día para la ETA, follow-ups, escalados y action items
+    assert counts == [5, 5]
@@ -0,0 +1,85 @@
+from datetime import date, datetime, timedelta
+
+from backend.database import sqlite_timestamp
+from backend.migrations import AUTO_VACUUM_INCREMENTAL
+from backend.services.retention import incremental_vacuum, purge_executed_followups
+
+from .factories import add_appointment, add_doctor, add_patient
+
+TODAY = date.today()
+OLD = datetime.combine(TODAY - timedelta(days=400), datetime.min.time()).replace(hour=9)
+RECENT = datetime.combine(TODAY - timedelta(days=2), datetime.min.time()).replace(hour=9)
+CUTOFF = TODAY - timedelta(days=180)
+
+
+def _insert(conn, table: str, appointment_id: int, when: datetime, type: str = "REMINDER",
+            channel: str = "SMS", executed: bool = True, message: str = "hello", count: int = 1) -> None:
+    executed_at = sqlite_timestamp(when) if executed else None
+    conn.executemany(
+        f"INSERT INTO {table} (appointment_id, type, channel, scheduled_time, message,"
+        " executed, executed_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(appointment_id, type, channel, sqlite_timestamp(when), message, int(executed),
+          executed_at, sqlite_timestamp(when))] * count,
+    )
+    conn.commit()
+
+
+def _summaries(conn) -> list[tuple]:
+    return conn.execute(
+        "SELECT day, type, channel, executed FROM followupdaysummary ORDER BY day, type, channel"
+    ).fetchall()
+
+
+def _remaining(conn, table: str) -> list[tuple]:
+    return conn.execute(
+        f"SELECT scheduled_time, executed FROM {table} ORDER BY scheduled_time, executed"
+    ).fetchall()
+
+
+def test_purge_summarizes_old_executed_tasks_once(session, raw_conn):
+    appointment = add_appointment(session, add_doctor(session), add_patient(session))
+    _insert(raw_conn, "followuptask", appointment.id, OLD, count=2)
+    _insert(raw_conn, "followuptask", appointment.id, OLD, type="CHECKIN", channel="EMAIL")
+    _insert(raw_conn, "followuptask_archive", appointment.id, OLD, count=3)
+    _insert(raw_conn, "followuptask_archive", appointment.id, OLD + timedelta(days=1))
+    # se quedan: pendiente antigua y ejecutadas recientes
+    _insert(raw_conn, "followuptask", appointment.id, OLD, executed=False)
+    _insert(raw_conn, "followuptask", appointment.id, RECENT)
+    _insert(raw_conn, "followuptask_archive", appointment.id, RECENT)
+
+    report = purge_executed_followups(raw_conn, CUTOFF, batch_rows=2, pause=0)
+    assert report.rows_deleted == {"followuptask": 3, "followuptask_archive": 4}
+
+    old_day, next_day = OLD.date().isoformat(), (OLD + timedelta(days=1)).date().isoformat()
+    expected = [
+        (old_day, "CHECKIN", "EMAIL", 1),
+        (old_day, "REMINDER", "SMS", 5),
+        (next_day, "REMINDER", "SMS", 1),
+    ]
+    assert _summaries(raw_conn) == expected
+    assert _remaining(raw_conn, "followuptask") == [
+        (sqlite_timestamp(OLD), 0), (sqlite_timestamp(RECENT), 1)
+    ]
+    assert _remaining(raw_conn, "followuptask_archive") == [(sqlite_timestamp(RECENT), 1)]
+
+    # otra pasada no encuentra nada ni vuelve a sumar
+    again = purge_executed_followups(raw_conn, CUTOFF, pause=0)
+    assert again.rows_deleted == {"followuptask": 0, "followuptask_archive": 0}
+    assert _summaries(raw_conn) == expected
+
+
+def test_purge_reclaims_space_with_incremental_vacuum(session, raw_conn):
+    assert raw_conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+    appointment = add_appointment(session, add_doctor(session), add_patient(session))
+    _insert(raw_conn, "followuptask", appointment.id, OLD, message="x" * 500, count=2_000)
+
+    report = purge_executed_followups(raw_conn, CUTOFF, summarize=False, pause=0)
+    assert report.rows_deleted["followuptask"] == 2_000
+    assert report.incremental_vacuum
+    assert report.pages_freed > 0
+    assert report.bytes_reclaimed > 0
+    assert raw_conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    # purge-only: sin recuentos
+    assert _summaries(raw_conn) == []
+    # ya no queda nada por liberar
+    assert incremental_vacuum(raw_conn, pause=0) == 0
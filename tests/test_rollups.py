@@ -0,0 +1,130 @@
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+
+from sqlmodel import select
+
+from backend.models import AppointmentStatus, ArrivalStatus, DoctorDayRollup
+from backend.services.rollups import (
+    OVERFLOW_BUCKET,
+    bucket_bounds,
+    compute_rollups,
+    histogram_quantile,
+    merge_histograms,
+)
+
+from .factories import add_appointment, add_doctor, add_patient
+
+DAY = date(2030, 3, 4)
+
+
+def _visit(session, doctor, at: time, wait: float, visit: float, day: date = DAY, **kwargs):
+    """
+    Cita atendida: llega `wait` minutos antes de empezar y la visita dura `visit`.
+    """
+    start = datetime.combine(day, at)
+    return add_appointment(
+        session, doctor, add_patient(session), day=day, at=at,
+        status=AppointmentStatus.COMPLETED,
+        patient_arrival_time=start - timedelta(minutes=wait),
+        visit_start_time=start,
+        visit_end_time=start + timedelta(minutes=visit),
+        **kwargs,
+    )
+
+
+def _skipped(session, doctor, at: time, arrival: ArrivalStatus):
+    appointment = add_appointment(session, doctor, add_patient(session), day=DAY, at=at,
+                                  status=AppointmentStatus.SKIPPED)
+    appointment.arrival_status = arrival
+    session.add(appointment)
+    session.commit()
+    return appointment
+
+
+def test_bucket_bounds():
+    assert bucket_bounds(0) == (0.0, 1.0)
+    assert bucket_bounds(59) == (59.0, 60.0)
+    assert bucket_bounds(60) == (60.0, 65.0)
+    assert bucket_bounds(OVERFLOW_BUCKET - 1) == (235.0, 240.0)
+    assert bucket_bounds(OVERFLOW_BUCKET) == (240.0, float("inf"))
+
+
+def test_histogram_quantile():
+    assert histogram_quantile(Counter(), 0.5) is None
+
+    histogram = Counter({2: 5, 10: 4, 60: 1})
+    assert histogram_quantile(histogram, 0.5) == 2.5
+    assert histogram_quantile(histogram, 0.9) == 10.5
+    assert histogram_quantile(histogram, 0.99) == 62.5
+    # el de desbordamiento da su límite inferior
+    assert histogram_quantile(Counter({OVERFLOW_BUCKET: 1}), 0.5) == 240.0
+
+    assert merge_histograms(['{"2": 1, "10": 2}', '{"2": 3}']) == Counter({2: 4, 10: 2})
+
+
+def test_counts_and_histogram_buckets(session, raw_conn):
+    doctor = add_doctor(session)
+    _visit(session, doctor, time(9), wait=3.5, visit=15)
+    _visit(session, doctor, time(10), wait=75, visit=300)
+    _skipped(session, doctor, time(11), ArrivalStatus.SKIPPED)
+    # saltada con el paciente en sala: no es no-show
+    _skipped(session, doctor, time(12), ArrivalStatus.ARRIVED)
+    add_appointment(session, doctor, add_patient(session), day=DAY, at=time(13))
+    add_appointment(session, doctor, add_patient(session), day=DAY, at=time(14),
+                    status=AppointmentStatus.CANCELLED)
+
+    assert compute_rollups(raw_conn, DAY, DAY) == 1
+    session.expire_all()
+    rollup = session.exec(select(DoctorDayRollup)).one()
+
+    assert (rollup.total_appointments, rollup.completed, rollup.skipped, rollup.no_shows) == (5, 2, 2, 1)
+    # los saltados no cuentan como minutos reservados (20 por cita)
+    assert rollup.booked_minutes == 60
+    assert (rollup.wait_count, rollup.wait_sum_minutes) == (2, 78.5)
+    assert (rollup.visit_count, rollup.visit_sum_minutes) == (2, 315.0)
+    # 3.5 -> cubo de 1 min [3, 4); 75 -> cubo de 5 min [75, 80); 300 -> desbordamiento
+    assert merge_histograms([rollup.wait_histogram]) == Counter({3: 1, 63: 1})
+    assert merge_histograms([rollup.visit_histogram]) == Counter({15: 1, OVERFLOW_BUCKET: 1})
+
+    # recalcular es un upsert
+    assert compute_rollups(raw_conn, DAY, DAY) == 1
+    assert len(session.exec(select(DoctorDayRollup)).all()) == 1
+
+
+def test_stats_merge_rollups_over_range(client, session, raw_conn):
+    doctor = add_doctor(session)
+    other = add_doctor(session, "Dr. Other")
+    _visit(session, doctor, time(9), wait=4, visit=10)
+    _visit(session, doctor, time(9), wait=8, visit=20, day=DAY + timedelta(days=1))
+    _visit(session, doctor, time(9), wait=50, visit=50, day=DAY + timedelta(days=2))
+    _visit(session, other, time(9), wait=30, visit=30)
+    compute_rollups(raw_conn, DAY, DAY + timedelta(days=2))
+
+    params = {"from": DAY.isoformat(), "to": (DAY + timedelta(days=1)).isoformat()}
+    stats = client.get(f"/doctors/{doctor.id}/stats", params=params).json()
+    assert (stats["days"], stats["total_appointments"], stats["completed"]) == (2, 2, 2)
+    assert stats["wait_minutes"] == {"count": 2, "mean": 6.0, "p50": 4.5, "p90": 8.5, "p99": 8.5}
+    assert stats["visit_minutes"]["mean"] == 15.0
+    assert stats["utilization"] == 30 / 40
+
+    params["to"] = "2030-03-01"
+    assert client.get(f"/doctors/{doctor.id}/stats", params=params).status_code == 400
+    params["to"] = params["from"]
+    assert client.get("/doctors/999999/stats", params=params).status_code == 404
+
+
+def test_day_is_rolled_up_once_nothing_is_left_to_attend(client, session):
+    doctor = add_doctor(session)
+    day = date.today()
+    first = add_appointment(session, doctor, add_patient(session), day=day, at=time(9),
+                            status=AppointmentStatus.IN_PROGRESS, visit_start_time=datetime.utcnow())
+    last = add_appointment(session, doctor, add_patient(session), day=day, at=time(10))
+
+    assert client.post("/doctor/end_visit", json={"appointment_id": first.id}).status_code == 200
+    assert session.exec(select(DoctorDayRollup)).all() == []
+
+    assert client.post("/doctor/skip", json={"appointment_id": last.id}).status_code == 200
+    session.expire_all()
+    rollup = session.exec(select(DoctorDayRollup)).one()
+    assert (rollup.doctor_id, rollup.day) == (doctor.id, day)
+    assert (rollup.completed, rollup.skipped, rollup.no_shows) == (1, 1, 1)
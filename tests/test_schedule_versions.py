@@ -0,0 +1,42 @@
+from datetime import date, time
+
+from sqlmodel import Session, create_engine
+
+from backend.schedule_versions import VersionCache, cached_version
+
+from .factories import add_appointment, add_doctor, add_patient
+
+
+def test_write_through_another_engine_invalidates_cache_and_etag(client, session, db_path):
+    doctor, patient = add_doctor(session), add_patient(session)
+    day = date.today()
+    add_appointment(session, doctor, patient, day=day)
+    params = {"doctor_id": doctor.id, "day": day.isoformat()}
+
+    # otro worker: su propio engine (y pool) sobre el mismo fichero
+    other = create_engine(f"sqlite:///{db_path}")
+    other_cache = VersionCache(db_path)
+    try:
+        before = cached_version(session, doctor.id, day)
+        assert other_cache.get(doctor.id, day) == before
+        etag = client.get("/doctor/schedule", params=params).headers["ETag"]
+        assert client.get("/doctor/schedule", params=params,
+                          headers={"If-None-Match": etag}).status_code == 304
+
+        with Session(other) as other_session:
+            add_appointment(other_session, doctor, patient, day=day, at=time(11))
+
+        # las dos cachés lo ven sin esperar a nada: data_version cambió
+        assert cached_version(session, doctor.id, day) == before + 1
+        assert other_cache.get(doctor.id, day) == before + 1
+        changed = client.get("/doctor/schedule", params=params, headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["ETag"] != etag
+        assert len(changed.json()["rows"]) == 2
+
+        # y al revés: lo escrito por el engine de la app lo ve la otra caché
+        add_appointment(session, doctor, patient, day=day, at=time(12))
+        assert other_cache.get(doctor.id, day) == before + 2
+    finally:
+        other_cache.close()
+        other.dispose()
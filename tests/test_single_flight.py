@@ -0,0 +1,69 @@
+import asyncio
+import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend.services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+    gate = threading.Event()
+
+    def slow():
+        calls.append(1)
+        gate.wait(2)
+        return {"value": 42}
+
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(flight.do, "key", slow) for _ in range(8)]
+        time.sleep(0.1)
+        gate.set()
+        results = [f.result() for f in futures]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.in_flight() == 0
+
+
+def test_exception_is_shared_and_not_cached():
+    flight = SingleFlight()
+
+    def boom():
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        flight.do("key", boom)
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_async_leader_survives_cancellation_and_gc():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return "done"
+
+    async def scenario():
+        leader = asyncio.ensure_future(flight.do_async("key", slow))
+        while not calls:
+            await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(flight.do_async("key", slow))
+        await asyncio.sleep(0)
+        leader.cancel()
+        gc.collect()  # la ejecución en curso sólo la sujeta SingleFlight
+        release.set()
+        result = await follower
+        await asyncio.sleep(0.05)  # que la tarea termine y se suelte
+        return result
+
+    assert asyncio.run(scenario()) == "done"
+    assert len(calls) == 1
+    assert not flight._tasks
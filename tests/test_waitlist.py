@@ -0,0 +1,137 @@
+from datetime import date, datetime, time, timedelta
+
+from sqlmodel import select
+
+from backend.models import (
+    Appointment,
+    AppointmentStatus,
+    FollowUpTask,
+    WaitlistEntry,
+    WaitlistStatus,
+)
+from backend.services import followup_leases
+from backend.services.waitlist import expire_offers
+
+from .factories import add_appointment, add_doctor, add_followup, add_patient
+
+TOMORROW = date.today() + timedelta(days=1)
+
+
+def _join(client, patient, doctor, day=TOMORROW, earliest="08:00", latest="18:00"):
+    response = client.post("/waitlist/", json={
+        "patient_id": patient.id, "doctor_id": doctor.id, "day": day.isoformat(),
+        "earliest": earliest, "latest": latest,
+    })
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def _entry(session, entry_id) -> WaitlistEntry:
+    session.expire_all()
+    return session.get(WaitlistEntry, entry_id)
+
+
+def test_cancel_drops_pending_followups(client, session, raw_conn):
+    doctor, patient = add_doctor(session), add_patient(session)
+    appointment = add_appointment(session, doctor, patient)
+    sent = add_followup(session, appointment, when=datetime.utcnow() - timedelta(hours=1))
+    sent.executed = True
+    session.add(sent)
+    session.commit()
+    add_followup(session, appointment, when=datetime.utcnow() - timedelta(minutes=5))
+
+    assert client.post(f"/appointments/{appointment.id}/cancel").status_code == 200
+    session.expire_all()
+    left = session.exec(select(FollowUpTask).where(FollowUpTask.appointment_id == appointment.id)).all()
+    assert [task.executed for task in left] == [True]
+
+    # una tarea que se cuela después de cancelar no se envía
+    add_followup(session, appointment, when=datetime.utcnow() - timedelta(minutes=1))
+    assert followup_leases.claim_due(raw_conn, "w1") == []
+
+
+def test_freed_slot_goes_to_the_oldest_fitting_entry(client, session):
+    doctor = add_doctor(session)
+    appointment = add_appointment(session, doctor, add_patient(session), at=time(10))
+    narrow = _join(client, add_patient(session, "Narrow"), doctor, earliest="12:00", latest="13:00")
+    first = _join(client, add_patient(session, "First"), doctor)
+    _join(client, add_patient(session, "Second"), doctor)
+
+    response = client.post(f"/appointments/{appointment.id}/cancel").json()
+    assert response["waitlist_entry_id"] == first
+    entry = _entry(session, first)
+    assert entry.status == WaitlistStatus.OFFERED and entry.offered_time == time(10)
+    assert entry.offer_expires_at > datetime.utcnow()
+    assert _entry(session, narrow).status == WaitlistStatus.WAITING
+
+
+def test_slots_already_started_are_not_offered(client, session):
+    doctor = add_doctor(session)
+    # hoy, pero a una hora que ya ha pasado
+    appointment = add_appointment(session, doctor, add_patient(session), day=date.today(), at=time(0))
+    _join(client, add_patient(session), doctor, day=date.today(), earliest="00:00", latest="23:59")
+
+    assert client.post(f"/appointments/{appointment.id}/cancel").json()["waitlist_entry_id"] is None
+
+
+def test_skipping_twice_offers_once(client, session):
+    doctor = add_doctor(session)
+    appointment = add_appointment(session, doctor, add_patient(session))
+    first = _join(client, add_patient(session), doctor)
+    second = _join(client, add_patient(session), doctor)
+
+    assert client.post("/doctor/skip", json={"appointment_id": appointment.id}).json()["waitlist_entry_id"] == first
+    assert client.post("/doctor/skip", json={"appointment_id": appointment.id}).json()["waitlist_entry_id"] is None
+    assert _entry(session, second).status == WaitlistStatus.WAITING
+
+
+def test_expired_offer_moves_to_the_next_entry(client, session):
+    doctor = add_doctor(session)
+    appointment = add_appointment(session, doctor, add_patient(session))
+    first = _join(client, add_patient(session), doctor)
+    second = _join(client, add_patient(session), doctor)
+    client.post(f"/appointments/{appointment.id}/cancel")
+
+    later = datetime.utcnow() + timedelta(days=1)
+    assert [offer.id for offer in expire_offers(session, now=later)] == [second]
+    assert _entry(session, first).status == WaitlistStatus.WAITING
+    assert _entry(session, second).status == WaitlistStatus.OFFERED
+
+    # caducada: ya no se puede aceptar
+    entry = _entry(session, second)
+    entry.offer_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    session.add(entry)
+    session.commit()
+    response = client.post(f"/waitlist/{second}/accept")
+    assert response.status_code == 409
+    assert response.json()["detail"] == "offer has expired"
+
+
+def test_offer_is_accepted_once(client, session):
+    doctor = add_doctor(session)
+    appointment = add_appointment(session, doctor, add_patient(session))
+    entry_id = _join(client, add_patient(session), doctor)
+    client.post(f"/appointments/{appointment.id}/cancel")
+
+    accepted = client.post(f"/waitlist/{entry_id}/accept")
+    assert accepted.status_code == 200
+    assert accepted.json()["status"] == "booked"
+    again = client.post(f"/waitlist/{entry_id}/accept")
+    assert again.status_code == 409
+    booked = session.exec(
+        select(Appointment).where(Appointment.status == AppointmentStatus.SCHEDULED)
+    ).all()
+    assert [a.id for a in booked] == [accepted.json()["appointment_id"]]
+
+
+def test_unavailable_slot_returns_the_entry_to_waiting(client, session):
+    doctor = add_doctor(session)
+    appointment = add_appointment(session, doctor, add_patient(session))
+    entry_id = _join(client, add_patient(session), doctor)
+    client.post(f"/appointments/{appointment.id}/cancel")
+    # alguien reserva el hueco por su cuenta antes de aceptar
+    add_appointment(session, doctor, add_patient(session))
+
+    assert client.post(f"/waitlist/{entry_id}/accept").status_code == 409
+    entry = _entry(session, entry_id)
+    assert entry.status == WaitlistStatus.WAITING and entry.offer_expires_at is None